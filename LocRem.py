@@ -7,7 +7,10 @@ __status__ = "Development"
 """
 
 
-from includes.Server import Server
+from includes.Server import Server, RunDeadlineExceeded
+from includes.DomainRouting import DomainRoutingIndex
+import logging
+import pipes
 import time
 
 
@@ -20,8 +23,8 @@ class LocRem(Server):
         self.logger = server.set_logger(self.logfile, formatter='%(message)s', mode='w')
         self.localdomains_file = server.server_conf.get('LocRem', 'local')
         self.remotedomains_file = server.server_conf.get('LocRem', 'remote')
-        self.ignored_domains = [s.strip(',').strip() for s in
-                                str.split(server.server_conf.get(self.__class__.__name__, 'ignoreDomains'))]
+        self.ignored_domains = set(s.strip(',').strip() for s in
+                                   str.split(server.server_conf.get(self.__class__.__name__, 'ignoreDomains')))
         self.ignored_nameservers = [s.strip(',').strip() for s in
                                     str.split(server.server_conf.get(self.__class__.__name__, 'ignoreNameServers'))]
 
@@ -35,6 +38,10 @@ class LocRem(Server):
 
         # working dictionaries
         self.fixlocrem = {'local': [], 'remote': [], 'second': [], 'check': [], 'remove': []}
+        # domains listed under 'check', for membership checks
+        self.check_domains = set()
+        # local and remote domains, loaded by check_loc_rem()
+        self.routing = None
 
         # data processing
         self.check_loc_rem()
@@ -51,21 +58,20 @@ class LocRem(Server):
         """
         domain_local_ip = self.acc_details[self.domain_users[domain]]['ip']
 
-        a_result = server.resolve(domain, 'A')
-        mx_result = server.resolve(domain, 'MX')
-        ns_result = server.resolve(domain, 'NS')
+        if domain not in self.domain_resolving:
+            self.domain_resolving.update(server.resolve_many([domain], ('A', 'MX', 'NS')))
 
-        self.domain_resolving.setdefault(domain, {'A': a_result})
-        self.domain_resolving[domain]['MX'] = mx_result
-        self.domain_resolving[domain]['NS'] = ns_result
+        a_result = self.domain_resolving[domain]['A']
+        mx_result = self.domain_resolving[domain]['MX']
+        ns_result = self.domain_resolving[domain]['NS']
 
         if ns_result:
             # domain is using ignored nameservers
             ns_domains = list(set(['.'.join(item[0].split('.')[-2:]) for item in ns_result]))
             for ns_domain in ns_domains:
                 if ns_domain in self.ignored_nameservers:
-                    self.fixlocrem['check'].append((domain, "Domain is using ignored name servers, check "
-                                                            "skipped:\n{0}".format(ns_result)))
+                    self.add_check(domain, "Domain is using ignored name servers, check "
+                                           "skipped:\n{0}".format(ns_result))
                     return False
 
         if mx_result:
@@ -73,8 +79,8 @@ class LocRem(Server):
 
             if domain_local_ip in domain_mx_ips:
                 if len(domain_mx_ips) > 1:
-                    self.fixlocrem['check'].append(
-                        (domain, "Multiple MX Entries found, one is pointing to this server\n{0}".format(mx_result)))
+                    self.add_check(domain,
+                                   "Multiple MX Entries found, one is pointing to this server\n{0}".format(mx_result))
                     return False
                 return True
             else:
@@ -89,87 +95,155 @@ class LocRem(Server):
             # domain is not resolving to local vHost IP
             return False
 
+    def add_check(self, domain, message):
+        """
+        Adds domain to the 'check' list, for cases operator has to check
+        """
+        self.fixlocrem['check'].append((domain, message))
+        self.check_domains.add(domain)
+
     def check_loc_rem(self):
         """
         Iterates over the domains and initiates checkResolving method
         :param locrem:
         :return:
         """
-        localdomains = [line.rstrip() for line in open(self.localdomains_file, 'r')]
-        remotedomains = [line.rstrip() for line in open(self.remotedomains_file, 'r')]
+        self.routing = DomainRoutingIndex(self.localdomains_file, self.remotedomains_file)
 
-        for domain in self.domain_list:
-            if '.'.join(domain.split('.')[-2:]) not in self.ignored_domains:
-                resolve_result = self.checkResolving(domain)
+        checked_domains = [domain for domain in self.domain_list
+                           if '.'.join(domain.split('.')[-2:]) not in self.ignored_domains]
+        self.domain_resolving.update(server.resolve_many(checked_domains, ('A', 'MX', 'NS')))
 
-                if resolve_result and domain in remotedomains:
-                    self.fixlocrem['local'].append((domain, "{0:>13} A:{1[A]}\n{0:>13} MX:{1[MX]}\n"
-                                                            "{0:>13} NS:{1[NS]}\n".format(' ', self.domain_resolving[domain])))
-                elif not resolve_result and domain in localdomains and \
-                                domain not in [record[0] for record in self.fixlocrem['check']]:
-                    self.fixlocrem['remote'].append((domain, "{0:>13} A:{1[A]}\n{0:>13} MX:{1[MX]}\n"
-                                                            "{0:>13} NS:{1[NS]}\n".format(' ', self.domain_resolving[domain])))
-                else:
-                    self.logger.info("Domain {0} configured OK".format(domain))
+        for domain in checked_domains:
+            resolve_result = self.checkResolving(domain)
+
+            if resolve_result and self.routing.is_remote(domain):
+                self.fixlocrem['local'].append((domain, "{0:>13} A:{1[A]}\n{0:>13} MX:{1[MX]}\n"
+                                                    "{0:>13} NS:{1[NS]}\n".format(' ', self.domain_resolving[domain])))
+            elif not resolve_result and self.routing.is_local(domain) and domain not in self.check_domains:
+                self.fixlocrem['remote'].append((domain, "{0:>13} A:{1[A]}\n{0:>13} MX:{1[MX]}\n"
+                                                     "{0:>13} NS:{1[NS]}\n".format(' ', self.domain_resolving[domain])))
+            else:
+                self.logger.info("Domain {0} configured OK".format(domain))
 
 
-    def apply_fix(self, locrem, domain, domain_mx):
+    def plan_fixes(self):
         """
+        Groups local and remote fixes by user, so every user is unsuspended and suspended only once
+
+        :return: list of (user, [(locrem, domain, domain_mx)]) sorted by user
         """
-        TEST = server.server_conf.getboolean('Server', 'verbose_dry_run')
+        plan = {}
+        for locrem in ('local', 'remote'):
+            for domain, domain_mx in self.fixlocrem[locrem]:
+                plan.setdefault(self.domain_users[domain], []).append((locrem, domain, domain_mx))
 
-        user = self.domain_users[domain]
+        return sorted(plan.items())
 
-        fixlocrem = "cpapi2 --user={0} Email setmxcheck domain={1} mxcheck={2}".format(user, domain, locrem)
-        unsuspend = "whmapi1 unsuspendacct user=" + user
-        suspend = "whmapi1 suspendacct user=" + user
+    def apply_user_fixes(self, user_fixes):
+        """
+        Applies all fixes of one user. Suspended user is unsuspended once, all setmxcheck changes are applied
+        and the user is suspended again with the original reason, also when the run deadline is exceeded.
+        Runs in a worker thread, log messages are returned and logged in user order by run().
 
-        if user not in self.suspended_users_data.keys():
-            # user not suspended
-            if not TEST:
-                server.exec_cpanel_api_command(fixlocrem)
-                self.logger.info("Domain {0} was moved to {1} \n{2}".format(domain, locrem, domain_mx))
-            else:
-                self.logger.info("DRY RUN: Domain {0} would be moved to {1}"
-                                 "\n {2}".format(domain, locrem, domain_mx))
-        else:
-            if not TEST:
-                self.logger.debug("User {0} suspended, unsuspending for LocRem fix".format(user))
-                server.exec_cpanel_api_command(unsuspend)
-                self.logger.info("Domain {0} was moved to {1} \n{2}".format(domain, locrem, domain_mx))
-                server.exec_cpanel_api_command(fixlocrem)
-                suspend += " reason=" + self.suspended_users_data[user]['reason']
-                server.exec_cpanel_api_command(suspend)
-                self.logger.debug("User %s suspended" % user)
-            else:
-                self.logger.info("DRY RUN: User {0} would be unsuspended and "
-                                 "domain {1} moved to {2}\n{3}".format(user, domain, locrem, domain_mx))
+        :param user_fixes: (user, [(locrem, domain, domain_mx)]), see plan_fixes()
+        :return: (list of (log level, message), True if fixes were stopped by the run deadline)
+        """
+        TEST = server.server_conf.getboolean('Server', 'verbose_dry_run')
+
+        user, fixes = user_fixes
+        suspended = user in self.suspended_users_data
+        messages = []
+
+        if TEST:
+            if suspended:
+                messages.append((logging.INFO, "DRY RUN: User {0} would be unsuspended and suspended again "
+                                               "after {1} fixes".format(user, len(fixes))))
+            for locrem, domain, domain_mx in fixes:
+                messages.append((logging.INFO, "DRY RUN: Domain {0} would be moved to {1}"
+                                               "\n {2}".format(domain, locrem, domain_mx)))
+            return messages, False
+
+        aborted = False
+        try:
+            if suspended:
+                messages.append((logging.DEBUG, "User {0} suspended, unsuspending for LocRem fix".format(user)))
+                server.exec_cpanel_api_command("whmapi1 unsuspendacct user=" + user)
+            try:
+                for locrem, domain, domain_mx in fixes:
+                    server.exec_cpanel_api_command("cpapi2 --user={0} Email setmxcheck domain={1} "
+                                                   "mxcheck={2}".format(user, domain, locrem))
+                    self.routing.set_route(domain, locrem)
+                    messages.append((logging.INFO, "Domain {0} was moved to {1} \n{2}".format(domain, locrem,
+                                                                                                domain_mx)))
+            finally:
+                # runs also when the run deadline stopped the fixes, account must not stay unsuspended
+                if suspended:
+                    messages.append(self.suspend_again(user))
+        except RunDeadlineExceeded, err:
+            messages.append((logging.INFO, "RUN ABORTED for user {0}: {1}".format(user, err)))
+            aborted = True
+
+        return messages, aborted
+
+    def suspend_again(self, user):
+        """
+        Suspends the user unsuspended for the fixes, with the original suspension reason.
+        Suspension is executed also after the run deadline.
+
+        :param user: cPanel username
+        :return: (log level, message)
+        """
+        suspend = "whmapi1 suspendacct user={0} reason={1}".format(
+            user, pipes.quote(self.suspended_users_data[user]['reason']))
+        data = server.api_call(suspend, ignore_deadline=True)
+        try:
+            if int(data['metadata']['result']):
+                return logging.DEBUG, "User %s suspended" % user
+            reason = data['metadata']['reason']
+        except (TypeError, KeyError, ValueError):
+            reason = 'invalid suspendacct output'
+
+        return logging.ERROR, "User {0} was NOT suspended again, suspend it manually: {1}".format(user, reason)
 
     def run(self):
         """
         Executes the steps of the script in order.
-        Iterates over self.fixlocrem dictionary
+        Logs self.fixlocrem check and remove entries, applies local and remote fixes grouped by user
         Reports cases where operator will have to check the situation.
 
         :param self:
         :return:
         """
         length = time.time() - self.start
-        for lr_key, domains in self.fixlocrem.iteritems():
-            if lr_key == 'check' or lr_key == 'remove':
-                for entry in self.fixlocrem[lr_key]:
-                    self.logger.info("{0}: {1}\n{2}".format(lr_key.upper(), entry[0], entry[1]))
-            else:
-                self.logger.info(lr_key.upper())
-                for domain in domains:
-                    self.apply_fix(lr_key, domain[0], domain[1])
+        error = ''
+        for lr_key in ('check', 'remove'):
+            for entry in self.fixlocrem[lr_key]:
+                self.logger.info("{0}: {1}\n{2}".format(lr_key.upper(), entry[0], entry[1]))
+
+        # users are fixed in parallel, messages of every user are logged together, in user order
+        plan = self.plan_fixes()
+        results = server.parallel_map(self.apply_user_fixes, plan, server.api_workers)
+        for (user, fixes), (messages, aborted) in zip(plan, results):
+            self.logger.info("USER {0}".format(user))
+            for level, message in messages:
+                self.logger.log(level, message)
+            if aborted:
+                error = 'ABORTED: '
+
+        if error:
+            self.logger.info("RUN ABORTED: run deadline exceeded, remaining fixes were not applied")
 
         self.logger.info('Program operation took {0}'.format(length))
 
-        server.mail_report(self.__class__.__name__, logfile=self.logfile)
+        server.mail_report(self.__class__.__name__, logfile=self.logfile, error=error)
 
 
 if __name__ == '__main__':
     server = Server()
-    locrem = LocRem()
-    locrem.run()
+    try:
+        locrem = LocRem()
+    except RunDeadlineExceeded, err:
+        server.mail_report('LocRem', content='Run aborted while collecting data: %s' % err, error='ABORTED: ')
+    else:
+        locrem.run()
@@ -5,45 +5,184 @@ __version__ = "0.1"
 __email__ = "emanuel@plus.hr"
 __status__ = "Development"
 
-Report mail disk usage over 500MB
+Report mail disk usage over 500MB ('threshold_mb' in [MAReport] section, or --threshold)
+
+Usage:
+    python MAReport.py [--threshold MB] [--top N] [user ...]
+Without arguments all accounts are checked.
+With --top N (or 'top' in [MAReport] section) N largest mailboxes of all checked accounts are reported instead.
+
+Mailbox sizes are read from maildirsize files in account home directories (/home/<user>/mail/<domain>/<box>),
+Maildir folders are scanned when maildirsize is missing or older than 'stale_hours' (default 24), by a pool of
+'scan_workers' threads (default 8). Accounts without mail directory are checked through the cPanel API.
 """
 
-from includes.Server import Server
-import yaml
+import heapq
+import optparse
+import os
+import pwd
 
-srv = Server()
-oud = srv.get_owners_user_details()
+from includes.MailUsage import account_mailboxes, mailbox_usage
+from includes.Server import Server, RunDeadlineExceeded
 
-def mail_report(user):
-    repl = {'USERNAME': user, 'USER': '', 'DOMAIN': ''}
 
-    report = {user: []}
+def mail_usage(user, userEmails):
+    """
+    Reads disk usage of user mailboxes through the cPanel API, for accounts without mail directory on this server
 
+    Returns:
+        list: (email, usage in MB, 'api') for every mailbox
+    """
+    repl = {'USERNAME': user, 'USER': '', 'DOMAIN': ''}
+
+    commands = []
     for email in userEmails:
         repl['USER'] = email.split('@')[0]
         repl['DOMAIN'] = email.split('@')[1]
 
-        get_acc_disk_usage = reduce(lambda a, kv: a.replace(*kv), repl.iteritems(), srv.GET_MAIL_DISK_USAGE)
+        commands.append(reduce(lambda a, kv: a.replace(*kv), repl.iteritems(), srv.GET_MAIL_DISK_USAGE))
+
+    # disk usage of all user mailboxes is read concurrently
+    usage = []
+    for email, disk_usage in zip(userEmails, srv.api_calls(commands)):
+        usage.append((email, float(disk_usage['result']['data']['diskused']), 'api'))
+
+    return usage
+
+
+def user_home(user, home_dir='/home'):
+    """
+    Returns:
+        str: account home directory, home_dir/user if the user is not in the system password database
+    """
+    try:
+        return pwd.getpwnam(user).pw_dir
+    except KeyError:
+        return os.path.join(home_dir, user)
+
+
+def scan_mailboxes(users, max_age, workers, home_dir='/home'):
+    """
+    Reads disk usage of all mailboxes of all users in one pass, mailboxes are read by a pool of worker threads
+
+    Arguments:
+        users: list of users
+        max_age: maildirsize files older than max_age seconds are not used, mailbox is scanned
+        workers: number of worker threads
+        home_dir: base of home directories of users that are not in the system password database
+
+    Returns:
+        dict: {user: [(email, usage in MB, 'maildirsize' or 'scan')]}, users without mail directory are not included
+    """
+    usages = {}
+    mailboxes = []
+    for user in users:
+        user_mailboxes = account_mailboxes(user_home(user, home_dir))
+        if user_mailboxes is not None:
+            usages[user] = []
+            mailboxes.extend((user, email, path) for email, path in user_mailboxes)
+
+    for (user, email, path), (size, source) in zip(mailboxes, srv.parallel_map(
+            lambda mailbox: mailbox_usage(mailbox[2], max_age), mailboxes, workers)):
+        usages[user].append((email, round(size / 1024.0 / 1024.0, 2), source))
 
-        mail_quota = float(yaml.load(srv.exec_cpanel_api_command(get_acc_disk_usage))['result']['data']['diskused'])
-        if mail_quota >= 500:
-            report[user].append((email, mail_quota))
+    return usages
 
-    if len(report[user]) > 0:
+
+def print_user_usage(user, usage, threshold):
+    """
+    Prints mailboxes of the user with usage over threshold MB
+    """
+    over = [(email, mail_quota) for email, mail_quota, source in usage if mail_quota >= threshold]
+    if over:
         print("{0:>8} {1}".format(' ', user))
-        for item in report[user]:
-            # item = (email, mail_quota)
+        for item in over:
             print("{0:>13} {1[0]:34} {1[1]}MB".format(' ', item))
 
 
-for owner in oud.keys():
-    print owner
-    for user in oud[owner].keys():
-        try:
-            userEmails = yaml.load(srv.exec_cpanel_api_command(srv.GET_USER_MAILS.replace('USER', user)))['data']['pops']
-            cmd = '/scripts/generate_maildirsize --confirm --allaccounts --verbose '+user
-            srv.exec_cpanel_api_command(cmd)
-            mail_report(user)
-        except Exception as error:
-            print('No data returned, check the cPanel username you provided for user {0}'.format(user))
-            print error
+def print_top(usages, top):
+    """
+    Prints top largest mailboxes of all users
+    """
+    largest = heapq.nlargest(top, ((mail_quota, email, user) for user, usage in usages.items()
+                                   for email, mail_quota, source in usage))
+    print("{0:>4} {1:34} {2:16} {3}".format('#', 'MAILBOX', 'USER', 'USAGE'))
+    for rank, (mail_quota, email, user) in enumerate(largest, 1):
+        print("{0:>4} {1:34} {2:16} {3}MB".format(rank, email, user, mail_quota))
+
+
+def print_report(oud, usages, threshold, top):
+    """
+    Prints mailboxes over threshold MB by owner and user, or top largest mailboxes if top is set
+    """
+    if top:
+        print_top(usages, top)
+    else:
+        for owner in oud.keys():
+            print owner
+            for user in oud[owner].keys():
+                print_user_usage(user, usages.get(user, []), threshold)
+
+
+def users_details(users):
+    """
+    Returns:
+        dict: {owner: {user: details}} for the listed users, or for all accounts if users list is empty
+    """
+    if not users:
+        return srv.get_owners_user_details()
+
+    oud = {}
+    for user in users:
+        for owner, owner_users in srv.get_owners_user_details('^%s$' % user, 'user').items():
+            oud.setdefault(owner, {}).update(owner_users)
+
+    return oud
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [--threshold MB] [--top N] [user ...]')
+    parser.add_option('--threshold', type='float', help='report mailboxes using at least this many MB')
+    parser.add_option('--top', type='int', help='report N largest mailboxes instead of mailboxes over threshold')
+    options, args = parser.parse_args()
+
+    srv = Server()
+    threshold = options.threshold
+    if threshold is None:
+        threshold = float(srv.get_conf_value('MAReport', 'threshold_mb', 500))
+    top = options.top
+    if top is None:
+        top = int(srv.get_conf_value('MAReport', 'top', 0))
+
+    # collected usages are kept outside of the try block, so they are reported also when the run is aborted
+    oud = {}
+    usages = {}
+    try:
+        oud = users_details(args)
+        usages.update(scan_mailboxes([user for owner in oud.keys() for user in oud[owner].keys()],
+                                     float(srv.get_conf_value('MAReport', 'stale_hours', 24)) * 3600,
+                                     int(srv.get_conf_value('MAReport', 'scan_workers', 8)),
+                                     srv.get_conf_value('MAReport', 'home_dir', '/home')))
+
+        for owner in oud.keys():
+            for user in oud[owner].keys():
+                if user in usages:
+                    continue
+                # mail directory not found on this server, usage is read through the API
+                try:
+                    userEmails = srv.api_call(srv.GET_USER_MAILS.replace('USER', user))['data']['pops']
+                    cmd = '/scripts/generate_maildirsize --confirm --allaccounts --verbose '+user
+                    srv.exec_cpanel_api_command(cmd)
+                    usages[user] = mail_usage(user, userEmails)
+                except RunDeadlineExceeded:
+                    raise
+                except Exception as error:
+                    print('No data returned, check the cPanel username you provided for user {0}'.format(user))
+                    print error
+
+        print_report(oud, usages, threshold, top)
+    except RunDeadlineExceeded as error:
+        print('RUN ABORTED: {0}, report is not complete'.format(error))
+        print('ABORTED: mailboxes of {0} of {1} users checked'.format(
+            len(usages), sum(len(users) for users in oud.values())))
+        print_report(oud, usages, threshold, top)
@@ -6,7 +6,8 @@ __email__ = "emanuel@plus.hr"
 __status__ = "Development"
 """
 
-from includes.Server import Server
+from includes.Server import Server, RunDeadlineExceeded
+from includes.ReportSpool import ReportSpool
 
 class ResolvingReport(object):
 
@@ -16,23 +17,29 @@ class ResolvingReport(object):
 
         # working dictionaries
         self.domain_data = {}
+        # domains of several users are resolved together, so small accounts don't leave the resolver pool idle
+        self.resolve_chunk = int(server.get_conf_value('ResolvingReport', 'resolve_chunk', 300))
 
-    def domain_resolve(self, domain):
+    def resolve_domains(self, domains):
         """
-        Return domain resolving data
-        :param domain:
+        Resolves list of domains concurrently and stores resolving data for the report
+        :param domains:
         :return:
         """
-        a_result = server.resolve(domain, 'A')
-        mx_result = server.resolve(domain, 'MX')
-        ns_result = server.resolve(domain, 'NS')
+        resolving = server.resolve_many(domains, ('A', 'MX', 'NS'))
 
-        domain_data = {}
-        domain_data.setdefault('resolving', {'A': a_result})
-        domain_data['resolving']['MX'] = mx_result
-        domain_data['resolving']['NS'] = ns_result
+        for domain, records in resolving.iteritems():
+            self.domain_data.setdefault(domain, {})['resolving'] = records
 
-        return domain_data
+    def load_domains_userdata(self, domains):
+        """
+        Loads domain user data (document root, IP) for list of domains from the server domain inventory,
+        API is called only for domains missing from the inventory
+        :param domains:
+        :return:
+        """
+        for domain, userdata in server.get_domains_userdata(domains).iteritems():
+            self.domain_data.setdefault(domain, {})['userdata'] = userdata
 
     def populate_domain_data(self, domain):
         """
@@ -40,94 +47,161 @@ class ResolvingReport(object):
         :param domain:
         :return:
         """
-        self.domain_resolve(domain)
-        domain_data = server.get_domain_data(domain)['data']['userdata']
-
-        self.domain_data[domain] = self.domain_resolve(domain)
+        if 'resolving' not in self.domain_data.get(domain, {}):
+            self.resolve_domains([domain])
+        if 'userdata' not in self.domain_data[domain]:
+            self.load_domains_userdata([domain])
+        domain_data = self.domain_data[domain]['userdata']
 
         if domain in self.domain_data.keys():
             try:
                 self.domain_data[domain]['documentroot'] = domain_data['documentroot']
                 self.domain_data[domain]['ip'] = domain_data['ip']
-            except KeyError:
+            except (KeyError, TypeError):
                 self.domain_data[domain]['documentroot'] = "No domain data found, admin should check"
                 self.domain_data[domain]['ip'] = "No domain data found, admin should check"
 
-    def generate_report(self, owners_users_data):
+    def iter_user_chunks(self, owners_users_data):
         """
-        This method will handle data population for report generation
+        Yields chunks of (owner, user, user_domains, domains) tuples in report order, with resolving and user data
+        of all domains in the chunk loaded. Users are added to a chunk until it has 'resolve_chunk' domains, only
+        data of the current chunk is kept in memory. Owners without users are yielded with None user
+        :param owners_users_data:
         :return:
         """
         domain_types = ['addon_domains', 'parked_domains', 'sub_domains']
 
-        report = ''
-
+        chunk = []
+        chunk_domains = []
         for owner in owners_users_data.keys():
-            report += '\n{0} | {1:>8} | {2:>21} | {3:>28}\n'.format('OWNER', 'USER/DOMAIN', 'IP/MX/NS', 'DOCUMENT ROOT')
-            report += owner
             users = owners_users_data[owner].keys()
             users.sort()
+            if not users:
+                chunk.append((owner, None, None, []))
             for user in users:
                 user_domains = server.get_account_domains(user)
-                domain = user_domains['main_domain']
-
-                self.populate_domain_data(domain)
-                domain_resolving = self.domain_data[domain]['resolving']
-                document_root = self.domain_data[domain]['documentroot']
-                report += '{0:>17}:  LOCAL IP: {1:34}\n'.format(user, owners_users_data[owner][user]['ip'])
-                report += '{0:>13}{1:34} {2:54}\n'.format(' ', domain, document_root)
-                report += '{0:>13}IP: {1}\n'.format(' ', domain_resolving['A'])
-                report += '{0:>13}MX: {1}\n'.format(' ', domain_resolving['MX'])
-                report += '{0:>13}NS: {1}\n\n'.format(' ', domain_resolving['NS'])
-
-                for domain_type in domain_types:
-                    for domain in user_domains[domain_type]:
-                        self.populate_domain_data(domain)
-                        document_root = self.domain_data[domain]['documentroot']
-                        report += '{0:>13}{1:34} {2:54}\n'.format(' ', domain, document_root)
-                        report += '{0:>13}{1}\n'.format(' ', domain_resolving['A'] )
-                        report += '{0:>13}MX: {1}\n'.format(' ', domain_resolving['MX'])
-                        report += '{0:>13}NS: {1}\n\n'.format(' ', domain_resolving['NS'])
-
-        server.mail_report(self.__class__.__name__, content=report)
+                domains = [user_domains['main_domain']] + [d for domain_type in domain_types
+                                                           for d in user_domains[domain_type]]
+                chunk.append((owner, user, user_domains, domains))
+                chunk_domains.extend(domains)
+                if len(chunk_domains) >= self.resolve_chunk:
+                    self.domain_data.clear()
+                    self.resolve_domains(chunk_domains)
+                    self.load_domains_userdata(chunk_domains)
+                    yield chunk
+                    chunk = []
+                    chunk_domains = []
+
+        if chunk:
+            self.domain_data.clear()
+            self.resolve_domains(chunk_domains)
+            self.load_domains_userdata(chunk_domains)
+            yield chunk
 
-    def generate_report_p24(self, owners_users_data):
+    def generate_report(self, owners_users_data):
         """
         This method will handle data population for report generation
         :return:
         """
         domain_types = ['addon_domains', 'parked_domains', 'sub_domains']
 
-        report = ''
+        report = ReportSpool()
+        users_count = 0
+        domains_count = 0
+
+        error = ''
+        try:
+            current_owner = None
+            for chunk in self.iter_user_chunks(owners_users_data):
+                for owner, user, user_domains, domains in chunk:
+                    if owner != current_owner:
+                        report.write('\n{0} | {1:>8} | {2:>21} | {3:>28}\n'.format('OWNER', 'USER/DOMAIN',
+                                                                                       'IP/MX/NS', 'DOCUMENT ROOT'))
+                        report.write(owner)
+                        current_owner = owner
+                    if user is None:
+                        continue
+                    domain = user_domains['main_domain']
+                    users_count += 1
+                    domains_count += len(domains)
+
+                    self.populate_domain_data(domain)
+                    domain_resolving = self.domain_data[domain]['resolving']
+                    document_root = self.domain_data[domain]['documentroot']
+                    report.write('{0:>17}:  LOCAL IP: {1:34}\n'.format(user, owners_users_data[owner][user]['ip']))
+                    report.write('{0:>13}{1:34} {2:54}\n'.format(' ', domain, document_root))
+                    report.write('{0:>13}IP: {1}\n'.format(' ', domain_resolving['A']))
+                    report.write('{0:>13}MX: {1}\n'.format(' ', domain_resolving['MX']))
+                    report.write('{0:>13}NS: {1}\n\n'.format(' ', domain_resolving['NS']))
+
+                    for domain_type in domain_types:
+                        for domain in user_domains[domain_type]:
+                            self.populate_domain_data(domain)
+                            domain_resolving = self.domain_data[domain]['resolving']
+                            document_root = self.domain_data[domain]['documentroot']
+                            report.write('{0:>13}{1:34} {2:54}\n'.format(' ', domain, document_root))
+                            report.write('{0:>13}{1}\n'.format(' ', domain_resolving['A'] ))
+                            report.write('{0:>13}MX: {1}\n'.format(' ', domain_resolving['MX']))
+                            report.write('{0:>13}NS: {1}\n\n'.format(' ', domain_resolving['NS']))
+        except RunDeadlineExceeded, err:
+            report.write('\n\nRUN ABORTED: %s, report is not complete\n' % err)
+            error = 'ABORTED: '
+
+        report.add_summary('Owners: %s, users: %s, domains: %s' % (len(owners_users_data), users_count,
+                                                                   domains_count))
+        server.mail_report(self.__class__.__name__, spool=report, error=error)
 
-        for owner in owners_users_data.keys():
-            report += '\nOWNER, USER/DOMAIN, IP/MX/NS, DOCUMENT ROOT\n'
-            report += owner
-            users = owners_users_data[owner].keys()
-            users.sort()
-            for user in users:
-                user_domains = server.get_account_domains(user)
-                domain = user_domains['main_domain']
-
-                self.populate_domain_data(domain)
-                domain_resolving = self.domain_data[domain]['resolving']
-                document_root = self.domain_data[domain]['documentroot']
-                report += '%17s:  LOCAL IP: %34s\n' % (user, owners_users_data[owner][user]['ip'])
-                report += '%13s, %34s %54s\n' % (' ', domain, document_root)
-                report += '%13s IP: %s\n' % (' ', domain_resolving['A'])
-                report += '%13s MX: %s\n' % (' ', domain_resolving['MX'])
-                report += '%13s NS: %s\n\n' % (' ', domain_resolving['NS'])
-
-                for domain_type in domain_types:
-                    for domain in user_domains[domain_type]:
-                        self.populate_domain_data(domain)
-                        document_root = self.domain_data[domain]['documentroot']
-                        report += '%13s, %34s %54s\n' % (' ', domain, document_root)
-                        report += '%13s IP: %s\n' % (' ', domain_resolving['A'])
-                        report += '%13s MX: %s\n' % (' ', domain_resolving['MX'])
-                        report += '%13s NS: %s\n\n' % (' ', domain_resolving['NS'])
-
-        server.mail_report(self.__class__.__name__, content=report)
+    def generate_report_p24(self, owners_users_data):
+        """
+        This method will handle data population for report generation
+        :return:
+        """
+        domain_types = ['addon_domains', 'parked_domains', 'sub_domains']
+
+        report = ReportSpool()
+        users_count = 0
+        domains_count = 0
+
+        error = ''
+        try:
+            current_owner = None
+            for chunk in self.iter_user_chunks(owners_users_data):
+                for owner, user, user_domains, domains in chunk:
+                    if owner != current_owner:
+                        report.write('\nOWNER, USER/DOMAIN, IP/MX/NS, DOCUMENT ROOT\n')
+                        report.write(owner)
+                        current_owner = owner
+                    if user is None:
+                        continue
+                    domain = user_domains['main_domain']
+                    users_count += 1
+                    domains_count += len(domains)
+
+                    self.populate_domain_data(domain)
+                    domain_resolving = self.domain_data[domain]['resolving']
+                    document_root = self.domain_data[domain]['documentroot']
+                    report.write('%17s:  LOCAL IP: %34s\n' % (user, owners_users_data[owner][user]['ip']))
+                    report.write('%13s, %34s %54s\n' % (' ', domain, document_root))
+                    report.write('%13s IP: %s\n' % (' ', domain_resolving['A']))
+                    report.write('%13s MX: %s\n' % (' ', domain_resolving['MX']))
+                    report.write('%13s NS: %s\n\n' % (' ', domain_resolving['NS']))
+
+                    for domain_type in domain_types:
+                        for domain in user_domains[domain_type]:
+                            self.populate_domain_data(domain)
+                            domain_resolving = self.domain_data[domain]['resolving']
+                            document_root = self.domain_data[domain]['documentroot']
+                            report.write('%13s, %34s %54s\n' % (' ', domain, document_root))
+                            report.write('%13s IP: %s\n' % (' ', domain_resolving['A']))
+                            report.write('%13s MX: %s\n' % (' ', domain_resolving['MX']))
+                            report.write('%13s NS: %s\n\n' % (' ', domain_resolving['NS']))
+        except RunDeadlineExceeded, err:
+            report.write('\n\nRUN ABORTED: %s, report is not complete\n' % err)
+            error = 'ABORTED: '
+
+        report.add_summary('Owners: %s, users: %s, domains: %s' % (len(owners_users_data), users_count,
+                                                                   domains_count))
+        server.mail_report(self.__class__.__name__, spool=report, error=error)
 
     def define_search_type(self, owner='', user=''):
         #rijesiti ovaj condition kroz naziv varijable argumenta i njegovu vrijednost
@@ -6,29 +6,48 @@ __email__ = "emanuel@plus.hr"
 __status__ = "Development"
 """
 
-from includes.Server import Server
+from includes.Server import Server, RunDeadlineExceeded
+import calendar
 import datetime
 
-try:
-    # 'Importing netaddr for python 2.4'
-    from netaddr import IP
-    from netaddr import CIDR
-except:
-    # Importing netaddr for python > 2.4
-    from netaddr import IPAddress as IP
-    from netaddr import IPNetwork as CIDR
+
+def project_bw_limits(totalbytes, day_of_month, days_in_month, headroom):
+    """
+    Computes new bandwidth limits for all accounts at once: usage so far is projected to the end of the month
+    and increased by headroom. Computed as one array operation when numpy is installed.
+
+    Arguments:
+        totalbytes: list of bandwidth used this month, in bytes
+        day_of_month: current day of the month
+        days_in_month: number of days in the current month
+        headroom: projected usage multiplier
+
+    Returns:
+        list: new limits in MB (int), in the same order as totalbytes
+    """
+    factor = float(days_in_month) / day_of_month * headroom / 1024 / 1024
+    try:
+        import numpy
+    except ImportError:
+        return [int(float(used) * factor) for used in totalbytes]
+
+    return (numpy.array(totalbytes, dtype=numpy.float64) * factor).astype(numpy.int64).tolist()
 
 
 class SATerminator(object):
 
     def __init__(self):
         # configuration parameters
-        self.ns_ipranges = [s.strip() for s in server.server_conf.get('Server', 'ns_ipranges').split(',')]
         self.ignoreDomains = [s.strip() for s in server.server_conf.get('SATerminator', 'ignoreDomains').split(',')]
         self.period_moved = float(server.server_conf.get('SATerminator', 'term_period_moved'))
         self.period_expired = float(server.server_conf.get('SATerminator', 'term_period_expired'))
         self.terminate_owners = [s.strip() for s in
                                  server.server_conf.get('SATerminator', 'default_owners_to_terminate').split(',')]
+        # termination decisions are made on resolving results, cached DNS answers older than this are not used
+        self.dns_max_age = float(server.get_conf_value('SATerminator', 'dns_max_age', 0))
+        # new bandwidth limit is projected month-end usage multiplied by bw_headroom, default 40/30 gives the
+        # former 40/day_of_month limit in 30 day months
+        self.bw_headroom = float(server.get_conf_value('SATerminator', 'bw_headroom', 40 / 30.0))
 
         self.logfile = server.server_conf.get(self.__class__.__name__, 'logfile')
         self.logger = server.set_logger(self.logfile, formatter='%(message)s', mode='w')
@@ -54,22 +73,22 @@ class SATerminator(object):
                     user_domains = domains['addon_domains']+domains['parked_domains']
                     user_domains.append(domains['main_domain'])
                     self.suspended_users_data[user]['domains'] = user_domains
-
-                    for domain in user_domains:
-                        ns = server.resolve(domain, 'NS')
-                        a = server.resolve(domain, 'A')
-                        mx = server.resolve(domain, 'MX')
-                        if ns:
-                            ns_records = sorted(ns, key=lambda ns_rec: ns_rec[0])
-                        else:
-                            ns_records = False
-
-                        self.domains.setdefault(domain, {})['NS'] = ns_records
-                        self.domains[domain]['A'] = a
-                        self.domains[domain]['MX'] = mx
+                    self.domains.update(dict((domain, {}) for domain in user_domains))
             else:
                 self.suspended_users_data.pop(user)
 
+        resolving = server.resolve_many(self.domains.keys(), ('NS', 'A', 'MX'), max_age=self.dns_max_age)
+        for domain in self.domains.keys():
+            ns = resolving[domain]['NS']
+            if ns:
+                ns_records = sorted(ns, key=lambda ns_rec: ns_rec[0])
+            else:
+                ns_records = False
+
+            self.domains[domain]['NS'] = ns_records
+            self.domains[domain]['A'] = resolving[domain]['A']
+            self.domains[domain]['MX'] = resolving[domain]['MX']
+
     def check_terminate_details(self, user):
         """
         Checks for the conditions for termination.
@@ -82,18 +101,36 @@ class SATerminator(object):
         """
         user_details = self.suspended_users_data[user]
         if 'Bandwidth Limit Exceeded' in user_details['reason']:
-            # set new bandwith limit for the user
-            bw_data = server.get_bw_data('user', user)[0]
-            day_of_month = float(datetime.datetime.today().day)
-            new_bw_limit = int(float(bw_data['totalbytes'])/1024/1024 * 40/day_of_month)
-            response = server.set_bw_limit(user, new_bw_limit)
-            self.logger.info('User %s: %s}' % (user, response))
+            # bandwith limit was raised by raise_bw_limits()
             return False
         elif user_details['reason'] != 'Unknown':
             return user_details['suspendperiod'] > self.period_moved
         else:
             return user_details['suspendperiod'] > self.period_expired
 
+    def raise_bw_limits(self):
+        """
+        Raises bandwidth limits of all accounts suspended for exceeding it, based on one showbw snapshot
+        of the whole server. Limits are set with concurrent limitbw calls.
+        """
+        users = sorted(user for user, details in self.suspended_users_data.items()
+                       if 'Bandwidth Limit Exceeded' in details['reason'])
+        if not users:
+            return
+
+        bw_data = server.get_bw_snapshot()
+        for user in users:
+            if user not in bw_data:
+                self.logger.info('User %s: no bandwidth data found, limit not changed' % user)
+        users = [user for user in users if user in bw_data]
+
+        today = datetime.datetime.today()
+        limits = project_bw_limits([bw_data[user]['totalbytes'] for user in users], today.day,
+                                   calendar.monthrange(today.year, today.month)[1], self.bw_headroom)
+
+        for user, response in zip(users, server.set_bw_limits(zip(users, limits))):
+            self.logger.info('User %s: %s' % (user, response))
+
     def compare_resolving(self, user):
         """
         Method is checking if the domain is using any nameservers on our nameservers IP ranges
@@ -101,13 +138,11 @@ class SATerminator(object):
         """
         ns_ip_resolve = 0
         for domain in self.suspended_users_data[user]['domains']:
-            if not ns_ip_resolve and '.'.join(domain.split('.')[-2:]) not in self.ignoreDomains:
-                # while no domain is resolving via our name servers and domain is not listed in ignored domains
-                dom_res_ns = self.domains[domain]['NS']
-                if dom_res_ns:
-                    if [net for net in self.ns_ipranges for ns in dom_res_ns if IP(ns[1]) in CIDR(net)]:
-                        # condition will be true if server NS entry resolves to Nameserver IP ranges
-                        ns_ip_resolve = 1
+            if '.'.join(domain.split('.')[-2:]) not in self.ignoreDomains:
+                # stop at the first domain resolving via our name servers, ignored domains are skipped
+                if server.uses_our_nameservers(self.domains[domain]['NS']):
+                    ns_ip_resolve = 1
+                    break
 
         terminate = self.check_terminate_details(user)
         if terminate:
@@ -148,20 +183,29 @@ class SATerminator(object):
                     else:
                         self.logger.info("%8s DRY RUN: Command %s" % (' ', terminate_command))
 
-
-        server.mail_report(self.__class__.__name__, logfile=self.logfile)
-
     def run(self):
-        self.resolve_suspended(self.terminate_owners)
+        error = ''
+        try:
+            self.resolve_suspended(self.terminate_owners)
+            self.raise_bw_limits()
 
-        for user in self.suspended_users_data.keys():
-            self.compare_resolving(user)
+            for user in self.suspended_users_data.keys():
+                self.compare_resolving(user)
+
+            self.terminator()
+        except RunDeadlineExceeded, err:
+            self.logger.info("RUN ABORTED: %s, remaining accounts were not processed" % err)
+            error = 'ABORTED: '
 
-        self.terminator()
+        server.mail_report(self.__class__.__name__, logfile=self.logfile, error=error)
 
 
 if __name__ == '__main__':
     server = Server()
 
-    sa_terminator = SATerminator()
-    sa_terminator.run()
+    try:
+        sa_terminator = SATerminator()
+    except RunDeadlineExceeded, err:
+        server.mail_report('SATerminator', content='Run aborted while collecting data: %s' % err, error='ABORTED: ')
+    else:
+        sa_terminator.run()
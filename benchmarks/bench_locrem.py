@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+LocRem.check_loc_rem() classification pass on a synthetic server, default 100000 domains, without API calls or
+DNS queries: resolving answers are generated in advance and returned by a stand-in for Server.resolve_many().
+
+Compared with the list based lookups check_loc_rem() used before DomainRoutingIndex ('domain in remotedomains'
+on lists and the 'check' domain list rebuilt for every domain), measured on --reference-size domains because
+the list based pass grows quadratically.
+
+Usage:
+    python benchmarks/bench_locrem.py [--size 100000] [--reference-size 10000]
+"""
+
+import logging
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+import LocRem
+
+LOCAL_IP = '10.0.0.1'
+OUR_NS = [('ns1.example-hosting.com', '10.0.53.1'), ('ns2.example-hosting.com', '10.0.53.2')]
+EXTERNAL_NS = [('ns1.external-dns.net', '192.0.2.53')]
+
+
+class ResolvingServer(object):
+    """
+    Server stand-in answering resolve_many() from generated resolving data
+    """
+
+    def __init__(self, resolving):
+        self.resolving = resolving
+
+    def resolve_many(self, domains, rdtypes):
+        return dict((domain, self.resolving[domain]) for domain in domains)
+
+
+def generate(size, seed=0):
+    """
+    Returns:
+        tuple: (domains, resolving {domain: {'A', 'MX', 'NS'}}, localdomains, remotedomains)
+    """
+    rnd = random.Random(seed)
+    domains = ['domain%d.com' % i for i in range(size)]
+    resolving = {}
+    localdomains, remotedomains = [], []
+    for domain in domains:
+        kind = rnd.random()
+        if kind < 0.6:
+            resolving[domain] = {'A': [LOCAL_IP], 'MX': [('mail.' + domain, [LOCAL_IP])], 'NS': OUR_NS}
+        elif kind < 0.65:
+            resolving[domain] = {'A': [LOCAL_IP], 'MX': [('mail.' + domain, [LOCAL_IP]),
+                                                        ('mx.external-mail.net', ['192.0.2.25'])], 'NS': OUR_NS}
+        else:
+            resolving[domain] = {'A': ['192.0.2.10'], 'MX': [('mx.external-mail.net', ['192.0.2.25'])],
+                                 'NS': EXTERNAL_NS}
+        # about 10% of the domains are listed under the wrong route
+        if rnd.random() < 0.9:
+            (kind < 0.65 and localdomains or remotedomains).append(domain)
+        else:
+            (kind < 0.65 and remotedomains or localdomains).append(domain)
+
+    return domains, resolving, localdomains, remotedomains
+
+
+def make_locrem(domains, resolving, workdir, localdomains, remotedomains):
+    """
+    Returns LocRem instance with the state LocRem.__init__() would load, without Server API calls
+    """
+    for name, route_domains in (('localdomains', localdomains), ('remotedomains', remotedomains)):
+        f = open(os.path.join(workdir, name), 'w')
+        f.write(''.join('%s\n' % domain for domain in route_domains))
+        f.close()
+
+    LocRem.server = ResolvingServer(resolving)
+    locrem = LocRem.LocRem.__new__(LocRem.LocRem)
+    locrem.logger = logging.getLogger('bench_locrem')
+    locrem.logger.addHandler(logging.NullHandler())
+    locrem.logger.propagate = False
+    locrem.localdomains_file = os.path.join(workdir, 'localdomains')
+    locrem.remotedomains_file = os.path.join(workdir, 'remotedomains')
+    locrem.ignored_domains = set()
+    locrem.ignored_nameservers = []
+    locrem.acc_details = {'user': {'ip': LOCAL_IP}}
+    locrem.domain_users = dict((domain, 'user') for domain in domains)
+    locrem.domain_list = domains
+    locrem.domain_resolving = {}
+    locrem.fixlocrem = {'local': [], 'remote': [], 'second': [], 'check': [], 'remove': []}
+    locrem.check_domains = set()
+    locrem.routing = None
+
+    return locrem
+
+
+def list_lookups(locrem):
+    """
+    Classification with the list based lookups check_loc_rem() used before DomainRoutingIndex
+    """
+    localdomains = [line.rstrip() for line in open(locrem.localdomains_file, 'r')]
+    remotedomains = [line.rstrip() for line in open(locrem.remotedomains_file, 'r')]
+    locrem.domain_resolving.update(LocRem.server.resolve_many(locrem.domain_list, ('A', 'MX', 'NS')))
+
+    for domain in locrem.domain_list:
+        resolve_result = locrem.checkResolving(domain)
+        if resolve_result and domain in remotedomains:
+            locrem.fixlocrem['local'].append((domain, ''))
+        elif not resolve_result and domain in localdomains and \
+                domain not in [record[0] for record in locrem.fixlocrem['check']]:
+            locrem.fixlocrem['remote'].append((domain, ''))
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=100000)
+    parser.add_option('--reference-size', type='int', default=10000,
+                      help='number of domains for the list based reference, 0 to skip it')
+    options, args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cpaneltools-bench-')
+    try:
+        print '%-32s %8s %10s %8s %8s %8s' % ('PASS', 'DOMAINS', 'SECONDS', 'LOCAL', 'REMOTE', 'CHECK')
+        runs = [('check_loc_rem (routing index)', options.size, lambda locrem: locrem.check_loc_rem())]
+        if options.reference_size:
+            runs.append(('check_loc_rem (routing index)', options.reference_size,
+                         lambda locrem: locrem.check_loc_rem()))
+            runs.append(('list lookups (reference)', options.reference_size, list_lookups))
+
+        for name, size, run in runs:
+            domains, resolving, localdomains, remotedomains = generate(size)
+            locrem = make_locrem(domains, resolving, workdir, localdomains, remotedomains)
+            seconds = timed(run, locrem)
+            print '%-32s %8d %10.3f %8d %8d %8d' % (name, size, seconds, len(locrem.fixlocrem['local']),
+                                                    len(locrem.fixlocrem['remote']), len(locrem.fixlocrem['check']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
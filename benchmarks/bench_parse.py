@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Compares parse time and peak memory of YAML and JSON cPanel API output for large listaccts and dumpzone
+fixtures. Every parser runs in its own process, so peak RSS of one parser doesn't hide the other.
+
+Usage:
+    python benchmarks/bench_parse.py [--accounts 3000] [--records 20000] [--repeat 3]
+"""
+
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from fakecpanel import FakeCPanel
+
+
+def parsers():
+    """
+    Returns:
+        dict: {parser name: function decoding text}
+    """
+    available = {
+        'yaml.load': lambda text: yaml.load(text.replace('\t', ''), Loader=yaml.Loader),
+        'json.loads': json.loads,
+    }
+    if hasattr(yaml, 'CLoader'):
+        available['yaml.load (CLoader)'] = lambda text: yaml.load(text.replace('\t', ''), Loader=yaml.CLoader)
+
+    return available
+
+
+def build_fixtures(accounts, records, directory):
+    """
+    Writes listaccts and dumpzone output in YAML and JSON format
+
+    Returns:
+        list: [(fixture name, format, path)]
+    """
+    cpanel = FakeCPanel(accounts=accounts)
+    listaccts = cpanel.whmapi1_listaccts({})
+
+    zone = cpanel.zones[cpanel.accounts['user0']['domain']]
+    template = [record for record in zone if record['type'] in ('A', 'CNAME', 'TXT', 'MX')]
+    large_zone = []
+    for i in range(records):
+        record = dict(template[i % len(template)])
+        record['name'] = 'host%d.%s' % (i, record['name'])
+        large_zone.append(record)
+    FakeCPanel._number(large_zone)
+    dumpzone = {'data': {'zone': [{'record': large_zone}]},
+                'metadata': {'command': 'dumpzone', 'reason': 'OK', 'result': 1, 'version': 1}}
+
+    fixtures = []
+    for name, data in (('listaccts', listaccts), ('dumpzone', dumpzone)):
+        for fmt, dump in (('yaml', lambda d: yaml.safe_dump(d, default_flow_style=False)), ('json', json.dumps)):
+            path = os.path.join(directory, '%s.%s' % (name, fmt))
+            f = open(path, 'w')
+            f.write(dump(data))
+            f.close()
+            fixtures.append((name, fmt, path))
+
+    return fixtures
+
+
+def child(parser_name, path, repeat):
+    """
+    Parses fixture repeat times and prints best time and peak RSS growth as JSON
+    """
+    parse = parsers()[parser_name]
+    f = open(path)
+    text = f.read()
+    f.close()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        data = parse(text)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        del data
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print json.dumps({'seconds': best, 'peak_rss_kb': rss_after - rss_before})
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--accounts', type='int', default=3000)
+    parser.add_option('--records', type='int', default=20000)
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--child', nargs=2)
+    options, args = parser.parse_args()
+
+    if options.child:
+        return child(options.child[0], options.child[1], options.repeat)
+
+    directory = tempfile.mkdtemp(prefix='bench_parse')
+    print '%-10s %-20s %10s %12s %14s' % ('FIXTURE', 'PARSER', 'SIZE (KB)', 'TIME (s)', 'PEAK RSS (KB)')
+    for name, fmt, path in build_fixtures(options.accounts, options.records, directory):
+        for parser_name in sorted(parsers()):
+            if not parser_name.startswith(fmt):
+                continue
+            out = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--repeat', str(options.repeat),
+                                    '--child', parser_name, path], stdout=subprocess.PIPE).communicate()[0]
+            result = json.loads(out)
+            print '%-10s %-20s %10d %12.3f %14d' % (name, parser_name, os.path.getsize(path) / 1024,
+                                                     result['seconds'], result['peak_rss_kb'])
+        os.unlink(path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
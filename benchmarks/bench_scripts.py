@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+End to end benchmark of LocRem, SATerminator, dnsFix and ResolvingReport on synthetic servers, without
+a cPanel server or network access.
+
+For every size a FakeCPanel server is generated and served by:
+    - FakeWHMServer, reached through fake whmapi1/uapi/cpapi2 tools in benchmarks/bin (subprocess transport)
+      or directly (--transport http)
+    - StubDNSServer, answering DNS queries for all generated zones with configurable latency
+
+Every script runs in its own process (run_script.py) inside a temporary directory with generated
+includes/Server.conf. Wall time, peak RSS and API calls per function are appended as JSON lines to the
+results file, together with git revision, so results can be compared between versions.
+
+Usage:
+    python benchmarks/bench_scripts.py [--sizes 100,5000,50000] [--latency 0.005] [--transport subprocess]
+                                       [--scripts LocRem,SATerminator,dnsFix,ResolvingReport]
+                                       [--output benchmarks/results.jsonl] [--zone-files]
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_whm import FakeWHMServer
+from fakecpanel import FakeCPanel
+from stub_dns import StubDNSServer
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(BENCHMARKS)
+SCRIPTS = ('LocRem', 'SATerminator', 'dnsFix', 'ResolvingReport')
+TOKEN = 'BENCHMARKTOKEN'
+
+SERVER_CONF = """[Server]
+logfile = %(workdir)s/server.log
+reportMail = root@localhost
+send_report_mail =
+verbose_dry_run = 1
+timing = 1
+ns_ipranges = 10.0.53.0/24
+userdatadomains = %(workdir)s/userdatadomains
+trueuserowners = %(workdir)s/trueuserowners
+suspended_dir = %(workdir)s/suspended
+trueuserdomains = %(workdir)s/trueuserdomains
+users_dir = %(workdir)s/users
+resellers = %(workdir)s/resellers
+inventory_file = %(workdir)s/inventory
+dns_nameservers = 127.0.0.1
+dns_port = %(dns_port)s
+api_transport = %(transport)s
+api_scheme = http
+api_host = 127.0.0.1
+api_port = %(whm_port)s
+api_token = %(token)s
+
+[LocRem]
+logfile = %(workdir)s/locrem.log
+local = %(workdir)s/localdomains
+remote = %(workdir)s/remotedomains
+ignoreDomains =
+ignoreNameServers =
+
+[SATerminator]
+logfile = %(workdir)s/saterminator.log
+ignoreDomains =
+term_period_moved = 30
+term_period_expired = 90
+default_owners_to_terminate = %(owners)s
+
+[dnsFix]
+ignoreDomains =
+spf_include = include:spf.example-hosting.com
+state_file = %(workdir)s/dnsFix.state
+zone_dir = %(zone_dir)s
+serial_dir = %(serial_dir)s
+"""
+
+
+def git_revision():
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process.communicate()[0].strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def prepare_workdir(cpanel, whm_port, dns_port, transport, zone_files=False):
+    """
+    Creates temporary working directory with Server.conf and server files the scripts read
+
+    Returns:
+        str: working directory path
+    """
+    workdir = tempfile.mkdtemp(prefix='cpaneltools-bench-')
+    os.mkdir(os.path.join(workdir, 'includes'))
+
+    # zone files are kept up to date by FakeCPanel, dnsFix reads serials of unchanged zones from them,
+    # and with zone_files all zones instead of dumping them
+    serial_dir = os.path.join(workdir, 'named')
+    os.mkdir(serial_dir)
+    cpanel.write_zone_files(serial_dir)
+    zone_dir = zone_files and serial_dir or ''
+
+    f = open(os.path.join(workdir, 'includes', 'Server.conf'), 'w')
+    f.write(SERVER_CONF % {'workdir': workdir, 'whm_port': whm_port, 'dns_port': dns_port, 'token': TOKEN,
+                           'transport': transport, 'owners': ', '.join(cpanel.resellers), 'zone_dir': zone_dir,
+                           'serial_dir': serial_dir})
+    f.close()
+
+    f = open(os.path.join(workdir, 'userdatadomains'), 'w')
+    f.write(cpanel.userdatadomains())
+    f.close()
+
+    f = open(os.path.join(workdir, 'trueuserowners'), 'w')
+    f.write(cpanel.trueuserowners())
+    f.close()
+    os.mkdir(os.path.join(workdir, 'suspended'))
+    cpanel.write_suspended_files(os.path.join(workdir, 'suspended'))
+
+    f = open(os.path.join(workdir, 'localdomains'), 'w')
+    f.write(''.join('%s\n' % domain for domain in sorted(cpanel.zones)))
+    f.close()
+    open(os.path.join(workdir, 'remotedomains'), 'w').close()
+
+    return workdir
+
+
+def run_script(script, workdir, env, args=()):
+    """
+    Returns:
+        dict: run_script.py result (status, wall, maxrss_kb)
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'run_script.py'),
+                                os.path.join(REPOSITORY, script + '.py')] + list(args),
+                               cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+
+    f = open(os.path.join(workdir, script + '.out'), 'w')
+    f.write(out + err)
+    f.close()
+
+    lines = out.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {'script': script + '.py', 'status': process.returncode, 'wall': None, 'maxrss_kb': None,
+                'error': err.strip().splitlines()[-1:]}
+
+
+def bench_size(domains, options, revision):
+    """
+    Runs all scripts against a synthetic server with about 'domains' domains (4 domains per account)
+
+    Returns:
+        list: result dicts
+    """
+    cpanel = FakeCPanel(accounts=max(1, domains / 4), domains_per_account=3)
+    whm = FakeWHMServer(('127.0.0.1', 0), cpanel, TOKEN)
+    whm.start()
+    stub = StubDNSServer(('127.0.0.1', 0), cpanel, latency=options.latency)
+    stub.start()
+
+    workdir = prepare_workdir(cpanel, whm.server_address[1], stub.server_address[1], options.transport,
+                              options.zone_files)
+    env = dict(os.environ)
+    # fake tools run with 'python' from PATH, the interpreter running the benchmark is found first
+    env['PATH'] = os.pathsep.join([os.path.join(BENCHMARKS, 'bin'), os.path.dirname(sys.executable),
+                                   env.get('PATH', '')])
+    env['FAKE_WHM_PORT'] = str(whm.server_address[1])
+    env['FAKE_WHM_TOKEN'] = TOKEN
+
+    results = []
+    try:
+        for script in options.scripts.split(','):
+            calls_before = dict(whm.calls)
+            queries_before = dict(stub.queries)
+
+            result = run_script(script, workdir, env)
+            result.update({
+                'revision': revision,
+                'time': int(time.time()),
+                'domains': len(cpanel.domain_records()),
+                'accounts': len(cpanel.accounts),
+                'transport': options.transport,
+                'zone_files': bool(options.zone_files),
+                'dns_latency': options.latency,
+                'api_calls': dict((call, count - calls_before.get(call, 0)) for call, count in whm.calls.items()
+                                  if count != calls_before.get(call, 0)),
+                'dns_queries': dict((rdtype, count - queries_before.get(rdtype, 0))
+                                    for rdtype, count in stub.queries.items()
+                                    if count != queries_before.get(rdtype, 0)),
+            })
+            results.append(result)
+    finally:
+        whm.shutdown()
+        stub.shutdown()
+        if options.keep:
+            print 'Working directory kept in %s' % workdir
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def print_results(results):
+    print '%-20s %8s %10s %10s %10s %10s' % ('SCRIPT', 'DOMAINS', 'WALL', 'RSS_MB', 'API_CALLS', 'DNS')
+    for result in results:
+        wall = result['wall'] is not None and '%10.2f' % result['wall'] or '%10s' % 'FAILED'
+        rss = result['maxrss_kb'] is not None and '%10.1f' % (result['maxrss_kb'] / 1024.0) or '%10s' % '-'
+        print '%-20s %8d %s %s %10d %10d' % (result['script'], result['domains'], wall, rss,
+                                            sum(result['api_calls'].values()), sum(result['dns_queries'].values()))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='100,5000,50000', help='comma separated numbers of domains')
+    parser.add_option('--latency', type='float', default=0.005, help='DNS answer latency in seconds')
+    parser.add_option('--transport', default='subprocess', choices=['subprocess', 'http'])
+    parser.add_option('--scripts', default=','.join(SCRIPTS))
+    parser.add_option('--output', default=os.path.join(BENCHMARKS, 'results.jsonl'))
+    parser.add_option('--zone-files', action='store_true', help='dnsFix reads zones from generated zone files')
+    parser.add_option('--keep', action='store_true', help='keep working directories with logs and script output')
+    options, args = parser.parse_args()
+
+    revision = git_revision()
+    all_results = []
+    for size in options.sizes.split(','):
+        results = bench_size(int(size), options, revision)
+        all_results.extend(results)
+
+        f = open(options.output, 'a')
+        for result in results:
+            f.write(json.dumps(result, sort_keys=True) + '\n')
+        f.close()
+
+    print_results(all_results)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Import time and startup time of every script, measured in fresh processes:
+    - import: importing the script module (no Server construction, config reading or API calls)
+    - startup: import and Server() construction
+    - MAReport single user: MAReport.py run end to end for one account against the FakeWHMServer stand-in
+
+Every measurement is repeated --repeat times, minimum and median are reported together with
+the number of loaded modules.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 10] [--transport http]
+"""
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+
+from bench_scripts import BENCHMARKS, REPOSITORY, SCRIPTS, TOKEN, prepare_workdir, run_script
+from fake_whm import FakeWHMServer
+from fakecpanel import FakeCPanel
+
+MEASURE = """
+import sys
+import time
+sys.path.insert(0, %(repository)r)
+start = time.time()
+import %(module)s
+imported = time.time()
+from includes.Server import Server
+Server()
+import json
+print json.dumps({'import': imported - start, 'startup': time.time() - start, 'modules': len(sys.modules)})
+"""
+
+
+def measure(module, workdir):
+    code = MEASURE % {'repository': REPOSITORY, 'module': module}
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError('%s: %s' % (module, err.strip().splitlines()[-1:]))
+
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=10)
+    parser.add_option('--transport', default='http', choices=['subprocess', 'http'],
+                      help='API transport for MAReport single user run')
+    options, args = parser.parse_args()
+
+    cpanel = FakeCPanel(accounts=20)
+    whm = FakeWHMServer(('127.0.0.1', 0), cpanel, TOKEN)
+    whm.start()
+    workdir = prepare_workdir(cpanel, whm.server_address[1], 53, options.transport)
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join([os.path.join(BENCHMARKS, 'bin'), os.path.dirname(sys.executable),
+                                   env.get('PATH', '')])
+    env['FAKE_WHM_PORT'] = str(whm.server_address[1])
+    env['FAKE_WHM_TOKEN'] = TOKEN
+
+    try:
+        print '%-28s %10s %10s %10s %10s %8s' % ('SCRIPT', 'IMPORT_MIN', 'IMPORT_MED', 'START_MIN', 'START_MED',
+                                               'MODULES')
+        for module in ('includes.Server',) + SCRIPTS + ('MAReport',):
+            results = [measure(module, workdir) for i in range(options.repeat)]
+            imports = [result['import'] for result in results]
+            startups = [result['startup'] for result in results]
+            print '%-28s %10.1f %10.1f %10.1f %10.1f %8d' % (
+                module, min(imports) * 1000, median(imports) * 1000, min(startups) * 1000,
+                median(startups) * 1000, results[-1]['modules'])
+
+        user = cpanel.account_order[0]
+        walls = [run_script('MAReport', workdir, env, [user])['wall'] for i in range(options.repeat)]
+        print '%-28s %10s %10s %10.1f %10.1f' % ('MAReport.py %s (end to end)' % user, '-', '-',
+                                                min(walls) * 1000, median(walls) * 1000)
+        print 'Times in milliseconds'
+    finally:
+        whm.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
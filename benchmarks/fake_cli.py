@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Fake whmapi1, uapi and cpapi2 command line tools (benchmarks/bin), forwarding calls to the FakeWHMServer
+stand-in, so the scripts can run with the default subprocess transport, including the process startup cost.
+
+Environment:
+    FAKE_WHM_PORT: stand-in port (default 2086)
+    FAKE_WHM_TOKEN: stand-in API token (default TOKEN)
+"""
+
+import json
+import os
+import sys
+
+import yaml
+
+from includes.Transport import WHMAPITransport, TransportError
+
+
+def main(api):
+    cmd = [api] + sys.argv[1:]
+    transport = WHMAPITransport('127.0.0.1', os.environ.get('FAKE_WHM_PORT', 2086),
+                                os.environ.get('FAKE_WHM_TOKEN', 'TOKEN'), scheme='http')
+    try:
+        output, error = transport.execute(cmd)
+    except TransportError, err:
+        sys.stderr.write('%s\n' % err)
+        return 1
+
+    if error:
+        sys.stderr.write('%s\n' % error)
+        return 1
+
+    if '--output=json' in cmd:
+        sys.stdout.write(output + '\n')
+    else:
+        # command line tools output YAML by default
+        sys.stdout.write('---\n' + yaml.safe_dump(json.loads(output), default_flow_style=False))
+
+    return 0
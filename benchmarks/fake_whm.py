@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Local stand-in for the WHM JSON API (json-api), answering from a synthetic FakeCPanel server.
+Used for testing 'api_transport = http' without a cPanel server.
+
+Usage:
+    python benchmarks/fake_whm.py [--port 2086] [--token TOKEN] [--accounts 10]
+
+Server.conf for the stand-in:
+    api_transport = http
+    api_scheme = http
+    api_host = 127.0.0.1
+    api_port = 2086
+    api_token = TOKEN
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import optparse
+import threading
+import urlparse
+
+from fakecpanel import FakeCPanel
+
+
+class FakeWHMHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.headers.get('Authorization') != 'whm %s:%s' % (server.api_user, server.token):
+            return self._send(403, json.dumps({'cpanelresult': {'error': 'Access denied', 'data': {'result': '0'}}}))
+
+        url = urlparse.urlparse(self.path)
+        if not url.path.startswith('/json-api/'):
+            return self._send(404, json.dumps({'error': 'Not found'}))
+
+        function = url.path[len('/json-api/'):]
+        params = {}
+        for key, value in urlparse.parse_qsl(url.query, keep_blank_values=True):
+            # repeated parameters (mass_edit_dns_zone edit/add) are passed as lists
+            if key in params:
+                if not isinstance(params[key], list):
+                    params[key] = [params[key]]
+                params[key].append(value)
+            else:
+                params[key] = value
+
+        server.lock.acquire()
+        try:
+            server.requests += 1
+            if self.headers.get('Connection', '').lower() == 'keep-alive':
+                server.keepalive_requests += 1
+
+            if function == 'uapi_cpanel':
+                server.count('uapi %s::%s' % (params['cpanel.module'], params['cpanel.function']))
+                output = server.cpanel.call('uapi', params.pop('cpanel.function'), params,
+                                            user=params.pop('cpanel.user'), module=params.pop('cpanel.module'))
+                # json-api wraps UAPI result under data.uapi
+                output = {'data': {'uapi': output['result']},
+                          'metadata': {'command': 'uapi_cpanel', 'reason': 'OK', 'result': 1, 'version': 1}}
+            elif function == 'cpanel':
+                server.count('cpapi2 %s::%s' % (params['cpanel_jsonapi_module'], params['cpanel_jsonapi_func']))
+                output = server.cpanel.call('cpapi2', params.pop('cpanel_jsonapi_func'), params,
+                                            user=params.pop('cpanel_jsonapi_user'),
+                                            module=params.pop('cpanel_jsonapi_module'))
+            else:
+                server.count('whmapi1 %s' % function)
+                params.pop('api.version', None)
+                output = server.cpanel.call('whmapi1', function, params)
+        except (KeyError, ValueError, AttributeError), err:
+            output = {'metadata': {'command': function, 'reason': 'Error: %r' % err, 'result': 0, 'version': 1}}
+        finally:
+            server.lock.release()
+
+        self._send(200, json.dumps(output))
+
+
+class FakeWHMServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cpanel, token, api_user='root'):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeWHMHandler)
+        self.cpanel = cpanel
+        self.token = token
+        self.api_user = api_user
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.keepalive_requests = 0
+        self.calls = {}
+
+    def count(self, call):
+        """
+        Counts API calls by function, called with self.lock held
+        """
+        self.calls[call] = self.calls.get(call, 0) + 1
+
+    def start(self):
+        """
+        Serves requests from a background thread, returns the thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=2086)
+    parser.add_option('--token', default='TOKEN')
+    parser.add_option('--accounts', type='int', default=10)
+    options, args = parser.parse_args()
+
+    whm = FakeWHMServer(('127.0.0.1', options.port), FakeCPanel(accounts=options.accounts), options.token)
+    print 'Fake WHM json-api listening on 127.0.0.1:%s' % options.port
+    whm.serve_forever()
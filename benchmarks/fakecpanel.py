@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Synthetic cPanel server used for offline testing and benchmarks.
+FakeCPanel.call() answers whmapi1, uapi and cpapi2 calls with the same output structure the command line
+tools return.
+"""
+
+import json
+import os
+import random
+import re
+import time
+
+
+def quote_txt(txtdata):
+    """
+    Returns TXT data in zone file format, as quoted character-strings of at most 255 bytes (UTF-8 encoded)
+    """
+    strings = []
+    while txtdata or not strings:
+        size = 255
+        while len(isinstance(txtdata, unicode) and txtdata[:size].encode('utf-8') or txtdata[:size]) > 255:
+            size -= 1
+        strings.append(txtdata[:size])
+        txtdata = txtdata[size:]
+
+    return ' '.join('"%s"' % string.replace('\\', '\\\\').replace('"', '\\"') for string in strings)
+
+
+class FakeCPanel(object):
+    """
+    Deterministic synthetic server with accounts, domains, DNS zones and mailboxes
+    """
+
+    def __init__(self, accounts=10, domains_per_account=3, resellers=3, suspended_ratio=0.1, seed=0,
+                 ip='10.0.0.1', nameservers=('ns1.example-hosting.com', 'ns2.example-hosting.com')):
+        self.random = random.Random(seed)
+        self.ip = ip
+        self.nameservers = nameservers
+        self.resellers = ['reseller%d' % i for i in range(resellers)]
+
+        self.accounts = {}
+        self.account_order = []
+        self.zones = {}
+        self.zone_serials = {}
+        self.mailboxes = {}
+        self.mxcheck = {}
+        self.bwlimits = {}
+        # when set, zone files are written here and rewritten after every zone change, see write_zone_files()
+        self.zone_dir = None
+        # when set, suspension marker files are kept here, see write_suspended_files()
+        self.suspended_dir = None
+
+        for i in range(accounts):
+            self._add_account('user%d' % i, domains_per_account, suspended_ratio)
+
+    def _add_account(self, user, domains_per_account, suspended_ratio):
+        rnd = self.random
+        main_domain = '%s-main.com' % user
+        domains = {'main_domain': main_domain, 'addon_domains': [], 'parked_domains': [],
+                   'sub_domains': ['blog.%s' % main_domain]}
+        for i in range(domains_per_account - 1):
+            domain_type = rnd.choice(['addon_domains', 'parked_domains'])
+            domains[domain_type].append('%s-%s%d.net' % (user, domain_type[0], i))
+
+        suspended = rnd.random() < suspended_ratio
+        unixtime = int(time.time()) - rnd.randint(1, 400) * 86400
+        self.accounts[user] = {
+            'user': user,
+            'owner': rnd.choice(self.resellers),
+            'domain': main_domain,
+            'ip': self.ip,
+            'plan': 'default',
+            'email': 'admin@%s' % main_domain,
+            'partition': 'home',
+            'diskused': '%dM' % rnd.randint(1, 5000),
+            'suspended': int(suspended),
+            'suspendreason': suspended and rnd.choice(['Unknown', 'Moved', 'Bandwidth Limit Exceeded']) or 'not suspended',
+            'suspendtime': suspended and unixtime or 0,
+            'totalbytes': rnd.randint(1, 50000) * 1024 * 1024,
+            'domains': domains,
+        }
+        self.account_order.append(user)
+
+        for domain in [main_domain] + domains['addon_domains'] + domains['parked_domains']:
+            self.zones[domain] = self._zone(domain)
+            self.zone_serials[domain] = 2017010100
+
+        self.mailboxes[user] = ['%s@%s' % (box, main_domain) for box in ['info', 'admin', 'sales'][:rnd.randint(1, 3)]]
+
+    def _zone(self, domain):
+        """
+        Zone with typical cPanel records, some of them needing dnsFix changes
+        """
+        rnd = self.random
+        name = domain + '.'
+        records = [{'type': ':RAW', 'raw': '; cPanel first:11.52', 'Lines': 1},
+                   {'type': ':RAW', 'raw': '$TTL 14400', 'Lines': 1},
+                   {'type': 'SOA', 'name': name, 'class': 'IN', 'ttl': 86400, 'mname': self.nameservers[0],
+                    'rname': 'hostmaster.' + domain, 'serial': '2017010100', 'refresh': 3600, 'retry': 1800,
+                    'expire': 1209600, 'minimum': 86400, 'Lines': 7}]
+        for ns in self.nameservers:
+            records.append({'type': 'NS', 'name': name, 'class': 'IN', 'ttl': 86400, 'nsdname': ns, 'Lines': 1})
+        records.append({'type': 'A', 'name': name, 'class': 'IN', 'ttl': 14400, 'address': self.ip, 'Lines': 1})
+
+        if rnd.random() < 0.5:
+            records.append({'type': 'MX', 'name': name, 'class': 'IN', 'ttl': 14400, 'preference': 0,
+                            'exchange': domain, 'Lines': 1})
+            records.append({'type': 'CNAME', 'name': 'mail.' + name, 'class': 'IN', 'ttl': 14400,
+                            'cname': domain, 'Lines': 1})
+        else:
+            records.append({'type': 'MX', 'name': name, 'class': 'IN', 'ttl': 14400, 'preference': 0,
+                            'exchange': 'mail.' + domain, 'Lines': 1})
+            records.append({'type': 'A', 'name': 'mail.' + name, 'class': 'IN', 'ttl': 14400,
+                            'address': self.ip, 'Lines': 1})
+
+        spf = rnd.choice(['v=spf1 +a +mx +ip4:%s ?all' % self.ip, 'v=spf1 +a +mx +ip4:%s ~all' % self.ip])
+        records.append({'type': 'TXT', 'name': name, 'class': 'IN', 'ttl': 14400, 'txtdata': spf, 'Lines': 1})
+        records.append({'type': 'CNAME', 'name': 'www.' + name, 'class': 'IN', 'ttl': 14400, 'cname': domain,
+                        'Lines': 1})
+
+        self._number(records)
+
+        return records
+
+    @staticmethod
+    def _number(records):
+        line = 1
+        for record in records:
+            record['Line'] = line
+            line += record['Lines']
+
+    # output structures
+
+    @staticmethod
+    def _whmapi1(function, data=None, result=1, reason='OK'):
+        output = {'metadata': {'command': function, 'reason': reason, 'result': result, 'version': 1}}
+        if data is not None:
+            output['data'] = data
+
+        return output
+
+    @staticmethod
+    def _uapi(module, function, data, status=1, errors=None):
+        return {'apiversion': 3, 'module': module, 'func': function,
+                'result': {'data': data, 'errors': errors, 'messages': None, 'metadata': {}, 'status': status,
+                           'warnings': None}}
+
+    @staticmethod
+    def _cpapi2(module, function, data):
+        return {'cpanelresult': {'apiversion': 2, 'module': module, 'func': function, 'data': data,
+                                 'event': {'result': 1}}}
+
+    def domain_owner(self, domain):
+        for user in self.account_order:
+            domains = self.accounts[user]['domains']
+            if domain == domains['main_domain'] or domain in domains['addon_domains'] + \
+                    domains['parked_domains'] + domains['sub_domains']:
+                return user
+
+        return None
+
+    def _acct(self, user):
+        account = self.accounts[user]
+        return dict((key, value) for key, value in account.items() if key not in ('domains', 'totalbytes'))
+
+    def _search(self, params):
+        search = params.get('search', '')
+        searchtype = params.get('searchtype', 'owner') or 'owner'
+        users = self.account_order
+        if search:
+            key = {'owner': 'owner', 'user': 'user', 'domain': 'domain', 'ip': 'ip', 'package': 'plan'}[searchtype]
+            # listaccts search is a regular expression
+            pattern = re.compile(search)
+            users = [user for user in users if pattern.search(str(self.accounts[user][key]))]
+
+        return users
+
+    # API calls
+
+    def call(self, api, function, params, user=None, module=None):
+        """
+        Arguments:
+            api: whmapi1, uapi or cpapi2
+            function: API function
+            params: dict of function parameters
+            user: --user option value for uapi and cpapi2
+            module: module name for uapi and cpapi2
+
+        Returns:
+            dict: command output structure
+        """
+        if api == 'whmapi1':
+            handler = getattr(self, 'whmapi1_' + function, None)
+            if handler is None:
+                return self._whmapi1(function, result=0, reason='Unknown app (%s) requested for this version' % function)
+            return handler(params)
+        elif api == 'uapi':
+            return getattr(self, 'uapi_%s_%s' % (module, function))(user, params)
+        elif api == 'cpapi2':
+            return getattr(self, 'cpapi2_%s_%s' % (module, function))(user, params)
+
+        raise ValueError('Unknown api %s' % api)
+
+    def whmapi1_listaccts(self, params):
+        return self._whmapi1('listaccts', {'acct': [self._acct(user) for user in self._search(params)]})
+
+    def whmapi1_listresellers(self, params):
+        return self._whmapi1('listresellers', {'reseller': list(self.resellers)})
+
+    def whmapi1_listsuspended(self, params):
+        accounts = []
+        for user in self.account_order:
+            account = self.accounts[user]
+            if account['suspended']:
+                accounts.append({'user': user, 'owner': account['owner'], 'reason': account['suspendreason'],
+                                 'time': time.ctime(account['suspendtime']), 'unixtime': account['suspendtime'],
+                                 'is_locked': 0})
+
+        return self._whmapi1('listsuspended', {'account': accounts})
+
+    def whmapi1_suspendacct(self, params):
+        account = self.accounts[params['user']]
+        account['suspended'] = 1
+        account['suspendreason'] = params.get('reason', 'Unknown')
+        account['suspendtime'] = int(time.time())
+        if self.suspended_dir:
+            self.write_suspended_file(params['user'])
+
+        return self._whmapi1('suspendacct')
+
+    def whmapi1_unsuspendacct(self, params):
+        account = self.accounts[params['user']]
+        account['suspended'] = 0
+        account['suspendreason'] = 'not suspended'
+        if self.suspended_dir:
+            self.write_suspended_file(params['user'])
+
+        return self._whmapi1('unsuspendacct')
+
+    def whmapi1_removeacct(self, params):
+        user = params['user']
+        account = self.accounts.pop(user)
+        self.account_order.remove(user)
+        if self.suspended_dir and os.path.exists(os.path.join(self.suspended_dir, user)):
+            os.unlink(os.path.join(self.suspended_dir, user))
+        if params.get('keepdns') != '1':
+            for domain in [account['domains']['main_domain']] + account['domains']['addon_domains'] + \
+                    account['domains']['parked_domains']:
+                self.zones.pop(domain, None)
+
+        return self._whmapi1('removeacct')
+
+    def whmapi1_domainuserdata(self, params):
+        domain = params['domain']
+        user = self.domain_owner(domain)
+        if user is None:
+            return self._whmapi1('domainuserdata', result=0, reason='Domain %s not found' % domain)
+
+        return self._whmapi1('domainuserdata', {'userdata': {
+            'documentroot': '/home/%s/public_html/%s' % (user, domain), 'ip': self.accounts[user]['ip'],
+            'servername': domain, 'user': user, 'owner': self.accounts[user]['owner']}})
+
+    def whmapi1_showbw(self, params):
+        users = self._search({'search': params.get('search', ''), 'searchtype': params.get('searchtype', 'user')})
+        accounts = []
+        for user in users:
+            account = self.accounts[user]
+            accounts.append({'user': user, 'owner': account['owner'], 'maindomain': account['domain'],
+                             'totalbytes': account['totalbytes'], 'limit': self.bwlimits.get(user, 0),
+                             'bwusage': []})
+
+        return self._whmapi1('showbw', {'acct': accounts, 'month': time.localtime().tm_mon,
+                                        'year': time.localtime().tm_year})
+
+    def whmapi1_limitbw(self, params):
+        self.bwlimits[params['user']] = int(params['bwlimit'])
+
+        return self._whmapi1('limitbw', {'bwlimits': [{'user': params['user'], 'bwlimit': params['bwlimit']}]},
+                             reason='Bandwidth Limit for %s has been set to %s' % (params['user'], params['bwlimit']))
+
+    def whmapi1_dumpzone(self, params):
+        domain = params['domain']
+        if domain not in self.zones:
+            return self._whmapi1('dumpzone', result=0, reason='Zone %s does not exist' % domain)
+
+        return self._whmapi1('dumpzone', {'zone': [{'record': self.zones[domain]}]})
+
+    def whmapi1_getzonerecord(self, params):
+        records = [record for record in self.zones.get(params['domain'], [])
+                   if str(record['Line']) == str(params['line'])]
+
+        return self._whmapi1('getzonerecord', {'record': records})
+
+    def _record_from_params(self, params):
+        record = {'name': params['name'], 'class': params.get('class', 'IN'), 'ttl': int(params.get('ttl', 14400)),
+                  'type': params['type'], 'Lines': 1}
+        if record['type'] == 'A':
+            record['address'] = params['address']
+        elif record['type'] == 'MX':
+            record['exchange'] = params['exchange']
+            record['preference'] = int(params.get('preference', 0))
+        elif record['type'] == 'CNAME':
+            record['cname'] = params['cname']
+        elif record['type'] == 'TXT':
+            record['txtdata'] = params['txtdata']
+
+        return record
+
+    def _bump_serial(self, domain):
+        self.zone_serials[domain] += 1
+        for record in self.zones[domain]:
+            if record['type'] == 'SOA':
+                record['serial'] = str(self.zone_serials[domain])
+        if self.zone_dir:
+            self.write_zone_file(domain)
+
+    def whmapi1_editzonerecord(self, params):
+        domain = params['domain']
+        zone = self.zones[domain]
+        for index, record in enumerate(zone):
+            if str(record['Line']) == str(params['line']):
+                new_record = self._record_from_params(params)
+                new_record['Line'] = record['Line']
+                zone[index] = new_record
+                self._bump_serial(domain)
+                return self._whmapi1('editzonerecord')
+
+        return self._whmapi1('editzonerecord', result=0, reason='Line %s not found' % params['line'])
+
+    def whmapi1_addzonerecord(self, params):
+        domain = params['domain']
+        self.zones[domain].append(self._record_from_params(params))
+        self._number(self.zones[domain])
+        self._bump_serial(domain)
+
+        return self._whmapi1('addzonerecord')
+
+    DATA_FIELDS = {'A': ('address',), 'AAAA': ('address',), 'CNAME': ('cname',), 'MX': ('preference', 'exchange'),
+                   'NS': ('nsdname',), 'TXT': ('txtdata',)}
+
+    def _record_from_entry(self, entry):
+        record = {'name': entry['dname'], 'class': 'IN', 'ttl': int(entry.get('ttl', 14400)),
+                  'type': entry['record_type'], 'Lines': 1}
+        data = entry['data']
+        if record['type'] == 'TXT':
+            # TXT character-strings are joined, like dumpzone reports them
+            data = [''.join(data)]
+        for field, value in zip(self.DATA_FIELDS[record['type']], data):
+            if field == 'preference':
+                value = int(value)
+            record[field] = value
+
+        return record
+
+    def whmapi1_mass_edit_dns_zone(self, params):
+        domain = params['zone']
+        if domain not in self.zones:
+            return self._whmapi1('mass_edit_dns_zone', result=0, reason='Zone %s does not exist' % domain)
+        if str(params.get('serial')) != str(self.zone_serials[domain]):
+            return self._whmapi1('mass_edit_dns_zone', result=0,
+                                 reason='Serial %s does not match zone serial %s' % (params.get('serial'),
+                                                                                    self.zone_serials[domain]))
+
+        def entries(name):
+            values = params.get(name, [])
+            if not isinstance(values, list):
+                values = [values]
+            return [json.loads(value) for value in values]
+
+        zone = self.zones[domain]
+        for entry in entries('edit') + entries('add'):
+            name = entry['dname'].rstrip('.')
+            if '..' in entry['dname'] or (name != domain and not name.endswith('.' + domain)):
+                return self._whmapi1('mass_edit_dns_zone', result=0,
+                                     reason='Invalid name %s for zone %s' % (entry['dname'], domain))
+        for entry in entries('edit'):
+            for index, record in enumerate(zone):
+                if record['Line'] == entry['line_index'] + 1:
+                    zone[index] = self._record_from_entry(entry)
+                    zone[index]['Line'] = record['Line']
+                    break
+            else:
+                return self._whmapi1('mass_edit_dns_zone', result=0,
+                                     reason='Line index %s not found' % entry['line_index'])
+        for entry in entries('add'):
+            zone.append(self._record_from_entry(entry))
+
+        self._number(zone)
+        self._bump_serial(domain)
+
+        return self._whmapi1('mass_edit_dns_zone', {'new_serial': str(self.zone_serials[domain])})
+
+    @staticmethod
+    def _owner(name, domain):
+        """
+        Returns record name as cPanel writes it to zone files: '@' for the zone apex, relative names inside the zone
+        """
+        if name == domain + '.':
+            return '@'
+        if name.endswith('.' + domain + '.'):
+            return name[:-len(domain) - 2]
+
+        return name
+
+    def zone_file(self, domain):
+        """
+        Returns:
+            str: zone in BIND zone file format, with the same line numbers as in dumpzone output.
+            Record names are relative to the zone ('@', 'mail', 'www'), like in cPanel zone files
+        """
+        lines = []
+        for record in self.zones[domain]:
+            owner = self._owner(record.get('name', ''), domain)
+            if record['type'] == ':RAW':
+                lines.append(record['raw'])
+            elif record['type'] == 'SOA':
+                lines.append('%s\t%s\t%s\tSOA\t%s.\t%s.\t(' % (owner, record['ttl'], record['class'], record['mname'],
+                                                                record['rname']))
+                lines.extend('\t\t\t\t\t\t%s ;%s' % (record[field], comment) for field, comment in
+                             (('serial', 'Serial Number'), ('refresh', 'refresh'), ('retry', 'retry'),
+                              ('expire', 'expire'), ('minimum', 'minimum')))
+                lines.append('\t\t\t\t\t\t)')
+            else:
+                if record['type'] == 'TXT':
+                    data = quote_txt(record['txtdata'])
+                elif record['type'] == 'MX':
+                    data = '%(preference)s %(exchange)s.' % record
+                else:
+                    data = ' '.join(str(record[field]) + (field != 'address' and '.' or '')
+                                    for field in self.DATA_FIELDS[record['type']])
+                lines.append('%s\t%s\t%s\t%s\t%s' % (owner, record['ttl'], record['class'], record['type'],
+                                                       data))
+
+        return ''.join('%s\n' % line for line in lines)
+
+    def write_zone_file(self, domain):
+        f = open(os.path.join(self.zone_dir, '%s.db' % domain), 'w')
+        f.write(self.zone_file(domain))
+        f.close()
+
+    def write_zone_files(self, zone_dir):
+        """
+        Writes zone files of all zones to zone_dir, as /var/named/<domain>.db on a cPanel server
+        """
+        self.zone_dir = zone_dir
+        for domain in self.zones:
+            self.write_zone_file(domain)
+
+    def write_suspended_file(self, user):
+        """
+        Creates or removes /var/cpanel/suspended/<user> marker file: suspension reason, modified at suspension time
+        """
+        path = os.path.join(self.suspended_dir, user)
+        account = self.accounts[user]
+        if not account['suspended']:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+
+        f = open(path, 'w')
+        # cPanel leaves the file empty when suspended without reason
+        f.write(account['suspendreason'] != 'Unknown' and account['suspendreason'] or '')
+        f.close()
+        os.utime(path, (account['suspendtime'], account['suspendtime']))
+
+    def write_suspended_files(self, suspended_dir):
+        """
+        Writes suspension marker files of all suspended accounts to suspended_dir, as /var/cpanel/suspended
+        """
+        self.suspended_dir = suspended_dir
+        for user in self.account_order:
+            self.write_suspended_file(user)
+        # lock files of WHM suspension locks are not marker files
+        open(os.path.join(suspended_dir, 'user0.lock'), 'w').close()
+
+    def trueuserowners(self):
+        """
+        Returns:
+            str: /etc/trueuserowners file content
+        """
+        return ''.join('%s: %s\n' % (user, self.accounts[user]['owner']) for user in self.account_order)
+
+    def domain_records(self):
+        """
+        Returns:
+            list: [(domain, user, owner, domain_type, parent_domain, documentroot)] for every domain on the server
+        """
+        records = []
+        for user in self.account_order:
+            account = self.accounts[user]
+            domains = account['domains']
+            main_domain = domains['main_domain']
+            records.append((main_domain, user, account['owner'], 'main', main_domain, '/home/%s/public_html' % user))
+            for domain_type in ('addon', 'parked', 'sub'):
+                for domain in domains[domain_type + '_domains']:
+                    records.append((domain, user, account['owner'], domain_type, main_domain,
+                                    '/home/%s/public_html/%s' % (user, domain)))
+
+        return records
+
+    def userdatadomains(self):
+        """
+        Returns:
+            str: /etc/userdatadomains file content
+        """
+        lines = []
+        for domain, user, owner, domain_type, parent, documentroot in self.domain_records():
+            lines.append('%s: %s==%s==%s==%s==%s==%s:80====0\n' % (domain, user, owner, domain_type, parent,
+                                                                     documentroot, self.accounts[user]['ip']))
+
+        return ''.join(lines)
+
+    def whmapi1_get_domain_info(self, params):
+        domains = []
+        for domain, user, owner, domain_type, parent, documentroot in self.domain_records():
+            domains.append({'domain': domain, 'user': user, 'user_owner': owner, 'domain_type': domain_type,
+                            'parent_domain': parent, 'docroot': documentroot, 'ipv4': self.accounts[user]['ip'],
+                            'ipv4_ssl': self.accounts[user]['ip'], 'ipv6': None, 'port': '80',
+                            'port_ssl': '443', 'modsecurity_enabled': 1, 'php_version': 'ea-php56'})
+
+        return self._whmapi1('get_domain_info', {'domains': domains})
+
+    def whmapi1_list_pops_for(self, params):
+        return self._whmapi1('list_pops_for', {'pops': list(self.mailboxes.get(params['user'], []))})
+
+    def uapi_DomainInfo_list_domains(self, user, params):
+        domains = self.accounts[user]['domains']
+
+        return self._uapi('DomainInfo', 'list_domains', {
+            'main_domain': domains['main_domain'], 'addon_domains': list(domains['addon_domains']),
+            'parked_domains': list(domains['parked_domains']), 'sub_domains': list(domains['sub_domains'])})
+
+    def uapi_Email_get_disk_usage(self, user, params):
+        email = '%s@%s' % (params['user'], params['domain'])
+        # stable pseudo random usage for every mailbox
+        diskused = random.Random(email).randint(0, 2000)
+
+        return self._uapi('Email', 'get_disk_usage', {'diskused': diskused, 'login': email})
+
+    def cpapi2_Email_setmxcheck(self, user, params):
+        self.mxcheck[params['domain']] = params['mxcheck']
+
+        return self._cpapi2('Email', 'setmxcheck', [{'checkmx': {'local': params['mxcheck'] == 'local'},
+                                                     'detected': params['mxcheck'], 'mxcheck': params['mxcheck'],
+                                                     'status': 1, 'statusmsg': 'Set Mail Exchanger type'}])
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Runs one of the scripts as __main__ in the current directory and prints its wall time and peak RSS
+as the last line of output, in JSON format. Used by bench_scripts.py, every script runs in a fresh process.
+
+Usage:
+    python benchmarks/run_script.py <repository>/LocRem.py [script arguments]
+"""
+
+import json
+import os
+import resource
+import runpy
+import sys
+import time
+
+if __name__ == '__main__':
+    script = os.path.abspath(sys.argv[1])
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(script))
+
+    start = time.time()
+    status = 0
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit, err:
+        status = err.code or 0
+    wall = time.time() - start
+
+    sys.stdout.flush()
+    print json.dumps({'script': os.path.basename(script), 'status': status, 'wall': wall,
+                      'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
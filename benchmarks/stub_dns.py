@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+
+Stub DNS server answering A, MX, NS, TXT and SOA queries for the zones of a synthetic FakeCPanel server.
+Every answer is delayed by the configured latency, to simulate queries going over the network.
+Part of the domains (external_ratio) resolves to external name servers and mail exchangers, so the
+scripts have both local and remote domains to work with.
+
+Server.conf for the stub:
+    dns_nameservers = 127.0.0.1
+    dns_port = <port>
+"""
+
+import SocketServer
+import hashlib
+import threading
+import time
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+from fakecpanel import quote_txt
+
+EXTERNAL_NS = ('ns1.external-dns.net', 'ns2.external-dns.net')
+EXTERNAL_IP = '192.0.2.10'
+EXTERNAL_MX = 'mx.external-mail.net'
+
+
+class StubDNSHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        server = self.server
+        try:
+            query = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return
+
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        name = question.name.to_text().rstrip('.').lower()
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        answers = server.lookup(name, rdtype)
+        if answers is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif answers:
+            response.answer.append(dns.rrset.from_text_list(question.name, server.ttl, dns.rdataclass.IN,
+                                                            question.rdtype, answers))
+
+        server.lock.acquire()
+        try:
+            server.queries[rdtype] = server.queries.get(rdtype, 0) + 1
+        finally:
+            server.lock.release()
+
+        sock.sendto(response.to_wire(), self.client_address)
+
+
+class StubDNSServer(SocketServer.ThreadingMixIn, SocketServer.UDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cpanel, latency=0.0, external_ratio=0.2, ttl=300,
+                 nameserver_ips=('10.0.53.1', '10.0.53.2')):
+        SocketServer.UDPServer.__init__(self, address, StubDNSHandler)
+        self.latency = latency
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.queries = {}
+
+        self.records = {}
+        for ns, ip in zip(cpanel.nameservers, nameserver_ips):
+            self._add(ns, 'A', ip)
+        for ns in EXTERNAL_NS:
+            self._add(ns, 'A', '192.0.2.53')
+        self._add(EXTERNAL_MX, 'A', '192.0.2.25')
+
+        for domain, zone in cpanel.zones.items():
+            if self._is_external(domain, external_ratio):
+                self._add_external(domain)
+            else:
+                self._add_zone(zone)
+
+    @staticmethod
+    def _is_external(domain, ratio):
+        return int(hashlib.md5(domain).hexdigest()[:8], 16) < ratio * 0xffffffff
+
+    def _add(self, name, rdtype, text):
+        self.records.setdefault(name.rstrip('.').lower(), {}).setdefault(rdtype, []).append(text)
+
+    def _add_external(self, domain):
+        for ns in EXTERNAL_NS:
+            self._add(domain, 'NS', ns + '.')
+        self._add(domain, 'A', EXTERNAL_IP)
+        self._add(domain, 'MX', '10 %s.' % EXTERNAL_MX)
+        self._add(domain, 'TXT', '"v=spf1 include:external-mail.net ~all"')
+
+    def _add_zone(self, zone):
+        cnames = []
+        for record in zone:
+            name = record.get('name')
+            if not name:
+                continue
+            rtype = record['type']
+            if rtype == 'A':
+                self._add(name, 'A', record['address'])
+            elif rtype == 'MX':
+                self._add(name, 'MX', '%s %s.' % (record['preference'], record['exchange']))
+            elif rtype == 'NS':
+                self._add(name, 'NS', record['nsdname'] + '.')
+            elif rtype == 'TXT':
+                self._add(name, 'TXT', quote_txt(record['txtdata']))
+            elif rtype == 'SOA':
+                self._add(name, 'SOA', '%s. %s. %s %s %s %s %s' % (
+                    record['mname'], record['rname'], record['serial'], record['refresh'], record['retry'],
+                    record['expire'], record['minimum']))
+            elif rtype == 'CNAME':
+                cnames.append((name, record['cname']))
+
+        # CNAME targets are flattened, so A queries for CNAME names return the target addresses
+        for name, target in cnames:
+            for address in self.records.get(target.rstrip('.').lower(), {}).get('A', []):
+                self._add(name, 'A', address)
+
+    def lookup(self, name, rdtype):
+        """
+        Returns:
+            list: record texts, empty list if name exists without records of rdtype, None if name doesn't exist
+        """
+        if name not in self.records:
+            return None
+
+        return self.records[name].get(rdtype, [])
+
+    def start(self):
+        """
+        Serves queries from a background thread, returns the thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
@@ -28,64 +28,85 @@ __status__ = "Production"
 # value name "ns_ipranges"
 # Example:
 # ns_ipranges = 178.218.172.160/27, 178.218.165.160/27
-
-from includes.Server import Server
-
-import yaml
+#
+# Incremental runs:
+# With "state_file" set in [dnsFix] section, SOA serial and fingerprint of MX, TXT and mail.domain.tld records of
+# every checked zone, taken from the zone itself, are stored in the state file. Zones found compliant in an earlier
+# run are not read or dumped again while the serial in their local zone file (<zone_dir or serial_dir>/<domain>.db,
+# serial_dir = /var/named by default) doesn't change. Zones with a changed serial, or without a readable zone file,
+# are dumped and not checked again if their records didn't change. Run with --full to check all zones (zones edited
+# without changing the serial).
+#
+# Local zone files:
+# With "zone_dir" set in [dnsFix] section (zone_dir = /var/named), zones are read from <zone_dir>/<domain>.db files,
+# parsed by "zone_workers" worker processes (default: number of CPUs), instead of dumping them through the API.
+# API is then used only for zone changes. Zones with missing or unparsable files are dumped through the API.
+
+from includes.Server import Server, RunDeadlineExceeded
+from includes.FileStore import FileStore
+from includes.ReportSpool import ReportSpool
+from includes.ZoneFile import ZoneFileReader
+
+import hashlib
+import json
+import optparse
 import time
 
-try:
-    # 'Importing netaddr for python 2.4'
-    from netaddr import IP
-    from netaddr import CIDR
-except:
-    # Importing netaddr for python > 2.4
-    from netaddr import IPAddress as IP
-    from netaddr import IPNetwork as CIDR
-
 
 class dnsFix(object):
-    server = Server()
-
     DUMP_DNS_ZONE = 'whmapi1 dumpzone domain=DOMAIN.TLD'
 
-    def __init__(self):
+    def __init__(self, full=False):
         self.start = time.time()
-        self.ns_ipranges = [s.strip() for s in dnsFix.server.server_conf.get('Server', 'ns_ipranges').split(',')]
+        self.full = full
         self.ignoreDomains = [s.strip() for s in
-                              dnsFix.server.server_conf.get('dnsFix', 'ignoreDomains').split(',')]
-        self.spf_includes = dnsFix.server.server_conf.get('dnsFix', 'spf_include').strip()
+                              server.server_conf.get('dnsFix', 'ignoreDomains').split(',')]
+        self.spf_includes = server.server_conf.get('dnsFix', 'spf_include').strip()
 
         # populate necessary data and create containers
-        self.owners_users_data = dnsFix.server.get_owners_user_details()
+        self.owners_users_data = server.get_owners_user_details()
 
         self.domain_resolving = {}
         self.dump_zone_fails = []
 
-        self.report_string = []
+        self.report_spool = ReportSpool()
+
+        # zone state of earlier runs, {domain: {'serial', 'fingerprint', 'settings', 'result', 'checked'}}
+        state_file = server.get_conf_value('dnsFix', 'state_file')
+        self.state_store = state_file and FileStore(state_file) or None
+        self.zone_state = {}
+        if self.state_store and not self.full:
+            self.zone_state = self.state_store.load()
+        self.new_zone_state = {}
+        self.zone_counts = {'skipped': 0, 'checked': 0, 'compliant': 0, 'fixed': 0, 'failed': 0}
+
+        # zones read from local zone files, see read_zone_file()
+        zone_dir = server.get_conf_value('dnsFix', 'zone_dir')
+        self.zone_reader = None
+        if zone_dir:
+            self.zone_reader = ZoneFileReader(zone_dir, int(server.get_conf_value('dnsFix', 'zone_workers', 0)))
+        self.zone_files = None
+        self.zone_file_buffer = {}
+        self.zone_sources = {'zone file': 0, 'API': 0}
+        # SOA serials of unchanged zones are read from local zone files, see zone_serial_unchanged()
+        self.serial_reader = self.zone_reader
+        if self.state_store and not self.serial_reader:
+            self.serial_reader = ZoneFileReader(server.get_conf_value('dnsFix', 'serial_dir', '/var/named'), 1)
+        self.unchanged_zones = set()
 
     def output_and_log(self, text):
         """
-        Just print the output steps to shell and prepere the report string.
+        Just print the output steps to shell and write them to the report spool.
         :param text:
         :return:
         """
         print text
-        self.report_string.append(str(text))
-
-    def get_zone_record(self, domain, line):
-        get_zone_record = "whmapi1 getzonerecord domain=%s line=%s" % (domain, line)
-
-        out = yaml.load(dnsFix.server.exec_cpanel_api_command(get_zone_record))['data']['record']
-        if out:
-            return out[0]
-        else:
-            return "Error getting zone record: ", domain, line
+        self.report_spool.writeline(str(text))
 
-    def check_MX_record(self, domain, zone_dump, local_ip):
+    def check_MX_record(self, domain, zone_dump, local_ip, plan):
         """
         This method locates the relevant MX lines in the zone dump, so checks and modifications can be made.
-        Currently just prints the results when change is needed.
+        Needed changes are added to the zone change plan, see apply_zone_plan().
 
         TODO: so far only check is that domain is using our nameservers!!!
         This method adds check that that the mails are resolving on the domain name
@@ -93,6 +114,7 @@ class dnsFix(object):
         :param domain:
         :param zone_dump:
         :param local_ip:
+        :param plan: list of (label, zone record or None for new records, new record) changes for the zone
         :return:
         """
         fixmx = 0
@@ -101,26 +123,18 @@ class dnsFix(object):
         for item in zone_dump:
             # fix MX record to point to mail.domain.tld
             if item['type'] == 'MX' and item['name'].strip('.') == item['exchange']:
-                line = 'whmapi1 editzonerecord domain=%s line=%s name=%s exchange=%s class=IN ttl=300 type=MX preference=%s' % \
-                       (domain, item['Line'], domain+'.', 'mail.'+domain, item['preference'])
                 log_msg = 'MX Record (OLD): ', item
                 self.output_and_log(log_msg)
-                dnsFix.server.exec_cpanel_api_command(line)
-                new_mx = self.get_zone_record(domain, item['Line'])
-                log_msg = 'MX Record (NEW): ', new_mx
-                self.output_and_log(log_msg)
+                plan.append(('MX Record', item, {'name': domain+'.', 'class': 'IN', 'ttl': 300, 'type': 'MX',
+                                                 'exchange': 'mail.'+domain, 'preference': item['preference']}))
                 fixmx = 1
             # fix mail.domain.tld record so it points to server IP
             if item.has_key('name') and item['name'].strip('.') == 'mail.'+domain \
                     and item['type'] == 'CNAME' and item['cname'] == domain:
-                line = 'whmapi1 editzonerecord domain=%s line=%s name=%s class=IN ttl=300 type=A address=%s' % \
-                       (domain, item['Line'], item['name'], local_ip)
                 log_msg = 'MAIL.DOMAIN.TLD Record (OLD): ', item
                 self.output_and_log(log_msg)
-                dnsFix.server.exec_cpanel_api_command(line)
-                nex_mail = self.get_zone_record(domain, item['Line'])
-                log_msg = 'MAIL.DOMAIN.TLD Record (NEW): ', nex_mail
-                self.output_and_log(log_msg)
+                plan.append(('MAIL.DOMAIN.TLD Record', item, {'name': item['name'], 'class': 'IN', 'ttl': 300,
+                                                              'type': 'A', 'address': local_ip}))
                 fixmail = 1
                 mail_record_exists = 1
 
@@ -131,33 +145,28 @@ class dnsFix(object):
 
         if not mail_record_exists:
             # add mail.domain.tld if the record is not present in the zone
-            add_mail_record = "whmapi1 addzonerecord domain=%s name=%s class=IN ttl=14400 type=A address=%s" % \
-                        (domain, 'mail.'+domain+'.', local_ip)
             self.output_and_log('Domain mail.domain.tld not found, adding now:')
-            dnsFix.server.exec_cpanel_api_command(add_mail_record)
+            plan.append(('MAIL.DOMAIN.TLD Record', None, {'name': 'mail.'+domain+'.', 'class': 'IN', 'ttl': 14400,
+                                                          'type': 'A', 'address': local_ip}))
 
         if not fixmx and not fixmail:
             self.output_and_log('Domain is using good MX/mail configuration.')
 
-    def fix_txt_record(self, domain, spf_record):
-        line = 'whmapi1 editzonerecord domain=%s line=%s name=%s class=IN ttl=14400 type=TXT txtdata="%s"' \
-               % (domain, spf_record['Line'], spf_record['name'], spf_record['txtdata'])
+    def fix_txt_record(self, domain, spf_record, plan):
         log_msg = "Applying TXT Fix for domain", domain, 'record', spf_record['name'], 'line', spf_record['Line']
         self.output_and_log(log_msg)
-        dnsFix.server.exec_cpanel_api_command(line)
-        new_txt = self.get_zone_record(domain, spf_record['Line'])
-        log_msg = 'TXT SPF (NEW):',  new_txt['txtdata']
-        if new_txt['txtdata'] != spf_record['txtdata']:
-            self.output_and_log("ERROR CONFIRMING DOMAIN TXT DATA, CHECK ZONE FILE FOR ERRORS (missing A record!)")
-        self.output_and_log(log_msg)
+        plan.append(('TXT SPF', spf_record, {'name': spf_record['name'], 'class': 'IN', 'ttl': 14400, 'type': 'TXT',
+                                             'txtdata': spf_record['txtdata']}))
 
-    def check_txt_record(self, domain, zone_dump):
+    def check_txt_record(self, domain, zone_dump, plan):
         """
         This method will locate the ALL TXT spf records in the zone dump by changing '?all' to '~all' and adding
         'include:spf.domain.tld' to the record where necessary (use config file to define the spf include domain)
+        Needed changes are added to the zone change plan, see apply_zone_plan().
 
         :param domain:
         :param zone_dump:
+        :param plan: list of zone changes, see check_MX_record()
         :return:
         """
         for item in zone_dump:
@@ -180,28 +189,139 @@ class dnsFix(object):
 
                 if spffix:
                     self.output_and_log(log_msg)
-                    self.fix_txt_record(domain, item)
+                    self.fix_txt_record(domain, item, plan)
                 else:
                     log_msg = "Domain %s is using correct SPF: %s" % (domain, item)
                     self.output_and_log(log_msg)
 
-    def dump_domain(self, domain):
+    @staticmethod
+    def zone_value(value):
+        """
+        Returns zone record field value as unicode, zone file records have UTF-8 str values, dumpzone records unicode
+        """
+        if isinstance(value, str):
+            return value.decode('utf-8', 'replace')
+
+        return unicode(value)
+
+    @staticmethod
+    def find_zone_record(zone_dump, record):
+        """
+        Returns zone_dump record with the same name, type and data as record, None if the zone has no such record
+        """
+        fields = Server.ZONE_RECORD_DATA[record['type']]
+        data = [dnsFix.zone_value(record[field]).strip('.') for field in fields]
+        for item in zone_dump:
+            if item['type'] == record['type'] and item.get('name', '').strip('.') == record['name'].strip('.') and \
+                    [dnsFix.zone_value(item.get(field, '')).strip('.') for field in fields] == data:
+                return item
+
+        return None
+
+    def apply_zone_plan(self, domain, zone_dump, plan):
+        """
+        Applies all planned changes of the zone with one mass_edit_dns_zone call, so the zone is saved, its serial
+        changed and reloaded only once. Result is verified with one zone dump.
+
+        :param domain:
+        :param zone_dump: zone dump the plan is based on
+        :param plan: list of zone changes, see check_MX_record()
+        :return: bool: True if all changes are confirmed in the zone
+        """
+        if not plan:
+            return True
+
+        serial = [item['serial'] for item in zone_dump if item['type'] == 'SOA']
+        if not serial:
+            self.output_and_log("ERROR: SOA record not found in zone %s, changes not applied" % domain)
+            return False
+
+        edit = [(old['Line'], new) for label, old, new in plan if old]
+        add = [new for label, old, new in plan if not old]
+        applied, reason = server.mass_edit_dns_zone(domain, serial[0], edit, add)
+        if not applied:
+            self.output_and_log("ERROR APPLYING ZONE CHANGES FOR DOMAIN %s: %s" % (domain, reason))
+            return False
+
+        # zone file was rewritten by the edit, it is read again
+        new_zone_dump = self.dump_domain(domain, prefetched=False)
+        if not new_zone_dump:
+            self.output_and_log("ERROR CONFIRMING ZONE CHANGES FOR DOMAIN %s, ZONE DUMP FAILED" % domain)
+            return False
+
+        confirmed = True
+        for label, old, new in plan:
+            new_record = self.find_zone_record(new_zone_dump, new)
+            if new_record:
+                log_msg = '%s (NEW): ' % label, new_record
+                self.output_and_log(log_msg)
+            else:
+                self.output_and_log("ERROR CONFIRMING %s FOR DOMAIN %s, CHECK ZONE FILE FOR ERRORS" %
+                                    (label.upper(), domain))
+                confirmed = False
+
+        return confirmed
+
+    def read_zone_file(self, domain, prefetched=True):
+        """
+        Reads zone records from the local zone file.
+        Zones of domains passed to read_zone_files() are taken from the worker pool results, other zones
+        (and all zones when prefetched is False) are read directly.
+
+        :param domain:
+        :param prefetched: use zone prepared by read_zone_files()
+        :return: zone records, or None if zone files are not used or the zone file can't be read
+        """
+        if not self.zone_reader:
+            return None
+
+        if prefetched and self.zone_files is not None:
+            while domain not in self.zone_file_buffer:
+                try:
+                    zone_domain, records, error = next(self.zone_files)
+                except StopIteration:
+                    break
+                self.zone_file_buffer[zone_domain] = (records, error)
+
+        if prefetched and domain in self.zone_file_buffer:
+            records, error = self.zone_file_buffer.pop(domain)
+        else:
+            records, error = self.zone_reader.read(domain)
+
+        if records is None:
+            self.output_and_log('Zone file not used, %s' % error)
+
+        return records
+
+    def read_zone_files(self, domains):
+        """
+        Starts parsing zone files of domains in worker processes, in the order the domains are checked
+        """
+        if self.zone_reader:
+            self.zone_files = self.zone_reader.read_many(domains)
+
+    def dump_domain(self, domain, prefetched=True):
         """
         Dump DNS zone and reads collects txt records.
+        Zone is read from the local zone file when zone files are used, and dumped through the API if the file
+        can't be read.
         Apply fix if needed
         """
+        zone_dump = self.read_zone_file(domain, prefetched)
+        if zone_dump:
+            self.zone_sources['zone file'] += 1
+            return zone_dump
+
+        self.zone_sources['API'] += 1
         cmd = dnsFix.DUMP_DNS_ZONE.replace('DOMAIN.TLD', domain)
         try:
-            dump_out = dnsFix.server.exec_cpanel_api_command(cmd).replace('\t','')
-            zone_dump = yaml.load(dump_out)['data']['zone'][0]['record']
-        except yaml.scanner.ScannerError, err:
+            zone_dump = server.api_call(cmd)['data']['zone'][0]['record']
+        except (TypeError, KeyError, IndexError), err:
+            # output could not be decoded, or zone data is missing from the output
             self.output_and_log('ERROR: \n' + repr(err))
-            print 'ERROR: ', err
-            self.dump_zone_fails.append(domain)
-            return 0
-        except KeyError, err:
-            self.output_and_log('ERROR: \n', repr(err))
-            self.dump_zone_fails.append(domain)
+            # zone is listed once, also when the dump confirming its changes fails
+            if domain not in self.dump_zone_fails:
+                self.dump_zone_fails.append(domain)
             return 0
 
         return zone_dump
@@ -216,37 +336,144 @@ class dnsFix(object):
         if '.'.join(domain.split('.')[-2:]) not in self.ignoreDomains:
             dom_res_ns = self.domain_resolving[domain]['NS']
             if (type(dom_res_ns) != bool) and dom_res_ns:
-                if [net for net in self.ns_ipranges for ns in dom_res_ns if IP(ns[1]) in CIDR(net)]:
+                if server.uses_our_nameservers(dom_res_ns):
                     # condition will be true if server NS entry resolves to our Name Server IP ranges
                     return True
             else:
                 # domain name server entries not found, or external:
                 return False
 
-    def resolve_domain(self, domain):
+    def zone_check_needed(self, domain, local_ip):
+        """
+        Returns True if the domain has MX records, uses our nameserver cluster and mails resolve locally
+        """
+        mx_resolve = self.domain_resolving[domain]['MX']
+
+        return bool(mx_resolve and self.check_ns_resolve(domain) and local_ip in mx_resolve[0][1])
+
+    def resolve_domains(self, domains):
         """
-        Accepts list of domains and populates self.domain_resolving[domain][('A'|'MX'|'NS'}| values
+        Accepts list of domains and populates self.domain_resolving[domain][('A'|'MX'|'NS'|'TXT'}| values
+        Domains are resolved concurrently through Server.resolve_many()
         Data format:
             A: query data is returned
             MX: list(tuple): list of tuples for every MX record and its resolving IP address
-            MX: list(tuple): list of tuples for every NS record and its resolving IP address
+            NS: list(tuple): list of tuples for every NS record and its resolving IP address
+            TXT: list of TXT records
 
-        :param user_domains:
+        :param domains:
         :return:
         """
-        ns = dnsFix.server.resolve(domain, 'NS')
-        a = dnsFix.server.resolve(domain, 'A')
-        mx = dnsFix.server.resolve(domain, 'MX')
-        txt = dnsFix.server.resolve(domain, 'TXT')
-        if ns:
-            ns_records = sorted(ns, key=lambda ns_rec: ns_rec[0])
-        else:
-            ns_records = False
+        resolving = server.resolve_many(domains, ('NS', 'A', 'MX', 'TXT'))
+
+        for domain, records in resolving.iteritems():
+            ns = records['NS']
+            if ns:
+                ns_records = sorted(ns, key=lambda ns_rec: ns_rec[0])
+            else:
+                ns_records = False
+
+            self.domain_resolving.setdefault(domain, {})['NS'] = ns_records
+            self.domain_resolving[domain]['A'] = records['A']
+            self.domain_resolving[domain]['MX'] = records['MX']
+            self.domain_resolving[domain]['TXT'] = records['TXT']
+
+    def zone_fingerprint(self, domain, zone_dump, local_ip):
+        """
+        Fingerprints the zone records the checks depend on, before the checks change them.
+        Zone data comes from the zone itself (zone file or dumpzone), resolved answers could be cached or
+        served by a nameserver that didn't reload the zone yet.
+
+        :param domain:
+        :param zone_dump: zone records
+        :param local_ip: IP address mail.domain.tld has to point to
+        :return: tuple: (SOA serial or None if the zone has no SOA record, hash of MX, TXT and mail.domain.tld
+                 records, SPF include setting and local_ip)
+        """
+        serial = None
+        records = []
+        for item in zone_dump:
+            if item['type'] == 'SOA':
+                serial = str(item['serial'])
+            elif item['type'] in ('MX', 'TXT') or item.get('name', '').strip('.') == 'mail.' + domain:
+                # zone file records have str values, dumpzone records unicode, both are hashed the same way
+                records.append(dict((key, value.decode('utf-8', 'replace') if isinstance(value, str) else value)
+                                    for key, value in item.iteritems() if key not in ('Line', 'Lines')))
+        records.sort(key=lambda record: json.dumps(record, sort_keys=True))
+
+        return serial, hashlib.sha1(json.dumps([records, self.spf_includes, local_ip], sort_keys=True)).hexdigest()
+
+    def check_settings(self, local_ip):
+        """
+        Returns hash of the settings zone checks depend on (SPF include and IP address of mail.domain.tld)
+        """
+        return hashlib.sha1(json.dumps([self.spf_includes, local_ip])).hexdigest()
+
+    def zone_serial_unchanged(self, domain, local_ip):
+        """
+        Returns True if the zone was compliant in the last run, check settings didn't change and SOA serial in the
+        local zone file is the stored one. Zone is then skipped without reading all of its records or dumping it.
+
+        :param domain:
+        :param local_ip: IP address mail.domain.tld has to point to
+        """
+        state = self.zone_state.get(domain)
+        if not self.serial_reader or not state or state['result'] != 'compliant' or \
+                state.get('settings') != self.check_settings(local_ip):
+            return False
+
+        serial = self.serial_reader.read_serial(domain)
+
+        return serial is not None and serial == state['serial']
 
-        self.domain_resolving.setdefault(domain, {})['NS'] = ns_records
-        self.domain_resolving[domain]['A'] = a
-        self.domain_resolving[domain]['MX'] = mx
-        self.domain_resolving[domain]['TXT'] = txt
+    def zone_unchanged(self, domain, fingerprint):
+        """
+        Returns True if the zone was compliant in the last run and its serial and records didn't change since
+
+        :param domain:
+        :param fingerprint: (serial, hash) tuple, see zone_fingerprint()
+        """
+        state = self.zone_state.get(domain)
+        if not state or state['result'] != 'compliant':
+            return False
+
+        return fingerprint[0] is not None and fingerprint == (state['serial'], state['fingerprint'])
+
+    def remember_zone(self, domain, result, local_ip, fingerprint=(None, None)):
+        """
+        Stores the check result of a zone, saved to the state file by save_zone_state()
+
+        :param domain:
+        :param result: compliant, fixed or failed
+        :param local_ip: IP address mail.domain.tld has to point to
+        :param fingerprint: (serial, hash) tuple of the checked zone, see zone_fingerprint()
+        """
+        self.zone_counts['checked'] += 1
+        self.zone_counts[result] += 1
+        if self.state_store:
+            serial, fingerprint = fingerprint
+            self.new_zone_state[domain] = {'serial': serial, 'fingerprint': fingerprint,
+                                           'settings': self.check_settings(local_ip), 'result': result,
+                                           'checked': time.time()}
+
+    def save_zone_state(self, complete):
+        """
+        Saves zone states of this run to the state file
+
+        :param complete: True if all domains were checked, states of domains no longer on the server are removed
+        """
+        if not self.state_store:
+            return
+
+        def merge(stored):
+            stored.update(self.new_zone_state)
+            if complete:
+                for domain in stored.keys():
+                    if domain not in self.domain_resolving:
+                        del stored[domain]
+            return stored
+
+        self.state_store.update(merge)
 
     def prepare_data(self):
         """
@@ -257,7 +484,22 @@ class dnsFix(object):
          This resolution is done by self.check_ns_resolve
         :return:
         """
-        users_domains = dnsFix.server.get_account_domain_list(owners_users_data=self.owners_users_data)
+        users_domains = server.get_account_domain_list(owners_users_data=self.owners_users_data)
+        self.resolve_domains([domain for user in users_domains.keys() for domain in users_domains[user]])
+
+        # zone files of changed zones are parsed ahead, in the same order as zones are checked below
+        zone_domains = []
+        for owner in self.owners_users_data.keys():
+            for user in sorted(self.owners_users_data[owner].keys()):
+                local_ip = self.owners_users_data[owner][user]['ip']
+                for domain in users_domains[user]:
+                    if not self.zone_check_needed(domain, local_ip):
+                        continue
+                    if self.zone_serial_unchanged(domain, local_ip):
+                        self.unchanged_zones.add(domain)
+                    else:
+                        zone_domains.append(domain)
+        self.read_zone_files(zone_domains)
 
         for owner in self.owners_users_data.keys():
             log_msg = '\n\nOWNER: %s' % owner
@@ -271,30 +513,59 @@ class dnsFix(object):
                 self.owners_users_data[owner][user]['domains'] = user_domains
 
                 for domain in user_domains:
-                    self.resolve_domain(domain)
                     log_msg = 'D: ', domain
                     self.output_and_log(log_msg)
                     log_msg = 'MX Resolve: ', self.domain_resolving[domain]['MX']
                     self.output_and_log(log_msg)
 
-                    mx_resolve = self.domain_resolving[domain]['MX']
                     # domain has MX records, uses our nameserver cluster and mails resolving locally
-                    if mx_resolve and self.check_ns_resolve(domain) and \
-                                        self.owners_users_data[owner][user]['ip'] in mx_resolve[0][1]:
+                    local_ip = self.owners_users_data[owner][user]['ip']
+                    if self.zone_check_needed(domain, local_ip):
+                        if domain in self.unchanged_zones:
+                            self.zone_counts['skipped'] += 1
+                            self.output_and_log('Zone %s is compliant and its serial is unchanged since the last '
+                                                'check.' % domain)
+                            continue
+
                         zone_dump = self.dump_domain(domain)
 
                         if zone_dump:
-                            self.check_txt_record(domain, zone_dump)
-                            self.check_MX_record(domain, zone_dump, self.owners_users_data[owner][user]['ip'])
+                            fingerprint = self.zone_fingerprint(domain, zone_dump, local_ip)
+                            if self.zone_unchanged(domain, fingerprint):
+                                self.zone_counts['skipped'] += 1
+                                self.output_and_log('Zone %s is compliant and unchanged since the last check.'
+                                                    % domain)
+                                continue
+
+                            plan = []
+                            self.check_txt_record(domain, zone_dump, plan)
+                            self.check_MX_record(domain, zone_dump, local_ip, plan)
+                            if not plan:
+                                self.remember_zone(domain, 'compliant', local_ip, fingerprint)
+                            elif self.apply_zone_plan(domain, zone_dump, plan):
+                                self.remember_zone(domain, 'fixed', local_ip, fingerprint)
+                            else:
+                                self.remember_zone(domain, 'failed', local_ip, fingerprint)
                         else:
                             log_msg = "ERROR: Unable to dump zone %s: \n %s" % (domain, zone_dump)
                             self.output_and_log(log_msg)
+                            self.remember_zone(domain, 'failed', local_ip)
                     else:
                         reason = "REASON: Domain %s not resolving to our servers or domain ignored." % domain
                         log_msg = "Skipped:", domain, reason
                         self.output_and_log(log_msg)
 
-    def report(self):
+    def report(self, error=''):
+        self.save_zone_state(complete=not error)
+
+        zone_counts = "\nZones skipped (unchanged): %(skipped)s, checked: %(checked)s (compliant: %(compliant)s, " \
+                      "fixed: %(fixed)s, failed: %(failed)s)" % self.zone_counts
+        self.output_and_log(zone_counts)
+        if self.zone_reader:
+            zone_sources = "Zones read from zone files: %s, dumped through the API: %s" % (
+                self.zone_sources['zone file'], self.zone_sources['API'])
+            self.output_and_log(zone_sources)
+
         if len(self.dump_zone_fails) > 0:
             log_msg = "\n\nZONES WITH DUMP ERRORS:"
             self.output_and_log(log_msg)
@@ -302,18 +573,35 @@ class dnsFix(object):
                 self.output_and_log(domain)
 
         execution_time = "\nExecution took: %s seconds" % (time.time()-self.start)
-        self.report_string.append(execution_time)
-        rs = '\n'.join(self.report_string)
-        dnsFix.server.mail_report(self.__class__.__name__, content=rs)
+        self.report_spool.writeline(execution_time)
+        self.report_spool.add_summary('Domains: %s, zones with dump errors: %s' % (len(self.domain_resolving),
+                                                                                   len(self.dump_zone_fails)))
+        self.report_spool.add_summary(zone_counts.strip())
+        if self.zone_reader:
+            self.report_spool.add_summary(zone_sources)
+        self.report_spool.add_summary(execution_time.strip())
+        server.mail_report(self.__class__.__name__, spool=self.report_spool, error=error)
 
 
 if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--full', action='store_true', default=False,
+                      help='check all zones, including zones that are unchanged since the last check')
+    options, args = parser.parse_args()
+
+    server = Server()
+
     try:
-        gmailFix = dnsFix()
-        gmailFix.prepare_data()
-        gmailFix.report()
+        gmailFix = dnsFix(full=options.full)
+        try:
+            gmailFix.prepare_data()
+        except RunDeadlineExceeded, err:
+            gmailFix.output_and_log('\n\nRUN ABORTED: %s, remaining domains were not checked' % err)
+            gmailFix.report(error='ABORTED: ')
+        else:
+            gmailFix.report()
     except Exception , err:
         err = 'Error executing script! \n %s' % repr(err)
-        dnsFix.server.mail_report('dnsFix.py', content=err, error='ERROR: ')
+        server.mail_report('dnsFix.py', content=err, error='ERROR: ')
 
 
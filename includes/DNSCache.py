@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from includes.FileStore import FileStore
+
+
+class HostCache(object):
+    """
+    Thread safe in-memory cache of host address lookups.
+    Entries expire with the TTL of the DNS answer, least recently used entries are evicted
+    when the cache grows over max_entries.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(host):
+        return host.lower().rstrip('.')
+
+    def get(self, host, max_age=None):
+        """
+        Arguments:
+            host: host name
+            max_age: if set, entries stored more than max_age seconds ago are ignored
+
+        Returns:
+            tuple: (True, cached value) if host is cached and not expired, (False, None) otherwise
+        """
+        key = self._key(host)
+
+        self.lock.acquire()
+        try:
+            now = time.time()
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > now and (max_age is None or now - entry[1] <= max_age):
+                # re-insert to mark the entry as most recently used
+                self.entries[key] = entry
+                self.hits += 1
+                return True, entry[2]
+
+            self.misses += 1
+            return False, None
+        finally:
+            self.lock.release()
+
+    def set(self, host, value, ttl):
+        """
+        Stores value for the host for ttl seconds
+        """
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+
+        key = self._key(host)
+
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+            now = time.time()
+            self.entries[key] = (now + ttl, now, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: cache counters
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries)}
+
+
+class PersistentDNSCache(object):
+    """
+    DNS answers cache stored on disk and shared between the scripts.
+    Entries are stored as {(domain, dns_type): (stored_at, expires, records)}, negative answers are
+    stored with records set to False.
+    Cache is loaded once at start, new answers are merged into the file by save().
+    """
+
+    def __init__(self, path):
+        self.store = FileStore(path)
+        self.lock = threading.Lock()
+        self.new_entries = {}
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+
+        now = time.time()
+        self.entries = dict((key, entry) for key, entry in self.store.load().iteritems() if entry[1] > now)
+
+    @staticmethod
+    def _key(domain, dns_type):
+        return domain.lower().rstrip('.'), dns_type
+
+    def get(self, domain, dns_type, max_age=None):
+        """
+        Arguments:
+            domain: queried domain
+            dns_type: type of DNS entry
+            max_age: if set, answers stored more than max_age seconds ago are ignored
+
+        Returns:
+            tuple: (True, records, remaining TTL) if valid answer is cached, (False, None, 0) otherwise
+        """
+        key = self._key(domain, dns_type)
+
+        self.lock.acquire()
+        try:
+            now = time.time()
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now and (max_age is None or now - entry[0] <= max_age):
+                self.hits += 1
+                return True, entry[2], entry[1] - now
+
+            self.misses += 1
+            return False, None, 0
+        finally:
+            self.lock.release()
+
+    def set(self, domain, dns_type, records, ttl):
+        """
+        Stores records (False for negative answers) for ttl seconds
+        """
+        if ttl <= 0:
+            return
+
+        key = self._key(domain, dns_type)
+        now = time.time()
+
+        self.lock.acquire()
+        try:
+            self.entries[key] = self.new_entries[key] = (now, now + ttl, records)
+        finally:
+            self.lock.release()
+
+    def save(self):
+        """
+        Merges answers resolved during this run into the cache file, expired entries are dropped
+        """
+        self.lock.acquire()
+        try:
+            new_entries = self.new_entries
+            self.new_entries = {}
+        finally:
+            self.lock.release()
+
+        if not new_entries:
+            return
+
+        def merge(stored):
+            now = time.time()
+            merged = dict((key, entry) for key, entry in stored.iteritems() if entry[1] > now)
+            for key, entry in new_entries.iteritems():
+                if key not in merged or merged[key][0] < entry[0]:
+                    merged[key] = entry
+
+            return merged
+
+        self.store.update(merge)
+
+    def stats(self):
+        """
+        Returns:
+            dict: cache counters
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import threading
+
+
+class DomainRoutingIndex(object):
+    """
+    Mail routing of server domains from /etc/localdomains and /etc/remotedomains, kept in sets for constant time
+    membership checks. Both files are read once, route changes made during the run are applied with set_route().
+
+    Usage:
+        routing = DomainRoutingIndex('/etc/localdomains', '/etc/remotedomains')
+        routing.is_remote('domain.tld')
+        routing.set_route('domain.tld', 'local')
+    """
+
+    ROUTES = ('local', 'remote')
+
+    def __init__(self, localdomains_file=None, remotedomains_file=None):
+        self.domains = {'local': set(), 'remote': set()}
+        # routes are changed from LocRem worker threads
+        self.lock = threading.Lock()
+
+        if localdomains_file:
+            self.load('local', localdomains_file)
+        if remotedomains_file:
+            self.load('remote', remotedomains_file)
+
+    def load(self, route, filename):
+        """
+        Adds domains listed in filename (one domain per line) to the route
+        """
+        f = open(filename, 'r')
+        try:
+            self.domains[route].update(domain for domain in (line.strip() for line in f) if domain)
+        finally:
+            f.close()
+
+    def is_local(self, domain):
+        return domain in self.domains['local']
+
+    def is_remote(self, domain):
+        return domain in self.domains['remote']
+
+    def route(self, domain):
+        """
+        Returns:
+            str: 'local', 'remote' or None if domain is not listed in any of the files
+        """
+        for route in self.ROUTES:
+            if domain in self.domains[route]:
+                return route
+
+        return None
+
+    def set_route(self, domain, route):
+        """
+        Moves domain to the route, after its mail routing was changed
+        """
+        if route not in self.ROUTES:
+            raise ValueError('Unknown mail route %r' % route)
+
+        self.lock.acquire()
+        try:
+            for other_route in self.ROUTES:
+                self.domains[other_route].discard(domain)
+            self.domains[route].add(domain)
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.domains['local']) + len(self.domains['remote'])
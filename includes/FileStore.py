@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import cPickle
+import fcntl
+import os
+
+
+class FileStore(object):
+    """
+    Pickled dictionary kept on disk and shared between scripts running at the same time.
+    Reads are done under shared lock, updates under exclusive lock of the <path>.lock file.
+    New content is written to a temporary file and renamed over the old one, so readers never see
+    partially written data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lockfile = path + '.lock'
+
+    def _lock(self, operation):
+        lock = open(self.lockfile, 'a')
+        fcntl.flock(lock.fileno(), operation)
+
+        return lock
+
+    def _read(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return {}
+
+        try:
+            try:
+                data = cPickle.load(f)
+            except Exception:
+                # corrupted or incompatible store is discarded
+                return {}
+        finally:
+            f.close()
+
+        if isinstance(data, dict):
+            return data
+        else:
+            return {}
+
+    def load(self):
+        """
+        Returns:
+            dict: stored data, empty dictionary if the store does not exist or can't be read
+        """
+        lock = self._lock(fcntl.LOCK_SH)
+        try:
+            return self._read()
+        finally:
+            lock.close()
+
+    def update(self, merge):
+        """
+        Replaces stored data with the result of merge(stored_data) while holding exclusive lock
+
+        :param merge: function accepting currently stored dictionary and returning the new one
+        :return: dict: data written to the store
+        """
+        # tempfile (and random, hashlib it imports) is loaded only by runs writing the store
+        import tempfile
+
+        lock = self._lock(fcntl.LOCK_EX)
+        try:
+            data = merge(self._read())
+
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self.path),
+                                            dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                f = os.fdopen(fd, 'wb')
+                try:
+                    cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                os.rename(tmp_path, self.path)
+            except:
+                os.unlink(tmp_path)
+                raise
+
+            return data
+        finally:
+            lock.close()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import bisect
+import socket
+
+
+class IPRangeIndex(object):
+    """
+    Index of IPv4 and IPv6 ranges for fast IP membership checks.
+    Ranges are converted once to sorted, merged integer intervals per address family,
+    every lookup is a single bisection.
+
+    Usage:
+        index = IPRangeIndex(['178.218.172.160/27', '2001:db8::/32'])
+        '178.218.172.170' in index
+    """
+
+    FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+    def __init__(self, ranges=()):
+        intervals = {4: [], 6: []}
+        for iprange in ranges:
+            iprange = iprange.strip()
+            if iprange:
+                version, start, end = self.parse_range(iprange)
+                intervals[version].append((start, end))
+
+        self.starts = {}
+        self.ends = {}
+        for version, family_intervals in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(family_intervals):
+                if ends and start <= ends[-1] + 1:
+                    # overlapping or adjacent ranges are merged
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[version] = starts
+            self.ends[version] = ends
+
+    @classmethod
+    def ip_to_int(cls, ip):
+        """
+        Returns:
+            tuple: (IP version, integer value of the address)
+
+        Raises:
+            ValueError: if ip is not a valid IPv4 or IPv6 address
+        """
+        version = ':' in ip and 6 or 4
+        try:
+            packed = socket.inet_pton(cls.FAMILIES[version][0], ip)
+        except (socket.error, TypeError):
+            raise ValueError('Invalid IP address %r' % ip)
+
+        return version, int(packed.encode('hex'), 16)
+
+    @classmethod
+    def parse_range(cls, iprange):
+        """
+        Arguments:
+            iprange: network in CIDR notation, or single address
+
+        Returns:
+            tuple: (IP version, first address, last address) with addresses as integers
+
+        Raises:
+            ValueError: if iprange is not a valid network
+        """
+        ip, _, prefix = iprange.partition('/')
+        version, address = cls.ip_to_int(ip.strip())
+        bits = cls.FAMILIES[version][1]
+        try:
+            prefix = prefix and int(prefix) or bits
+        except ValueError:
+            raise ValueError('Invalid network prefix in %r' % iprange)
+        if not 0 <= prefix <= bits:
+            raise ValueError('Invalid network prefix in %r' % iprange)
+
+        host_bits = bits - prefix
+        start = address >> host_bits << host_bits
+
+        return version, start, start + (1 << host_bits) - 1
+
+    def __contains__(self, ip):
+        """
+        Returns:
+            bool: True if ip is inside any of the ranges, False for addresses outside the ranges and invalid input
+        """
+        try:
+            version, address = self.ip_to_int(ip)
+        except (ValueError, TypeError):
+            return False
+
+        position = bisect.bisect_right(self.starts[version], address) - 1
+
+        return position >= 0 and address <= self.ends[version][position]
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
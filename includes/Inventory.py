@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import cPickle
+import os
+import time
+
+from includes.FileStore import FileStore
+
+
+class InventorySnapshot(object):
+    """
+    Account and domain inventory (listaccts accounts, domain records, suspended accounts...) shared between
+    script runs through a FileStore (pickled with the highest protocol).
+
+    Snapshot is valid while modification times of the watched files and directories are the same as when it was
+    created (cPanel rewrites /etc/trueuserdomains, /etc/userdatadomains and /var/cpanel/users when accounts and
+    domains change) and it is not older than max_age seconds.
+    Snapshot sections are added as the scripts load them, a script needing data that is not in the snapshot yet
+    loads it from the server and adds it. Every section is pickled separately, so a run unpickles only the sections
+    it uses, and every get() returns a new copy the caller can change.
+
+    Usage:
+        snapshot = InventorySnapshot('/var/cache/cpaneltools/inventory', ['/etc/userdatadomains'])
+        accounts = snapshot.get('accounts')
+        if accounts is None:
+            accounts = load_accounts()
+            snapshot.put('accounts', accounts)
+    """
+
+    def __init__(self, path, watched, max_age=3600):
+        self.store = FileStore(path)
+        self.watched = watched
+        self.max_age = max_age
+        self.key = None
+        self.data = None
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+    def _watched_mtimes(self):
+        """
+        Returns:
+            dict: {path: modification time, None if path doesn't exist}
+        """
+        mtimes = {}
+        for path in self.watched:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+
+        return mtimes
+
+    def _valid(self, stored):
+        return stored.get('key') == self.key and time.time() - stored.get('created', 0) < self.max_age
+
+    def _load(self):
+        if self.data is not None:
+            return
+
+        # key is taken before any section is loaded, changes made while loading invalidate the snapshot
+        self.key = self._watched_mtimes()
+        stored = self.store.load()
+        if stored and not self._valid(stored):
+            self.stats['invalidated'] += 1
+            stored = {}
+        self.data = stored.get('sections', {})
+
+    def get(self, section):
+        """
+        Returns:
+            section data, None if the section is not in the valid snapshot
+        """
+        self._load()
+        if section in self.data:
+            self.stats['hits'] += 1
+            return cPickle.loads(self.data[section])
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, section, value):
+        """
+        Adds section to the snapshot, a new snapshot is started if the stored one is not valid anymore
+        """
+        self._load()
+        pickled = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        self.data[section] = pickled
+
+        def merge(stored):
+            if not stored or not self._valid(stored):
+                stored = {'key': self.key, 'created': time.time(), 'sections': {}}
+            stored['sections'][section] = pickled
+            return stored
+
+        self.store.update(merge)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import os
+import re
+import stat
+import time
+
+# Maildir++ recommends recalculating maildirsize once it grows over 5120 bytes
+MAILDIRSIZE_MAX_BYTES = 5120
+# message size in Maildir file names, 1700000000.M1P2.host,S=2345,W=2400:2,S
+SIZE_IN_NAME = re.compile(r',S=(\d+)')
+
+
+def read_maildirsize(path, max_age):
+    """
+    Reads mailbox size from Maildir++ maildirsize file (quota line followed by '<bytes> <messages>' lines)
+
+    Arguments:
+        path: maildirsize file path
+        max_age: file older than max_age seconds is stale (0 disables the check)
+
+    Returns:
+        int: mailbox size in bytes, None if the file is missing, stale, a symbolic link or can't be parsed
+    """
+    try:
+        info = os.lstat(path)
+        if not stat.S_ISREG(info.st_mode) or info.st_size > MAILDIRSIZE_MAX_BYTES or \
+                (max_age and time.time() - info.st_mtime > max_age):
+            return None
+
+        f = open(path)
+        try:
+            lines = f.read().splitlines()[1:]
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+    size = 0
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            size += int(fields[0])
+        except ValueError:
+            return None
+
+    return max(size, 0)
+
+
+def is_real_dir(path):
+    """
+    Returns:
+        bool: True if path is a directory and not a symbolic link
+    """
+    try:
+        return stat.S_ISDIR(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+
+def maildir_size(path):
+    """
+    Sums message sizes in all folders of the Maildir (cur and new directories of the mailbox and its subfolders).
+    Message size is taken from the ',S=' part of the file name when present, other files are stat-ed.
+    Symbolic links are not followed, they could point back into the Maildir or into mailboxes of other accounts.
+
+    Returns:
+        int: size in bytes
+    """
+    size = 0
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+
+        in_messages = os.path.basename(directory) in ('cur', 'new')
+        for name in names:
+            if in_messages:
+                match = SIZE_IN_NAME.search(name)
+                if match:
+                    size += int(match.group(1))
+                    continue
+                try:
+                    size += os.lstat(os.path.join(directory, name)).st_size
+                except OSError:
+                    # message moved or deleted while scanning
+                    pass
+            elif name in ('cur', 'new') or name.startswith('.'):
+                if is_real_dir(os.path.join(directory, name)):
+                    directories.append(os.path.join(directory, name))
+
+    return size
+
+
+def mailbox_usage(path, max_age):
+    """
+    Returns:
+        tuple: (mailbox size in bytes, 'maildirsize' or 'scan' depending on how the size was read)
+    """
+    size = read_maildirsize(os.path.join(path, 'maildirsize'), max_age)
+    if size is not None:
+        return size, 'maildirsize'
+
+    return maildir_size(path), 'scan'
+
+
+def account_mailboxes(home):
+    """
+    Lists mailboxes of a cPanel account, stored as <home>/mail/<domain>/<mailbox>.
+    Linked mail and domain directories are skipped.
+
+    Returns:
+        list: (email, mailbox path) tuples, None if the account has no mail directory
+    """
+    mail_dir = os.path.join(home, 'mail')
+    if not is_real_dir(mail_dir):
+        return None
+    try:
+        domains = os.listdir(mail_dir)
+    except OSError:
+        return None
+
+    mailboxes = []
+    for domain in sorted(domains):
+        # default account folders (.Sent, cur, new, ...) are not domains
+        if domain.startswith('.') or '.' not in domain or not is_real_dir(os.path.join(mail_dir, domain)):
+            continue
+        try:
+            boxes = os.listdir(os.path.join(mail_dir, domain))
+        except OSError:
+            continue
+        for box in sorted(boxes):
+            path = os.path.join(mail_dir, domain, box)
+            if not box.startswith('.') and is_real_dir(path):
+                mailboxes.append(('%s@%s' % (box, domain), path))
+
+    return mailboxes
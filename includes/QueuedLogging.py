@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import Queue
+import logging
+import threading
+
+
+class QueuedFileHandler(logging.Handler):
+    """
+    Log file handler for the 'queued_logging' mode.
+    emit() only puts the record into a queue, background thread formats queued records and writes them
+    to the log file in batches, with one flush per batch.
+
+    Records are written in the same format as logging.FileHandler with the same formatter would write them.
+    Queue is written out when the handler is flushed or closed (logging.shutdown() does both at exit).
+    """
+
+    def __init__(self, filename, mode='a', batch_size=500):
+        logging.Handler.__init__(self)
+        self.file_handler = logging.FileHandler(filename, mode=mode, delay=True)
+        self.batch_size = batch_size
+        self.queue = Queue.Queue()
+        self.closed = False
+
+        self.writer = threading.Thread(target=self._write_queue, name='QueuedFileHandler(%s)' % filename)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.file_handler.setFormatter(fmt)
+
+    def emit(self, record):
+        # message is rendered now, arguments could be changed before the writer formats the record
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def _write_queue(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            records = [record for record in batch if record is not None]
+            stop = len(records) < len(batch)
+            try:
+                self._write(records)
+            finally:
+                for i in range(len(batch)):
+                    self.queue.task_done()
+
+    def _write(self, records):
+        if not records:
+            return
+
+        handler = self.file_handler
+        handler.acquire()
+        try:
+            if handler.stream is None:
+                handler.stream = handler._open()
+            for record in records:
+                try:
+                    handler.stream.write(handler.format(record) + '\n')
+                except Exception:
+                    handler.handleError(record)
+            handler.stream.flush()
+        finally:
+            handler.release()
+
+    def flush(self):
+        """
+        Waits until all queued records are written
+        """
+        if not self.closed:
+            self.queue.join()
+
+    def close(self):
+        """
+        Writes queued records, stops the writer thread and closes the log file
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.writer.join()
+            self.file_handler.close()
+        logging.Handler.close(self)
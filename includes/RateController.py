@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import threading
+import time
+
+
+class RateController(object):
+    """
+    Limits the number of API calls running at the same time to a concurrency window.
+    Window is adjusted AIMD style from observed calls:
+        - every fast and successful call grows the window by 1/window (about +1 per window of calls)
+        - slow (over target_latency) or failed call multiplies the window with decrease factor,
+          at most once per target_latency seconds, so one burst of slow calls counts as one congestion event
+    """
+
+    def __init__(self, min_window=1, max_window=4, target_latency=2.0, decrease=0.5):
+        self.min_window = float(min_window)
+        self.max_window = float(max(max_window, min_window))
+        self.target_latency = target_latency
+        self.decrease = decrease
+
+        self.window = self.min_window
+        self.active = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+        # statistics
+        self.calls = 0
+        self.errors = 0
+        self.slow_calls = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.lowest_window = self.window
+        self.highest_window = self.window
+
+    def acquire(self):
+        """
+        Blocks until the call fits into the concurrency window
+        """
+        self.condition.acquire()
+        try:
+            if self.active >= int(self.window):
+                self.waits += 1
+                start = time.time()
+                while self.active >= int(self.window):
+                    self.condition.wait()
+                self.wait_time += time.time() - start
+            self.active += 1
+        finally:
+            self.condition.release()
+
+    def release(self, latency, error=False):
+        """
+        Marks the call as finished and adjusts the window
+
+        Arguments:
+            latency: call duration in seconds
+            error: True if call failed or timed out
+        """
+        self.condition.acquire()
+        try:
+            self.active -= 1
+            self.calls += 1
+            if error:
+                self.errors += 1
+            slow = latency > self.target_latency
+            if slow:
+                self.slow_calls += 1
+
+            now = time.time()
+            if error or slow:
+                if now - self.last_decrease > self.target_latency:
+                    self.window = max(self.min_window, self.window * self.decrease)
+                    self.last_decrease = now
+            else:
+                self.window = min(self.max_window, self.window + 1.0 / self.window)
+
+            self.lowest_window = min(self.lowest_window, self.window)
+            self.highest_window = max(self.highest_window, self.window)
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+    def stats(self):
+        """
+        Returns:
+            dict: controller statistics
+        """
+        return {'calls': self.calls, 'errors': self.errors, 'slow_calls': self.slow_calls, 'waits': self.waits,
+                'wait_time': self.wait_time, 'window': self.window, 'lowest_window': self.lowest_window,
+                'highest_window': self.highest_window}
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import gzip
+import shutil
+import tempfile
+
+
+class ReportSpool(object):
+    """
+    Report written section by section to a temporary spool file instead of a string in memory.
+    Server.mail_report(spool=...) sends the spool content, either as mail body or as a (gzipped)
+    attachment with summary lines in the mail body.
+
+    Usage:
+        spool = ReportSpool()
+        spool.write('OWNER ...\\n')
+        spool.add_summary('Domains: 20000')
+        server.mail_report('ResolvingReport', spool=spool)
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        # unnamed temporary file, removed by the OS when closed or when the process exits
+        self.file = tempfile.TemporaryFile(prefix='cpaneltools-report-', dir=directory)
+        self.size = 0
+        self.lines = 0
+        self.summary = []
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.file.write(text)
+        self.size += len(text)
+        self.lines += text.count('\n')
+
+    def writeline(self, text=''):
+        self.write('%s\n' % text)
+
+    def add_summary(self, line):
+        """
+        Adds a line to the report summary, summary is used as mail body when report is attached
+        """
+        self.summary.append(line)
+
+    def open(self):
+        """
+        Returns:
+            file: spool file positioned at the start of the report, for reading
+        """
+        self.file.flush()
+        self.file.seek(0)
+
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+def gzip_file(source, name, directory=None):
+    """
+    Compresses content of an open file into a new temporary file, in chunks
+
+    Arguments:
+        source: file object positioned at the start of the content
+        name: file name stored in the gzip header
+        directory: directory for the temporary file (system default if None)
+
+    Returns:
+        file: temporary file with gzip data, positioned at the start
+    """
+    compressed = tempfile.TemporaryFile(prefix='cpaneltools-report-', dir=directory)
+    gz = gzip.GzipFile(name, 'wb', 9, compressed)
+    try:
+        shutil.copyfileobj(source, gz)
+    finally:
+        gz.close()
+    compressed.seek(0)
+
+    return compressed
@@ -7,35 +7,64 @@ __status__ = "Development"
 """
 # TODO: Napisi configtest funkcionalnost
 
-import smtplib
-import subprocess
 import shlex
 import ConfigParser
 import logging
+import os
 import time
-import yaml
-
-import commands
-import dns.resolver as resolver
-
-try:
-    from email.MIMEText import MIMEText
-except:
-    from email.mime.text import MIMEText
+import atexit
+import json
+import pipes
+import shutil
+import socket
+import StringIO
+import sys
+import threading
+
+from includes.DNSCache import HostCache, PersistentDNSCache
+from includes.Inventory import InventorySnapshot
+from includes.IPRanges import IPRangeIndex
+from includes.QueuedLogging import QueuedFileHandler
+from includes.RateController import RateController
+from includes.Timings import Timings
+from includes.Transport import SubprocessTransport, WHMAPITransport, TransportError, CommandTimeout
+
+# yaml, dnspython, smtplib, email, tempfile and multiprocessing are imported by the methods using them,
+# so scripts (and runs that don't need them) start without loading them
+
+
+class RunDeadlineExceeded(Exception):
+    """
+    Raised by exec_cpanel_api_command() when the run took longer than 'run_deadline' from [Server] section
+    """
+    pass
 
 
 class Server(object):
+    # API command line tools and the output format requested from them
+    API_COMMANDS = ('whmapi1', 'whmapi2', 'cpapi2', 'uapi')
+    API_OUTPUT = '--output=json'
+    # functions that only read data and can be safely retried
+    READ_ONLY_PREFIXES = ('list', 'get', 'show', 'dump', 'domainuserdata')
+
     # account
     LIST_SUSPENDED = 'whmapi1 listsuspended'
     LIST_RESELLERS = 'whmapi1 listresellers'
     LIST_ACCOUNTS = 'whmapi1 listaccts'
     LIST_ACC_DOMAINS = 'uapi --user=USER DomainInfo list_domains'
     LIST_DOMAIN_DATA = 'whmapi1 domainuserdata domain=DOMAIN'
+    LIST_DOMAIN_INFO = 'whmapi1 get_domain_info'
 
     # bandwidth
     GET_BW_DATA = 'whmapi1 showbw'
     SET_BW_DATA = 'whmapi1 limitbw'
 
+    # DNS zones
+    MASS_EDIT_ZONE = 'whmapi1 mass_edit_dns_zone zone=DOMAIN serial=SERIAL'
+    # mass_edit_dns_zone data fields of the record types, in API order
+    ZONE_RECORD_DATA = {'A': ('address',), 'AAAA': ('address',), 'CNAME': ('cname',), 'MX': ('preference', 'exchange'),
+                        'NS': ('nsdname',), 'TXT': ('txtdata',)}
+
     # e-mail
     GET_USER_MAILS = 'whmapi1 list_pops_for user=USER'
     GET_MAIL_DISK_USAGE = 'uapi --user=USERNAME Email get_disk_usage user=USER domain=DOMAIN'
@@ -46,14 +75,58 @@ class Server(object):
 
 
     def __init__(self):
+        self.start = time.time()
+
         # configuration parameters
         self.server_conf = self._read_config(self.__class__.__name__)
         self.logfile = self.server_conf.get('Server', 'logfile')
         self.report_mail = self.server_conf.get('Server', 'reportMail')
 
+        self.userdatadomains_file = self.get_conf_value('Server', 'userdatadomains', '/etc/userdatadomains')
+        self.suspended_dir = self.get_conf_value('Server', 'suspended_dir', '/var/cpanel/suspended')
+        self.trueuserowners_file = self.get_conf_value('Server', 'trueuserowners', '/etc/trueuserowners')
+        self.dns_workers = int(self.get_conf_value('Server', 'dns_workers', 20))
+        self.api_workers = int(self.get_conf_value('Server', 'api_workers', 4))
+        self.api_retries = int(self.get_conf_value('Server', 'api_retries', 2))
+        self.api_retry_backoff = float(self.get_conf_value('Server', 'api_retry_backoff', 1))
+        self.run_deadline = float(self.get_conf_value('Server', 'run_deadline', 0))
+        self.timings = Timings(self.server_conf.has_option('Server', 'timing') and
+                               self.server_conf.getboolean('Server', 'timing'),
+                               int(self.get_conf_value('Server', 'timing_slowest', 10)))
+        self.rate_controller = RateController(
+            min_window=int(self.get_conf_value('Server', 'rate_min_window', 1)),
+            max_window=int(self.get_conf_value('Server', 'rate_max_window', self.api_workers)),
+            target_latency=float(self.get_conf_value('Server', 'rate_target_latency', 2)),
+            decrease=float(self.get_conf_value('Server', 'rate_decrease', 0.5)))
+        self.dns_negative_ttl = int(self.get_conf_value('Server', 'dns_negative_ttl', 300))
+        self.queued_logging = self.server_conf.has_option('Server', 'queued_logging') and \
+            self.server_conf.getboolean('Server', 'queued_logging')
+
         # runtime variables
-        self.hostname = commands.getoutput('hostname')
+        self.hostname = socket.gethostname()
         self.logger = self.set_logger(self.logfile, mode='a')
+        self.host_cache = HostCache(int(self.get_conf_value('Server', 'dns_cache_size', 10000)))
+        self.resolver_configured = False
+        self.resolver_lock = threading.Lock()
+        self.subprocess_transport = SubprocessTransport()
+        self.transport = self._get_transport()
+        self.dns_cache = None
+        self.domain_inventory = None
+        self.domain_userdata = {}
+        self.ns_ranges = None
+        if self.get_conf_value('Server', 'dns_cache_file'):
+            self.dns_cache = PersistentDNSCache(self.get_conf_value('Server', 'dns_cache_file'))
+            atexit.register(self.dns_cache.save)
+        self.inventory = None
+        if self.get_conf_value('Server', 'inventory_file'):
+            # snapshot is invalidated when accounts, domains, resellers or suspensions change
+            watched = [self.get_conf_value('Server', 'trueuserdomains', '/etc/trueuserdomains'),
+                       self.userdatadomains_file,
+                       self.get_conf_value('Server', 'users_dir', '/var/cpanel/users'),
+                       self.get_conf_value('Server', 'resellers', '/var/cpanel/resellers'),
+                       self.suspended_dir]
+            self.inventory = InventorySnapshot(self.get_conf_value('Server', 'inventory_file'), watched,
+                                               float(self.get_conf_value('Server', 'inventory_max_age', 3600)))
 
 
     @staticmethod
@@ -64,104 +137,471 @@ class Server(object):
 
         return config
 
+    def get_conf_value(self, section, option, default=None):
+        """
+        Returns configuration value, or default if the option is not defined in the configuration file
+
+        Arguments:
+            section: configuration file section
+            option: option name
+            default: value returned when option is missing
+        """
+        if self.server_conf.has_option(section, option):
+            return self.server_conf.get(section, option)
+
+        return default
+
+    def _configure_resolver(self):
+        """
+        Points DNS queries to 'dns_nameservers' (comma separated) and 'dns_port' from [Server] section,
+        system resolver configuration is used when they are not set.
+        Called before the first DNS query, runs without DNS queries don't load dnspython.
+        """
+        # first queries run from several resolve_many() workers at once, none of them may query
+        # before the resolver is configured. resolve() checks the flag without the lock, so it is set
+        # only after the nameservers are applied
+        self.resolver_lock.acquire()
+        try:
+            if self.resolver_configured:
+                return
+
+            nameservers = self.get_conf_value('Server', 'dns_nameservers')
+            if nameservers:
+                import dns.resolver as resolver
+                default_resolver = resolver.get_default_resolver()
+                default_resolver.nameservers = [s.strip() for s in nameservers.split(',')]
+                default_resolver.port = int(self.get_conf_value('Server', 'dns_port', 53))
+            self.resolver_configured = True
+        finally:
+            self.resolver_lock.release()
+
+    def _get_transport(self):
+        """
+        Returns transport for cPanel API calls, defined with 'api_transport' in [Server] section:
+            subprocess: runs whmapi1/uapi/cpapi2 command line tools (default)
+            http: calls WHM JSON API over keep-alive connection, authenticated with 'api_token'
+        """
+        if self.get_conf_value('Server', 'api_transport', 'subprocess') == 'http':
+            return WHMAPITransport(self.get_conf_value('Server', 'api_host', '127.0.0.1'),
+                                   self.get_conf_value('Server', 'api_port', 2087),
+                                   self.get_conf_value('Server', 'api_token', ''),
+                                   user=self.get_conf_value('Server', 'api_user', 'root'),
+                                   scheme=self.get_conf_value('Server', 'api_scheme', 'https'),
+                                   verify=self.server_conf.has_option('Server', 'api_ssl_verify') and
+                                   self.server_conf.getboolean('Server', 'api_ssl_verify'))
+
+        return self.subprocess_transport
+
+    def _execute(self, cmd, timeout=None, read_only=False):
+        """
+        Executes command through the configured transport.
+        Commands not supported by the transport, or calls that failed to reach the API, are executed as subprocess.
+        Calls that are not read only are executed again only if the request didn't reach the API, a call that
+        failed after it was sent could have been executed already (suspendacct, mass_edit_dns_zone...).
+
+        Returns:
+            tuple: (output, error)
+
+        Raises:
+            CommandTimeout: if command didn't finish in timeout seconds
+        """
+        if self.transport is not self.subprocess_transport and cmd[0] in self.transport.commands:
+            try:
+                return self.transport.execute(cmd, timeout, resend=read_only)
+            except TransportError, err:
+                if err.sent and not read_only:
+                    return '', '%s transport failed after the request was sent, not executed again: %s' % (
+                        self.transport.name, err)
+                self.logger.info('%s transport failed, executing as subprocess: %s' % (self.transport.name, err))
+
+        return self.subprocess_transport.execute(cmd, timeout)
+
+    @staticmethod
+    def _api_function(cmd):
+        """
+        Returns API function name of the command (listaccts, dumpzone, list_domains...),
+        or command name for commands that are not API calls
+        """
+        positional = [arg for arg in cmd[1:] if not arg.startswith('-') and '=' not in arg]
+        if cmd[0] in ('whmapi1', 'whmapi2') and positional:
+            return positional[0]
+        elif cmd[0] in ('uapi', 'cpapi2') and len(positional) > 1:
+            return positional[1]
+
+        return cmd[0].split('/')[-1]
+
+    def _command_timeout(self, function, ignore_deadline=False):
+        """
+        Returns timeout for the API function, defined in [Timeouts] section by function name
+        ('default' option for all other functions, 300 seconds if not set).
+        Timeout is shortened to the time left until the run deadline, unless ignore_deadline is set.
+
+        Raises:
+            RunDeadlineExceeded: if run deadline has passed
+        """
+        timeout = float(self.get_conf_value('Timeouts', function, self.get_conf_value('Timeouts', 'default', 300)))
+
+        if self.run_deadline and not ignore_deadline:
+            remaining = self.start + self.run_deadline - time.time()
+            if remaining <= 0:
+                raise RunDeadlineExceeded('Run deadline of %s seconds exceeded' % self.run_deadline)
+            timeout = min(timeout, remaining)
+
+        return timeout
+
     @staticmethod
-    def set_logger(logname, formatter='%(asctime)s - %(levelname)s - %(message)s', mode='a'):
+    def parallel_map(func, items, workers):
+        """
+        Applies func to every item using a bounded pool of worker threads
+
+        Arguments:
+            func: function accepting single item
+            items: list of items
+            workers: maximum number of concurrent workers
+
+        Returns:
+            list: results in the same order as items
+        """
+        if not items:
+            return []
+
+        workers = max(1, min(workers, len(items)))
+        if workers == 1:
+            return [func(item) for item in items]
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def set_logger(self, logname, formatter='%(asctime)s - %(levelname)s - %(message)s', mode='a'):
         """
-        Sets file handler for log file
+        Sets file handler for log file, log file is opened on the first logged message ('w' mode log files are
+        truncated right away)
+        With 'queued_logging = 1' in [Server] section records are queued and written to the log file
+        in batches by a background thread (see QueuedFileHandler), log file format stays the same.
         :return: log file handler
         """
         logger = logging.getLogger(logname)
         logger.setLevel(logging.INFO)
-
-        fh = logging.FileHandler(logname, mode=mode)
+        if logger.handlers:
+            # logger for this file is already set up in this process, another handler would duplicate every line
+            return logger
+
+        if mode == 'w':
+            # delayed handler would truncate the file only on the first record, the log of the previous run
+            # would be mailed when nothing is logged
+            open(logname, 'w').close()
+            mode = 'a'
+
+        if self.queued_logging:
+            fh = QueuedFileHandler(logname, mode=mode)
+        else:
+            fh = logging.FileHandler(logname, mode=mode, delay=True)
         formatter = logging.Formatter(formatter)
         fh.setFormatter(formatter)
         logger.addHandler(fh)
 
         return logger
 
-    def resolve(self, domain, dns_type):
+    def _query(self, domain, dns_type, max_age=None):
+        """
+        Queries DNS for the domain and returns the answer as a list of record strings.
+        Answers, including negative ones (NXDOMAIN, no answer), are read from and stored to the
+        persistent cache when 'dns_cache_file' is configured in [Server] section.
+
+        Arguments:
+            domain: domain to query
+            dns_type: type of DNS entry to query
+            max_age: ignore cached answers older than max_age seconds (0 forces fresh query)
+
+        Returns:
+            tuple: (list of record strings or False if no record is found, TTL of the answer)
+        """
+        if self.dns_cache:
+            cached, records, ttl = self.dns_cache.get(domain, dns_type, max_age)
+            if cached:
+                return records, ttl
+
+        import dns.resolver as resolver
+        if not self.resolver_configured:
+            self._configure_resolver()
+
+        query_start = time.time()
+        try:
+            try:
+                answ = resolver.query(domain, dns_type)
+            finally:
+                if self.timings.enabled:
+                    self.timings.record('dns', dns_type, time.time() - query_start, domain)
+        except (resolver.NXDOMAIN, resolver.NoAnswer):
+            records, ttl = False, self.dns_negative_ttl
+        except:
+            # timeouts and server failures are not cached
+            return False, 0
+        else:
+            records, ttl = [str(rdata) for rdata in answ] or False, answ.rrset.ttl
+
+        if self.dns_cache:
+            self.dns_cache.set(domain, dns_type, records, ttl)
+
+        return records, ttl
+
+    def resolve(self, domain, dns_type, max_age=None):
         """
         Get DNS resolving results depending on the dns_type
 
         Arguments:
             domain: domain to query
             dns_type: type of DNS entry to query
+            max_age (optional): ignore cached answers older than max_age seconds (0 forces fresh answers)
 
         Results:
             There are three possible queries and result formats
             A: query data is returned
             list(tuple): list of tuples for every MX record and its resolving IP address
             list(tuple): list of tuples for every NS record and its resolving IP address
+            list: TXT and SOA records as strings
             False: No record found
+
+        A queries (including the MX and NS host lookups) are answered from self.host_cache while the
+        TTL of the cached answer is valid.
         """
-        try:
-            answ = resolver.query(domain, dns_type)
-        except:
+        if dns_type == 'A':
+            cached, records = self.host_cache.get(domain, max_age)
+            if cached:
+                if records:
+                    return list(records)
+                return records
+
+        answ, ttl = self._query(domain, dns_type, max_age)
+
+        if dns_type == 'A' and ttl:
+            self.host_cache.set(domain, answ and list(answ), ttl)
+
+        if not answ:
             return False
 
         records = []
         for rdata in answ:
             if dns_type == 'A':
-                records.append(str(rdata))
+                records.append(rdata)
             elif dns_type == 'MX':
-                if rdata:
-                    mx_record = str(rdata).split()[1].strip('.')
-                    a_record_mx = self.resolve(mx_record, 'A')
-                    if a_record_mx:
-                        records.append((mx_record, a_record_mx))
+                mx_record = rdata.split()[1].strip('.')
+                a_record_mx = self.resolve(mx_record, 'A', max_age)
+                if a_record_mx:
+                    records.append((mx_record, a_record_mx))
             elif dns_type == 'NS':
-                if rdata:
-                    ns_record = str(rdata).strip('.')
-                    a_record_ns = self.resolve(ns_record, 'A')
-                    if a_record_ns:
-                        records.append((ns_record, a_record_ns[0]))
-            elif dns_type == 'TXT':
-                if rdata:
-                    records.append(str(rdata))
+                ns_record = rdata.strip('.')
+                a_record_ns = self.resolve(ns_record, 'A', max_age)
+                if a_record_ns:
+                    records.append((ns_record, a_record_ns[0]))
+            elif dns_type in ('TXT', 'SOA'):
+                records.append(rdata)
 
         if len(records) > 0:
             return records
         else:
             return False
 
+    def resolve_many(self, domains, types=('A', 'MX', 'NS'), workers=None, max_age=None):
+        """
+        Resolves list of domains for every dns_type concurrently, using a pool of worker threads
+
+        Arguments:
+            domains: list of domains to query
+            types: DNS entry types to query for every domain
+            workers: number of concurrent queries ([Server] dns_workers by default)
+            max_age: ignore cached answers older than max_age seconds (see resolve())
+
+        Returns:
+            dict: {domain: {dns_type: result}}, result is in the same format as resolve() returns
+        """
+        if workers is None:
+            workers = self.dns_workers
+
+        unique_domains = []
+        seen = set()
+        for domain in domains:
+            if domain not in seen:
+                seen.add(domain)
+                unique_domains.append(domain)
+
+        queries = [(domain, dns_type) for domain in unique_domains for dns_type in types]
+        answers = self.parallel_map(lambda query: self.resolve(query[0], query[1], max_age), queries, workers)
+
+        results = {}
+        for (domain, dns_type), answer in zip(queries, answers):
+            results.setdefault(domain, {})[dns_type] = answer
+
+        return results
+
+    def is_our_nameserver(self, ip):
+        """
+        Checks if IP address is inside name server IP ranges ('ns_ipranges' in [Server] section).
+        Range index is built on the first call and reused for the rest of the run.
+
+        Arguments:
+            ip: IPv4 or IPv6 address
+
+        Returns:
+            bool: True if ip belongs to our name servers
+        """
+        if self.ns_ranges is None:
+            self.ns_ranges = IPRangeIndex(self.get_conf_value('Server', 'ns_ipranges', '').split(','))
+
+        return ip in self.ns_ranges
+
+    def uses_our_nameservers(self, ns_records):
+        """
+        Arguments:
+            ns_records: NS resolving result, list of (name server, IP address) tuples as returned by resolve()
+
+        Returns:
+            bool: True as soon as one of the name servers resolves to our name server IP ranges
+        """
+        if not ns_records:
+            return False
+
+        for ns in ns_records:
+            if self.is_our_nameserver(ns[1]):
+                return True
+
+        return False
+
+    @staticmethod
+    def _suspension_details(owner, reason, suspendtime, unixtime):
+        """
+        Returns:
+            dict: suspended user details, suspendperiod is the number of days since suspension
+        """
+        return {'owner': owner, 'reason': reason, 'suspendtime': suspendtime, 'unixtime': unixtime,
+                'suspendperiod': round((time.time() - unixtime) / 3600 / 24, 0)}
+
+    def _read_trueuserowners(self):
+        """
+        Reads account owners from /etc/trueuserowners ('trueuserowners' in [Server] section)
+        Line format: user: owner
+
+        Returns:
+            dict: {user: owner}
+        """
+        owners = {}
+        f = open(self.trueuserowners_file, 'r')
+        try:
+            for line in f:
+                user, _, owner = line.partition(':')
+                if owner:
+                    owners[user.strip()] = owner.strip()
+        finally:
+            f.close()
+
+        return owners
+
+    def _read_suspended_dir(self):
+        """
+        Reads suspended accounts from marker files in /var/cpanel/suspended ('suspended_dir' in [Server] section).
+        Every suspended user has a file named by the user, containing the suspension reason, suspension time is
+        the file modification time. Files with a dot in the name (user.lock) are not suspension markers.
+
+        Returns:
+            dict: {user: details}, same as get_suspended_user_data()
+
+        Raises:
+            IOError, OSError: if the directory or /etc/trueuserowners can't be read
+        """
+        owners = self._read_trueuserowners()
+
+        suspended_users_data = {}
+        for user in os.listdir(self.suspended_dir):
+            if '.' in user:
+                continue
+            path = os.path.join(self.suspended_dir, user)
+            try:
+                unixtime = os.stat(path).st_mtime
+                f = open(path, 'r')
+                try:
+                    reason = f.read().strip()
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                # user unsuspended while reading
+                continue
+
+            suspended_users_data[user] = self._suspension_details(owners.get(user, ''), reason or 'Unknown',
+                                                                  time.ctime(unixtime), unixtime)
+
+        return suspended_users_data
+
     def get_suspended_user_data(self):
         """
         populates suspended_user_data dictionary with suspended user data
+        Suspended accounts are read from /var/cpanel/suspended, listsuspended API call is used if the
+        directory can't be read.
 
         Returns:
             dict: {users: {details}}
         """
+        suspended_users_data = self._inventory_section('suspended', self._load_suspended_user_data)
+        if not suspended_users_data:
+            return suspended_users_data
+
+        # suspension periods of a stored snapshot are counted until now
+        return dict((user, self._suspension_details(details['owner'], details['reason'], details['suspendtime'],
+                                                    details['unixtime']))
+                    for user, details in suspended_users_data.items())
+
+    def _load_suspended_user_data(self):
         try:
-            data = yaml.load(self.exec_cpanel_api_command(Server.LIST_SUSPENDED))
-        except:
-            print ("Error loading yaml data from %s command output (Is dry run set to 1?)" % Server.LIST_SUSPENDED)
-            data = ''
+            return self._read_suspended_dir()
+        except (IOError, OSError), err:
+            self.logger.info('Unable to read suspended accounts from %s (%s), loading them with %s' %
+                             (self.suspended_dir, err, Server.LIST_SUSPENDED))
+
+        data = self.api_call(Server.LIST_SUSPENDED)
+        if not data:
+            print ("Error loading data from %s command output (Is dry run set to 1?)" % Server.LIST_SUSPENDED)
 
         suspended_users_data = {}
 
         if isinstance(data, dict):
             for account in data['data']['account']:
-                owner = account['owner']
-                user = account['user']
-                reason = account['reason']
-                suspendtime = account['time']
                 try:
                     unixtime = float(account['unixtime'])
                 except:
                     unixtime = 0
-                period = round((time.time() - unixtime) / 3600 / 24, 0)
 
-                suspended_users_data.setdefault(user, {'owner': owner})
-                suspended_users_data[user]['reason'] = reason
-                suspended_users_data[user]['suspendtime'] = suspendtime
-                suspended_users_data[user]['unixtime'] = unixtime
-                suspended_users_data[user]['suspendperiod'] = period
+                suspended_users_data[account['user']] = self._suspension_details(
+                    account['owner'], account['reason'], account['time'], unixtime)
 
             return suspended_users_data
         else:
             return 0
 
+    def _inventory_section(self, section, load):
+        """
+        Returns inventory section from the shared inventory snapshot ('inventory_file' in [Server] section).
+        Section missing from the snapshot is loaded with load() and added to the snapshot.
+
+        Arguments:
+            section: section name
+            load: function returning section data, False or empty results are not stored
+        """
+        if not self.inventory:
+            return load()
+
+        data = self.inventory.get(section)
+        if data is None:
+            data = load()
+            if data:
+                # caller gets the loaded data, snapshot keeps its own pickled copy
+                self.inventory.put(section, data)
+
+        return data
+
     def get_resellers(self):
         """
         Method for getting a list of reseller packages on the server
@@ -169,8 +609,10 @@ class Server(object):
         Returns:
             list: List of resellers
         """
+        return self._inventory_section('resellers', self._list_resellers)
 
-        data = yaml.load(self.exec_cpanel_api_command(Server.LIST_RESELLERS))
+    def _list_resellers(self):
+        data = self.api_call(Server.LIST_RESELLERS)
 
         if data:
             return data['data']['reseller']
@@ -191,9 +633,15 @@ class Server(object):
             dict: {user: acc_details}
 
         """
+        if not search:
+            # all accounts are taken from the shared inventory snapshot
+            return self._inventory_section('accounts', lambda: self._list_accounts(search, searchtype))
 
+        return self._list_accounts(search, searchtype)
+
+    def _list_accounts(self, search, searchtype):
         cmd = Server.LIST_ACCOUNTS + ' search=%s searchtype=%s' % (search, searchtype)
-        data = yaml.load(self.exec_cpanel_api_command(cmd))
+        data = self.api_call(cmd)
 
         if 'data' in data.keys():
             return data['data']['acct']
@@ -226,6 +674,85 @@ class Server(object):
 
         return owners_users
 
+    def _read_userdatadomains(self):
+        """
+        Reads domain records of all accounts from /etc/userdatadomains file ('userdatadomains' in [Server] section)
+        Line format: domain: user==owner==type==parent_domain==documentroot==ip:port==...
+
+        Returns:
+            list: [(domain, user, owner, domain_type, documentroot, ip)], domain_type is main, addon, parked or sub
+        """
+        records = []
+        f = open(self.userdatadomains_file, 'r')
+        try:
+            for line in f:
+                domain, _, data = line.strip().partition(': ')
+                fields = data.split('==')
+                if len(fields) < 6:
+                    continue
+                records.append((domain, fields[0], fields[1], fields[2], fields[4], fields[5].split(':')[0]))
+        finally:
+            f.close()
+
+        return records
+
+    def _get_domain_info(self):
+        """
+        Returns domain records of all accounts from a single whmapi1 get_domain_info call
+
+        Returns:
+            list: [(domain, user, owner, domain_type, documentroot, ip)], same as _read_userdatadomains()
+        """
+        data = self.api_call(Server.LIST_DOMAIN_INFO)
+
+        if not data or 'data' not in data:
+            return False
+
+        return [(item['domain'], item['user'], item.get('user_owner', ''), item['domain_type'],
+                 item.get('docroot', ''), item.get('ipv4', '')) for item in data['data']['domains']]
+
+    def get_domain_inventory(self):
+        """
+        Returns domains of every account on the server with a single operation.
+        Domain records are read from /etc/userdatadomains, or with one whmapi1 get_domain_info call if the file
+        can't be read. Inventory is loaded once and kept for the Server instance, together with document root
+        and IP of every domain (see get_domains_userdata()).
+
+        Returns:
+            dict: {user: {'main_domain': domain, 'addon_domains': [], 'parked_domains': [], 'sub_domains': []}},
+            False if inventory could not be loaded
+        """
+        if self.domain_inventory is not None:
+            return self.domain_inventory
+
+        records = self._inventory_section('domain_records', self._load_domain_records)
+
+        if not records:
+            self.domain_inventory = False
+            return False
+
+        inventory = {}
+        for domain, user, owner, domain_type, documentroot, ip in records:
+            self.domain_userdata[domain] = {'documentroot': documentroot, 'ip': ip}
+            user_domains = inventory.setdefault(user, {'main_domain': '', 'addon_domains': [], 'parked_domains': [],
+                                                       'sub_domains': []})
+            if domain_type == 'main':
+                user_domains['main_domain'] = domain
+            elif domain_type + '_domains' in user_domains:
+                user_domains[domain_type + '_domains'].append(domain)
+
+        self.domain_inventory = inventory
+
+        return inventory
+
+    def _load_domain_records(self):
+        try:
+            return self._read_userdatadomains()
+        except IOError, err:
+            self.logger.info('Unable to read %s (%s), loading domains with %s' % (self.userdatadomains_file, err,
+                                                                                 Server.LIST_DOMAIN_INFO))
+            return self._get_domain_info()
+
     def get_account_domains(self, user):
         """
         Argument:
@@ -234,9 +761,13 @@ class Server(object):
         Returns:
             dict: dictionary with keys 'main_domain', 'addon_domains', 'parked_domains', 'sub_domains'
         """
+        inventory = self.get_domain_inventory()
+        if inventory and user in inventory:
+            user_domains = inventory[user]
+            return dict((key, isinstance(value, list) and list(value) or value) for key, value in user_domains.items())
 
         cmd = Server.LIST_ACC_DOMAINS.replace('USER', user)
-        data = yaml.load(self.exec_cpanel_api_command(cmd))
+        data = self.api_call(cmd)
 
         if data:
             return data['result']['data']
@@ -246,6 +777,7 @@ class Server(object):
     def get_account_domain_list(self, subdomains=False, owners_users_data=False):
         """
         Returns a list of user domains (sub domains excluded)
+        Domains of all users are taken from get_domain_inventory(), so there is no API call per user
 
         note: try to use only when you don't call get.owners_user-details() method inside  your script, so you avoid
             calling this method twice
@@ -280,13 +812,53 @@ class Server(object):
         :return
         """
         cmd = Server.LIST_DOMAIN_DATA.replace('DOMAIN', domain)
-        data = yaml.load(self.exec_cpanel_api_command(cmd))
+        data = self.api_call(cmd)
 
         if data:
             return data['data']['userdata']
         else:
             return False
 
+    def get_domains_data(self, domains):
+        """
+        Returns data for list of domains, API calls are executed concurrently
+        :param domains: list of domains
+        :return: dict: {domain: domain data, False if no data was returned}
+        """
+        commands = [Server.LIST_DOMAIN_DATA.replace('DOMAIN', domain) for domain in domains]
+
+        domains_data = {}
+        for domain, data in zip(domains, self.api_calls(commands)):
+            if data and 'data' in data:
+                domains_data[domain] = data['data']['userdata']
+            else:
+                domains_data[domain] = False
+
+        return domains_data
+
+    def get_domains_userdata(self, domains):
+        """
+        Returns document root and IP for list of domains, taken from the domain inventory loaded with
+        get_domain_inventory(). Data of domains missing from the inventory is loaded with get_domains_data().
+
+        :param domains: list of domains
+        :return: dict: {domain: {'documentroot': path, 'ip': IP, ...}, False if no data was returned}
+        """
+        self.get_domain_inventory()
+
+        domains_data = {}
+        missing = []
+        for domain in domains:
+            if domain in self.domain_userdata:
+                domains_data[domain] = self.domain_userdata[domain]
+            else:
+                missing.append(domain)
+
+        if missing:
+            domains_data.update(self.get_domains_data(missing))
+
+        return domains_data
+
     def get_bw_data(self, searchtype='user', search=''):
         """
         Return Bandwith data. If not searchtype and search parameters are provided, it returns all the data
@@ -299,7 +871,7 @@ class Server(object):
         """
         # cmd = Server.GET_BW_DATA + ' search={0} + searchtype={1}'.format(search,  searchtype)
         cmd = Server.GET_BW_DATA + ' search=%s searchtype=%s' % (search, searchtype)
-        data = yaml.load(self.exec_cpanel_api_command(cmd))
+        data = self.api_call(cmd)
 
         if len(data['data']['acct']) > 0:
 
@@ -307,24 +879,235 @@ class Server(object):
         else:
             return False
 
+    def get_bw_snapshot(self):
+        """
+        Returns bandwidth data of all accounts with a single showbw call
+
+        Returns:
+            dict: {user: showbw account data}, empty if no data was returned
+        """
+        data = self.api_call(Server.GET_BW_DATA)
+
+        try:
+            return dict((account['user'], account) for account in data['data']['acct'])
+        except (TypeError, KeyError):
+            return {}
+
     def set_bw_limit(self, user, bw_value):
         # cmd = Server.SET_BW_DATA + ' user={0} bwlimit={1}'.format(user, bw_value)
         cmd = Server.SET_BW_DATA + ' user=%s bwlimit=%s' % (user, bw_value)
-        data = yaml.load(self.exec_cpanel_api_command(cmd))
+        data = self.api_call(cmd)
 
         return data['metadata']['reason']
 
-    def exec_cpanel_api_command(self, command):
+    def set_bw_limits(self, limits):
+        """
+        Sets bandwidth limits of many accounts, limitbw calls are executed concurrently (see api_calls())
+
+        Arguments:
+            limits: list of (user, limit in MB) tuples
+
+        Returns:
+            list: limitbw reason (or False if the call failed) for every user, in the same order as limits
+        """
+        commands = [Server.SET_BW_DATA + ' user=%s bwlimit=%s' % (user, bw_value) for user, bw_value in limits]
+
+        reasons = []
+        for data in self.api_calls(commands):
+            try:
+                reasons.append(data['metadata']['reason'])
+            except (TypeError, KeyError):
+                reasons.append(False)
+
+        return reasons
+
+    @staticmethod
+    def _txt_character_strings(txtdata, size=255):
+        """
+        Splits TXT record data into character-strings of at most size bytes (RFC 1035 limit is 255), multi-byte UTF-8
+        characters are not split. Unicode data is returned as unicode strings, UTF-8 str data as str.
+
+        Arguments:
+            txtdata: TXT record data, unicode or UTF-8 str
+            size: maximal character-string length in bytes
+        """
+        data = isinstance(txtdata, unicode) and txtdata.encode('utf-8') or txtdata
+        strings = []
+        start = 0
+        while start < len(data) or not strings:
+            end = start + size
+            # UTF-8 continuation bytes (10xxxxxx) can't start a character-string
+            while start + 1 < end < len(data) and 0x80 <= ord(data[end]) < 0xc0:
+                end -= 1
+            strings.append(data[start:end])
+            start = end
+
+        if isinstance(txtdata, unicode):
+            return [string.decode('utf-8') for string in strings]
+
+        return strings
+
+    @staticmethod
+    def _zone_edit_entry(record, line=None):
+        """
+        Converts dumpzone style record to mass_edit_dns_zone edit/add entry
+
+        Arguments:
+            record: dict with name, ttl, type and type specific data fields (address, exchange...)
+            line: dumpzone 'Line' of the record to replace, None for new records
+        """
+        # text values are kept as they are (TXT data can be non-ASCII unicode or UTF-8 str), json.dumps() encodes both
+        entry = {'dname': record['name'], 'ttl': int(record.get('ttl', 14400)), 'record_type': record['type'],
+                 'data': [isinstance(record[field], basestring) and record[field] or str(record[field])
+                          for field in Server.ZONE_RECORD_DATA[record['type']]]}
+        if record['type'] == 'TXT':
+            # TXT data longer than 255 bytes (long SPF records) is sent as several character-strings
+            entry['data'] = Server._txt_character_strings(entry['data'][0])
+        if line is not None:
+            # dumpzone lines are numbered from 1, mass_edit_dns_zone line_index from 0
+            entry['line_index'] = int(line) - 1
+
+        return entry
+
+    def mass_edit_dns_zone(self, domain, serial, edit=(), add=()):
+        """
+        Applies all record changes of a zone with one mass_edit_dns_zone call, zone is saved and reloaded once.
+        Changes are rejected by cPanel if the zone serial changed since the zone was dumped.
+
+        Arguments:
+            domain: zone name
+            serial: SOA serial of the dumped zone the changes are based on
+            edit: list of (line, record) tuples, record replaces the zone record on dumpzone line
+            add: list of new records
+
+        Returns:
+            tuple: (True if changes were applied, API reason)
+        """
+        cmd = Server.MASS_EDIT_ZONE.replace('DOMAIN', domain).replace('SERIAL', str(serial))
+        for line, record in edit:
+            cmd += ' edit=%s' % pipes.quote(json.dumps(self._zone_edit_entry(record, line)))
+        for record in add:
+            cmd += ' add=%s' % pipes.quote(json.dumps(self._zone_edit_entry(record)))
+
+        data = self.api_call(cmd)
+        try:
+            return bool(int(data['metadata']['result'])), data['metadata']['reason']
+        except (TypeError, KeyError, ValueError):
+            return False, 'Invalid mass_edit_dns_zone output: %r' % (data,)
+
+    @staticmethod
+    def parse_api_output(output):
+        """
+        Decodes cPanel API command output.
+        JSON output is decoded with json module, YAML parser is used only for output that is not JSON
+        (cPanel versions without --output option support)
+
+        Arguments:
+            output: output of exec_cpanel_api_command()
+
+        Returns:
+            decoded data, False if output is empty or can't be decoded
+        """
+        if not output:
+            return False
+
+        try:
+            return json.loads(output)
+        except ValueError:
+            import yaml
+            try:
+                return yaml.load(output.replace('\t', ''))
+            except yaml.YAMLError:
+                return False
+
+    def _timed_parse(self, command, output):
+        """
+        Decodes command output with parse_api_output(), recording parse time when timing is enabled
+        """
+        if not self.timings.enabled:
+            return self.parse_api_output(output)
+
+        parse_start = time.time()
+        data = self.parse_api_output(output)
+        self.timings.record('parse', self._api_function(command.split()), time.time() - parse_start, command)
+
+        return data
+
+    @staticmethod
+    def _output_command(command):
+        """
+        Adds output format option (Server.API_OUTPUT) to cPanel API command
+        """
+        api, _, arguments = command.partition(' ')
+        if api in Server.API_COMMANDS:
+            return ' '.join([api, Server.API_OUTPUT, arguments])
+
+        return command
+
+    def api_call(self, command, ignore_deadline=False):
+        """
+        Executes cPanel API command requesting JSON output and returns decoded data
+
+        Arguments:
+            command: cPanel api command
+            ignore_deadline: execute also after the run deadline, see exec_cpanel_api_command()
+
+        Returns:
+            decoded command output, False if command failed or output can't be decoded
+        """
+        return self._timed_parse(command, self.exec_cpanel_api_command(self._output_command(command),
+                                                                       ignore_deadline))
+
+    def api_calls(self, commands, workers=None):
+        """
+        Executes list of cPanel API commands concurrently (see exec_cpanel_api_commands()) and returns decoded data
+
+        Returns:
+            list: decoded output of every command, in the same order as commands
+        """
+        api_commands = [self._output_command(command) for command in commands]
+
+        outputs = self.exec_cpanel_api_commands(api_commands, workers)
+
+        return [self._timed_parse(command, out) for command, out in zip(commands, outputs)]
+
+    def exec_cpanel_api_commands(self, commands, workers=None):
+        """
+        Executes list of cPanel API commands through a pool of worker threads.
+        Every command goes through exec_cpanel_api_command(), so allowed commands check and logging are the same.
+
+        Arguments:
+            commands: list of cPanel api commands
+            workers: maximum number of commands executed at the same time ([Server] api_workers by default)
+
+        Returns:
+            list: exec_cpanel_api_command() result for every command, in the same order as commands
+        """
+        if workers is None:
+            workers = self.api_workers
+
+        return self.parallel_map(self.exec_cpanel_api_command, commands, workers)
+
+    def exec_cpanel_api_command(self, command, ignore_deadline=False):
         """
         Executes cPanel API call (whmapi1, whmapi2, cpapi2, uapi)
+        Number of calls running at the same time is limited by self.rate_controller.
+        Command process is killed after the timeout defined in [Timeouts] section, read only calls
+        (READ_ONLY_PREFIXES) are retried 'api_retries' times with exponential backoff, after a timeout or an error
+        without output.
 
         Arguments:
             command: cPanel api command
+            ignore_deadline: execute also after the run deadline, for calls restoring the state changed by
+                             earlier calls (suspending an account again)
 
         Returns:
             stdoutdata: output of Popen.communicate() method,
             0: if error occurs, or command is not allowed
             1: if test run is enabled
+
+        Raises:
+            RunDeadlineExceeded: if the run deadline has passed
         """
 
         allowed = ['whmapi1', 'whmapi2', 'cpapi2', 'uapi', '/scripts/generate_maildirsize', 'lve-read-snapshot',
@@ -332,54 +1115,262 @@ class Server(object):
         cmd = shlex.split(command)
 
         if cmd[0] in allowed:
-            print("Executing %s" % command)
-            self.logger.info("Executing %s" % command)
-            out, err = subprocess.Popen(cmd,
-                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-            if out:
-                self.logger.info("Command %s executed!" % command)
-                return out
-            elif err:
-                # self.logger.debug('ERROR with command {0}: \n{1}'.format(command, err))
-                self.logger.info('ERROR with command %s: \n%s' % (command, err))
-                return err
-            else:
-                return False
+            function = self._api_function(cmd)
+            read_only = function.startswith(Server.READ_ONLY_PREFIXES)
+            attempts = 1
+            if read_only:
+                attempts += self.api_retries
+
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(self.api_retry_backoff * 2 ** (attempt - 1))
+                    self.logger.info("Retrying (%s/%s) %s" % (attempt, attempts - 1, command))
+
+                timeout = self._command_timeout(function, ignore_deadline)
+                self.rate_controller.acquire()
+                # single write, so lines printed from worker threads don't interleave
+                sys.stdout.write("Executing %s\n" % command)
+                self.logger.info("Executing %s" % command)
+                call_start = time.time()
+                out, err = False, False
+                try:
+                    try:
+                        out, err = self._execute(cmd, timeout, read_only)
+                    except CommandTimeout, error:
+                        self.logger.info("TIMEOUT: %s" % error)
+                        continue
+                finally:
+                    latency = time.time() - call_start
+                    self.rate_controller.release(latency, error=not out)
+                    if self.timings.enabled:
+                        self.timings.record('api', function, latency, command)
+
+                if out:
+                    self.logger.info("Command %s executed!" % command)
+                    return out
+                elif err:
+                    # self.logger.debug('ERROR with command {0}: \n{1}'.format(command, err))
+                    self.logger.info('ERROR with command %s: \n%s' % (command, err))
+                    if attempt < attempts - 1:
+                        # read only call failed without output (HTTP 5xx, error on stderr), try again
+                        continue
+                    return err
+
+            return False
 
         else:
             self.logger.info("SKIPPED %s" % command)
 
         return False
 
-    def mail_report(self, name,  content='', logfile='', error=''):
+    def run_statistics(self):
+        """
+        Returns list of runtime statistics lines, appended to every report sent by mail_report()
+        """
+        statistics = ['DNS host cache: %(hits)s hits, %(misses)s misses, %(entries)s entries, '
+                      '%(evictions)s evictions' % self.host_cache.stats()]
+        statistics.append('API rate controller: %(calls)s calls, %(errors)s errors, %(slow_calls)s slow, '
+                          'window %(window).1f (%(lowest_window).1f - %(highest_window).1f), '
+                          '%(waits)s waits for %(wait_time).1fs' % self.rate_controller.stats())
+        if self.dns_cache:
+            statistics.append('DNS persistent cache: %(hits)s hits, %(misses)s misses, %(entries)s entries'
+                              % self.dns_cache.stats())
+        if self.inventory:
+            statistics.append('Inventory snapshot: %(hits)s hits, %(misses)s misses, %(invalidated)s invalidated'
+                              % self.inventory.stats)
+        statistics.extend(self.timings.summary())
+
+        return statistics
+
+    def mail_report(self, name,  content='', logfile='', error='', spool=None):
         """
-        Mmethod accepts string or filename data, and sends a report to the designated mail
+        Mmethod accepts string, filename or ReportSpool data, and sends a report to the designated mail
+        Report is streamed from the log file or spool to the mail server, it is never loaded into memory.
+        With 'report_attach = 1' in [Server] section report is sent as an attachment (gzipped unless
+        'report_gzip = 0'), mail body contains only the summary and run statistics.
 
         :param name: Name of the Class.__name__ that invoked the mail_report method
         :param content: string
         :param logfile: filename
         :param error: if calling script got an error during execution
+        :param spool: ReportSpool with the report, closed after the report is sent
         :return:
         """
-        if bool(self.server_conf.get('Server', 'send_report_mail')):
-            if logfile:
-                f = open(logfile, 'rb')
-                msg = MIMEText(f.read())
-                f.close()
+        for line in self.run_statistics():
+            self.logger.info("%s %s" % (name, line))
+
+        try:
+            if bool(self.server_conf.get('Server', 'send_report_mail')):
+                if logfile:
+                    # queued log records are written out before the log file is mailed
+                    for handler in logging.getLogger(logfile).handlers:
+                        handler.flush()
+                    try:
+                        source = open(logfile, 'rb')
+                    except IOError, err:
+                        # nothing was logged yet
+                        source = StringIO.StringIO('Log file %s not found: %s\n' % (logfile, err.strerror))
+                    summary = []
+                elif spool:
+                    source = spool.open()
+                    summary = spool.summary + ['Report size: %s lines, %s bytes' % (spool.lines, spool.size)]
+                else:
+                    print content
+                    source = StringIO.StringIO(content)
+                    summary = []
+
+                try:
+                    msg_file = self._report_message(name, source, summary, error)
+                finally:
+                    source.close()
+
+                smtp_start = time.time()
+                try:
+                    self._send_message(msg_file, 'root@' + self.hostname, self.report_mail)
+                finally:
+                    msg_file.close()
+                if self.timings.enabled:
+                    self.timings.record('smtp', 'sendmail', time.time() - smtp_start, name)
+
+                self.logger.info("Report mail sent to %s!" % self.report_mail)
+        finally:
+            if spool:
+                spool.close()
+
+    def _report_message(self, name, source, summary, error):
+        """
+        Writes report mail message to a temporary file
+
+        Arguments:
+            name: report name
+            source: open file with the report
+            summary: summary lines for the mail body when report is attached
+            error: subject prefix
+
+        Returns:
+            file: temporary file with the message, positioned at the start
+        """
+        import tempfile
+        from email.generator import Generator
+        try:
+            from email.MIMEText import MIMEText
+        except ImportError:
+            from email.mime.text import MIMEText
+
+        statistics = '\n\nRun statistics:\n' + '\n'.join(self.run_statistics())
+        msg_file = tempfile.TemporaryFile(prefix='cpaneltools-mail-')
+
+        if self.server_conf.has_option('Server', 'report_attach') and \
+                self.server_conf.getboolean('Server', 'report_attach'):
+            from email.mime.base import MIMEBase
+            from email.mime.multipart import MIMEMultipart
+            from includes.ReportSpool import gzip_file
+
+            msg = MIMEMultipart()
+            msg.attach(MIMEText('\n'.join(summary + ['Full report is attached.']) + statistics))
+
+            filename = '%s-%s-%s.txt' % (name, self.hostname, time.strftime('%Y%m%d-%H%M%S'))
+            compressed = None
+            if self.get_conf_value('Server', 'report_gzip', '1') != '0':
+                compressed = gzip_file(source, filename)
+                attachment = MIMEBase('application', 'gzip')
+                filename += '.gz'
             else:
-                print content
-                msg = MIMEText(content)
-                print msg
+                attachment = MIMEBase('text', 'plain')
+            attachment['Content-Transfer-Encoding'] = 'base64'
+            attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+            # message is generated with a placeholder payload, encoded report is streamed in its place
+            placeholder = 'cpaneltools-attachment-%s' % os.urandom(8).encode('hex')
+            attachment.set_payload(placeholder)
+            msg.attach(attachment)
+
+            self._set_report_headers(msg, name, error)
+            generated = StringIO.StringIO()
+            Generator(generated, mangle_from_=False).flatten(msg)
+            head, tail = generated.getvalue().split(placeholder, 1)
+
+            msg_file.write(head)
+            try:
+                self._write_base64(compressed or source, msg_file)
+            finally:
+                if compressed:
+                    compressed.close()
+            msg_file.write(tail.lstrip('\n'))
+        else:
+            # headers are generated for an empty body, report is copied after them as 8bit text
+            msg = MIMEText('', 'plain', 'utf-8')
+            del msg['Content-Transfer-Encoding']
+            msg['Content-Transfer-Encoding'] = '8bit'
+            self._set_report_headers(msg, name, error)
+            Generator(msg_file, mangle_from_=False).flatten(msg)
+            shutil.copyfileobj(source, msg_file)
+            msg_file.write(statistics + '\n')
+
+        msg_file.seek(0)
 
-            msg['Subject'] = error + name + ' report for server ' + self.hostname
-            msg['From'] = 'root@' + self.hostname
-            msg['To'] = self.report_mail
+        return msg_file
 
-            s = smtplib.SMTP('localhost')
-            s.sendmail(msg['From'], msg['To'], msg.as_string())
+    @staticmethod
+    def _write_base64(source, target, chunk_size=57 * 1024):
+        """
+        Writes content of the source file to target file base64 encoded, in 76 character lines.
+        Source is read in chunks of 57 byte multiples, so every chunk encodes into whole lines.
+        """
+        import base64
 
-            self.logger.info("Report mail sent to %s!" % msg['To'])
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(base64.encodestring(chunk))
 
+    def _set_report_headers(self, msg, name, error):
+        msg['Subject'] = error + name + ' report for server ' + self.hostname
+        msg['From'] = 'root@' + self.hostname
+        msg['To'] = self.report_mail
+
+    @staticmethod
+    def _send_message(msg_file, sender, recipient, chunk_size=65536):
+        """
+        Sends message from a file to the local mail server in chunks, the way smtplib.sendmail() would send it
+        """
+        import smtplib
+
+        s = smtplib.SMTP('localhost')
+        try:
+            s.ehlo_or_helo_if_needed()
+            code, response = s.mail(sender)
+            if code != 250:
+                raise smtplib.SMTPSenderRefused(code, response, sender)
+            code, response = s.rcpt(recipient)
+            if code not in (250, 251):
+                raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+            code, response = s.docmd('data')
+            if code != 354:
+                raise smtplib.SMTPDataError(code, response)
+
+            chunk = []
+            chunk_length = 0
+            for line in msg_file:
+                line = line.rstrip('\r\n')
+                if line.startswith('.'):
+                    # dot stuffing, RFC 5321
+                    line = '.' + line
+                chunk.append(line + '\r\n')
+                chunk_length += len(line) + 2
+                if chunk_length >= chunk_size:
+                    s.send(''.join(chunk))
+                    chunk = []
+                    chunk_length = 0
+            chunk.append('.\r\n')
+            s.send(''.join(chunk))
+
+            code, response = s.getreply()
+            if code != 250:
+                raise smtplib.SMTPDataError(code, response)
+            s.quit()
+        finally:
+            s.close()
 
 
 
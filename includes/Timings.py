@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import heapq
+import threading
+
+
+class Timings(object):
+    """
+    Collects wall time of API calls, DNS queries, output parsing and mail sending, grouped by
+    category ('api', 'dns', 'parse', 'smtp') and name (API function, DNS record type...).
+    When disabled, record() returns immediately, callers should check self.enabled before preparing
+    the arguments.
+    """
+
+    def __init__(self, enabled=False, slowest=10):
+        self.enabled = enabled
+        self.slowest_count = slowest
+
+        self.samples = {}
+        self.slowest = []
+        self.lock = threading.Lock()
+
+    def record(self, category, name, seconds, detail=''):
+        """
+        Arguments:
+            category: api, dns, parse, smtp
+            name: API function name, DNS record type...
+            seconds: measured wall time
+            detail: description of the call shown in the slowest calls list
+        """
+        if not self.enabled:
+            return
+
+        self.lock.acquire()
+        try:
+            self.samples.setdefault((category, name), []).append(seconds)
+            entry = (seconds, category, name, detail)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            elif self.slowest and entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def _percentile(values, percent):
+        return values[int(round((len(values) - 1) * percent / 100.0))]
+
+    def summary(self):
+        """
+        Returns:
+            list: summary lines with count, total, p50, p95 and max time per category and name,
+            followed by the slowest calls
+        """
+        if not self.enabled or not self.samples:
+            return []
+
+        self.lock.acquire()
+        try:
+            samples = dict((key, sorted(values)) for key, values in self.samples.items())
+            slowest = sorted(self.slowest, reverse=True)
+        finally:
+            self.lock.release()
+
+        lines = ['%-6s %-24s %8s %10s %8s %8s %8s' % ('TIMING', 'NAME', 'COUNT', 'TOTAL', 'P50', 'P95', 'MAX')]
+        for (category, name), values in sorted(samples.items()):
+            lines.append('%-6s %-24s %8d %10.3f %8.3f %8.3f %8.3f' % (
+                category, name, len(values), sum(values), self._percentile(values, 50),
+                self._percentile(values, 95), values[-1]))
+
+        if slowest:
+            lines.append('Slowest calls:')
+            for seconds, category, name, detail in slowest:
+                lines.append('%10.3fs %s %s %s' % (seconds, category, name, detail))
+
+        return lines
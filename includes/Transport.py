@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import threading
+
+# imported by WHMAPITransport, subprocess transport runs without loading them
+httplib = ssl = urllib = None
+
+
+def _import_http_modules():
+    global httplib, ssl, urllib
+    if httplib is None:
+        import ssl as ssl_module
+        import urllib as urllib_module
+        import httplib as httplib_module
+        ssl, urllib, httplib = ssl_module, urllib_module, httplib_module
+
+
+class TransportError(Exception):
+    """
+    Raised when API call can't be delivered through the transport.
+    sent is True when the request could have reached the API before the failure, so the call could have been
+    executed and must not be repeated unless it is read only.
+    """
+
+    def __init__(self, message, sent=False):
+        Exception.__init__(self, message)
+        self.sent = sent
+
+
+class CommandTimeout(Exception):
+    """
+    Raised when API call doesn't finish within its timeout
+    """
+    pass
+
+
+class SubprocessTransport(object):
+    """
+    Executes cPanel API calls by running the whmapi1/uapi/cpapi2 command line tools
+    """
+    name = 'subprocess'
+
+    @staticmethod
+    def _kill(process, timed_out):
+        timed_out.append(True)
+        try:
+            # command is started in its own session, so the whole process group is killed
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def execute(self, cmd, timeout=None):
+        """
+        Arguments:
+            cmd: list of command arguments (output of shlex.split)
+            timeout: seconds after which the command process group is killed
+
+        Returns:
+            tuple: (stdout, stderr)
+
+        Raises:
+            CommandTimeout: if command was killed after timeout
+        """
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+
+        timed_out = []
+        watchdog = None
+        if timeout:
+            watchdog = threading.Timer(timeout, self._kill, (process, timed_out))
+            watchdog.daemon = True
+            watchdog.start()
+
+        try:
+            out, err = process.communicate()
+        finally:
+            if watchdog:
+                watchdog.cancel()
+
+        if timed_out:
+            raise CommandTimeout('%s killed after %s seconds' % (' '.join(cmd), timeout))
+
+        return out, err
+
+
+class WHMAPITransport(object):
+    """
+    Executes cPanel API calls through the WHM JSON API (json-api) over persistent keep-alive connections,
+    authenticated with WHM API token.
+
+    Commands are accepted in the same format as the command line tools and output has the same structure
+    as command line tools output, so Server methods work unchanged:
+        whmapi1 <function> key=value ...             -> /json-api/<function>?api.version=1
+        uapi --user=<user> <Module> <function> ...   -> /json-api/uapi_cpanel?cpanel.user=<user>...
+        cpapi2 --user=<user> <Module> <function> ... -> /json-api/cpanel?cpanel_jsonapi_user=<user>...
+
+    Every thread gets its own connection, so the transport can be used from worker pools.
+    """
+    name = 'http'
+    commands = ('whmapi1', 'uapi', 'cpapi2')
+
+    def __init__(self, host, port, token, user='root', scheme='https', verify=False, timeout=None):
+        _import_http_modules()
+        self.host = host
+        self.port = int(port)
+        self.token = token
+        self.user = user
+        self.scheme = scheme
+        self.verify = verify
+        self.timeout = timeout
+
+        self.local = threading.local()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            kwargs = {}
+            if not self.verify and hasattr(ssl, '_create_unverified_context'):
+                # cpsrvd on localhost is usually using self signed certificate
+                kwargs['context'] = ssl._create_unverified_context()
+            connection = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout, **kwargs)
+        else:
+            connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        self.local.connection = connection
+
+        return connection
+
+    @staticmethod
+    def parse_command(cmd):
+        """
+        Splits command line into API name, options (--key=value), positional arguments and parameters
+
+        Returns:
+            tuple: (api, options dict, positional list, parameters list of (key, value) tuples)
+        """
+        api = cmd[0]
+        options = {}
+        positional = []
+        params = []
+
+        for arg in cmd[1:]:
+            if arg.startswith('--'):
+                key, _, value = arg[2:].partition('=')
+                options[key] = value
+            elif '=' in arg:
+                params.append(tuple(arg.split('=', 1)))
+            else:
+                positional.append(arg)
+
+        return api, options, positional, params
+
+    def build_request(self, cmd):
+        """
+        Returns:
+            tuple: (request path, function called on json-api)
+        """
+        api, options, positional, params = self.parse_command(cmd)
+
+        if api == 'whmapi1':
+            query = [('api.version', '1')] + params
+            function = positional[0]
+        elif api == 'uapi':
+            query = [('api.version', '1'), ('cpanel.user', options.get('user', '')),
+                     ('cpanel.module', positional[0]), ('cpanel.function', positional[1])] + params
+            function = 'uapi_cpanel'
+        elif api == 'cpapi2':
+            query = [('cpanel_jsonapi_user', options.get('user', '')), ('cpanel_jsonapi_apiversion', '2'),
+                     ('cpanel_jsonapi_module', positional[0]), ('cpanel_jsonapi_func', positional[1])] + params
+            function = 'cpanel'
+        else:
+            raise ValueError('API %s is not supported by %s transport' % (api, self.name))
+
+        return '/json-api/%s?%s' % (function, urllib.urlencode(query)), function
+
+    @staticmethod
+    def convert_response(cmd, data):
+        """
+        Converts json-api response to the structure command line tool would return
+        """
+        if cmd[0] == 'uapi':
+            positional = [arg for arg in cmd[1:] if not arg.startswith('--') and '=' not in arg]
+            return {'apiversion': 3, 'module': positional[0], 'func': positional[1],
+                    'result': data.get('data', {}).get('uapi', data)}
+
+        return data
+
+    @staticmethod
+    def _dropped(connection):
+        """
+        Returns True if the idle keep-alive connection was closed by the server (socket is readable at EOF)
+        """
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _open(self, connection, timeout):
+        """
+        Connects before the request is sent, so connection failures are known to happen before the API got it
+
+        Raises:
+            TransportError: if the API can't be reached, with sent=False
+        """
+        connection.timeout = timeout
+        if connection.sock:
+            connection.sock.settimeout(timeout)
+            return
+
+        try:
+            connection.connect()
+        except socket.error, err:
+            connection.close()
+            raise TransportError('connection to %s:%s failed: %r' % (self.host, self.port, err))
+
+    def _request(self, path, timeout=None, resend=False):
+        """
+        Sends GET request over the keep-alive connection of the thread.
+        Idle connections closed by the server are replaced before the request is sent. When the connection fails
+        after the request was sent, the request is sent again on a new connection only if resend is set (read only
+        calls), other calls could have been executed already.
+
+        Returns:
+            tuple: (HTTP status, response body)
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection and connection.sock and self._dropped(connection):
+            connection.close()
+        connection = connection or self._connect()
+        headers = {'Authorization': 'whm %s:%s' % (self.user, self.token), 'Connection': 'keep-alive'}
+
+        timeout = timeout or self.timeout
+        self._open(connection, timeout)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except socket.timeout:
+            raise
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not resend:
+                raise
+            # connection was closed while the request was sent, reconnect once
+            connection = self._connect()
+            self._open(connection, timeout)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+
+        return response.status, response.read()
+
+    def execute(self, cmd, timeout=None, resend=False):
+        """
+        Arguments:
+            cmd: list of command arguments (output of shlex.split)
+            timeout: seconds to wait for the response
+            resend: send the request again when the connection fails after it was sent, only for read only calls
+
+        Returns:
+            tuple: (output, error) in the same format as SubprocessTransport.execute()
+
+        Raises:
+            CommandTimeout: if response was not received within timeout
+            TransportError: if API could not be reached, or the connection failed after the request was sent
+                            (sent=True)
+        """
+        try:
+            path, function = self.build_request(cmd)
+        except (IndexError, ValueError), err:
+            raise TransportError('%s: %s' % (' '.join(cmd), repr(err)))
+
+        try:
+            status, body = self._request(path, timeout, resend)
+        except socket.timeout:
+            # connection state is unknown after timeout
+            self.local.connection.close()
+            self.local.connection = None
+            raise CommandTimeout('%s got no response in %s seconds' % (' '.join(cmd), timeout))
+        except TransportError, err:
+            raise TransportError('%s: %s' % (' '.join(cmd), err), err.sent)
+        except (httplib.HTTPException, socket.error), err:
+            raise TransportError('%s: %s' % (' '.join(cmd), repr(err)), sent=True)
+
+        if status != 200:
+            return '', 'HTTP %s from json-api/%s: %s' % (status, function, body)
+
+        try:
+            data = json.loads(body)
+        except ValueError, err:
+            return '', 'Invalid json-api/%s response: %s' % (function, err)
+
+        # output is serialized again, so callers can parse it the same way as command line tools output
+        return json.dumps(self.convert_response(cmd, data)), ''
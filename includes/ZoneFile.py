@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+"""
+__author__ = "Emanuel Zelic"
+__version__ = "0.1"
+__email__ = "emanuel@plus.hr"
+__status__ = "Development"
+"""
+
+import os
+
+# multiprocessing is imported when zones are read through a worker pool
+
+CLASSES = ('IN', 'CH', 'HS', 'CS')
+TTL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# record data fields in the order they appear in the zone file, same field names as in whmapi1 dumpzone output
+DATA_FIELDS = {'A': ('address',), 'AAAA': ('address',), 'CNAME': ('cname',), 'NS': ('nsdname',),
+               'PTR': ('ptrdname',), 'MX': ('preference', 'exchange'),
+               'SOA': ('mname', 'rname', 'serial', 'refresh', 'retry', 'expire', 'minimum'),
+               'SRV': ('priority', 'weight', 'port', 'target'), 'CAA': ('flag', 'tag', 'value')}
+NAME_FIELDS = ('cname', 'nsdname', 'ptrdname', 'exchange', 'mname', 'rname', 'target')
+INTEGER_FIELDS = ('preference', 'refresh', 'retry', 'expire', 'minimum', 'priority', 'weight', 'port', 'flag')
+
+
+class ZoneFileError(Exception):
+    """
+    Raised when zone file can't be parsed, or uses syntax the parser doesn't support ($INCLUDE, $GENERATE)
+    """
+    pass
+
+
+def tokenize(line):
+    """
+    Splits zone file line into tokens, comments are removed.
+    Quoted strings are returned with their quotes, so they can be told apart from names.
+
+    Returns:
+        list: tokens
+    """
+    tokens = []
+    token = ''
+    quoted = False
+    escaped = False
+    for char in line:
+        if quoted:
+            token += char
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                tokens.append(token)
+                token = ''
+                quoted = False
+        elif char == ';':
+            break
+        elif char in ' \t\r\n':
+            if token:
+                tokens.append(token)
+                token = ''
+        elif char in '()':
+            if token:
+                tokens.append(token)
+                token = ''
+            tokens.append(char)
+        elif char == '"':
+            if token:
+                tokens.append(token)
+            token = char
+            quoted = True
+        else:
+            token += char
+
+    if quoted:
+        raise ZoneFileError('Unterminated quoted string')
+    if token:
+        tokens.append(token)
+
+    return tokens
+
+
+def unquote(token):
+    """
+    Returns text of a quoted string token, with escapes resolved
+    """
+    if not token.startswith('"'):
+        return token
+
+    text = ''
+    chars = iter(token[1:-1])
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            if char.isdigit():
+                # \DDD decimal escape
+                char = chr(int(char + next(chars, '') + next(chars, '')))
+        text += char
+
+    return text
+
+
+def parse_ttl(token):
+    """
+    Returns:
+        int: TTL in seconds, or None if token is not a TTL ('14400', '1h', '1h30m')
+    """
+    if token.isdigit():
+        return int(token)
+
+    seconds = 0
+    number = ''
+    for char in token.lower():
+        if char.isdigit():
+            number += char
+        elif char in TTL_UNITS and number:
+            seconds += int(number) * TTL_UNITS[char]
+            number = ''
+        else:
+            return None
+
+    if number:
+        return None
+
+    return seconds
+
+
+def absolute_name(name, origin):
+    """
+    Returns:
+        str: absolute name with the trailing dot
+    """
+    if name == '@':
+        return origin
+    if name.endswith('.'):
+        return name
+
+    return '%s.%s' % (name, origin)
+
+
+def parse_zone(lines, origin):
+    """
+    Parses zone file into records with the same structure as records in whmapi1 dumpzone output.
+    Every line that is not a record ($TTL and $ORIGIN directives, comments and empty lines) is returned as ':RAW'
+    record. Records have 'Line' (first line of the record, counted from 1) and 'Lines' (number of lines) keys,
+    like dumpzone records, so their line numbers can be used for zone edits.
+
+    Record names are absolute, with the trailing dot ('mail.domain.tld.'), names in record data are absolute
+    without the trailing dot ('mail.domain.tld').
+
+    Arguments:
+        lines: iterable of zone file lines (open zone file)
+        origin: zone name
+
+    Returns:
+        list: records
+
+    Raises:
+        ZoneFileError: if zone file can't be parsed
+    """
+    return list(iter_zone(lines, origin))
+
+
+def iter_zone(lines, origin):
+    """
+    Parses zone file like parse_zone(), records are returned as they are parsed, so reading can stop early
+
+    Returns:
+        generator: records
+
+    Raises:
+        ZoneFileError: if zone file can't be parsed
+    """
+    origin = origin.rstrip('.') + '.'
+    default_ttl = None
+    last_name = origin
+    last_ttl = None
+
+    tokens = []
+    first_line = 0
+    starts_with_name = False
+    depth = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            line_tokens = tokenize(line)
+        except ZoneFileError, err:
+            raise ZoneFileError('Line %s: %s' % (number, err))
+
+        if not depth:
+            if not line_tokens:
+                yield {'type': ':RAW', 'raw': line.rstrip('\r\n'), 'Line': number, 'Lines': 1}
+                continue
+
+            first_line = number
+            starts_with_name = line[:1] not in ' \t'
+            tokens = []
+
+        for token in line_tokens:
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                if depth < 0:
+                    raise ZoneFileError('Line %s: unbalanced parentheses' % number)
+            else:
+                tokens.append(token)
+
+        if depth:
+            # record continues on the next line
+            continue
+
+        if tokens[0].startswith('$'):
+            directive = tokens[0].upper()
+            if directive == '$TTL' and len(tokens) > 1 and parse_ttl(tokens[1]) is not None:
+                default_ttl = parse_ttl(tokens[1])
+            elif directive == '$ORIGIN' and len(tokens) > 1:
+                origin = absolute_name(tokens[1], origin)
+            else:
+                raise ZoneFileError('Line %s: unsupported directive %s' % (first_line, tokens[0]))
+            yield {'type': ':RAW', 'raw': line.rstrip('\r\n'), 'Line': first_line, 'Lines': 1}
+            continue
+
+        try:
+            record = parse_record(tokens, starts_with_name, origin, last_name, default_ttl or last_ttl)
+        except (ZoneFileError, ValueError, IndexError), err:
+            raise ZoneFileError('Line %s: %s' % (first_line, err or 'incomplete record'))
+
+        record['Line'] = first_line
+        record['Lines'] = number - first_line + 1
+        yield record
+        last_name = record['name']
+        last_ttl = record['ttl']
+
+    if depth:
+        raise ZoneFileError('Line %s: record is not closed' % first_line)
+
+
+def parse_record(tokens, starts_with_name, origin, last_name, default_ttl):
+    """
+    Parses tokens of one resource record ([name] [ttl] [class] type data)
+
+    Returns:
+        dict: record
+    """
+    tokens = list(tokens)
+    name = last_name
+    if starts_with_name:
+        name = absolute_name(tokens.pop(0), origin)
+
+    ttl, record_class = default_ttl, 'IN'
+    while tokens:
+        if tokens[0].upper() in CLASSES:
+            record_class = tokens.pop(0).upper()
+        elif parse_ttl(tokens[0]) is not None:
+            ttl = parse_ttl(tokens.pop(0))
+        else:
+            break
+
+    record_type = tokens.pop(0).upper()
+    record = {'name': name, 'class': record_class, 'ttl': ttl, 'type': record_type}
+
+    if record_type in ('TXT', 'SPF'):
+        record['txtdata'] = ''.join(unquote(token) for token in tokens)
+        return record
+
+    fields = DATA_FIELDS.get(record_type)
+    if not fields:
+        record['unknowndata'] = ' '.join(tokens)
+        return record
+
+    if len(tokens) < len(fields):
+        raise ZoneFileError('%s record has %s data fields, %s expected' % (record_type, len(tokens), len(fields)))
+
+    for field, token in zip(fields, tokens):
+        if field in NAME_FIELDS:
+            token = absolute_name(token, origin).rstrip('.')
+        elif field in INTEGER_FIELDS:
+            token = int(token)
+        else:
+            token = unquote(token)
+        record[field] = token
+    if record_type == 'SOA' and record['ttl'] is None:
+        record['ttl'] = record['minimum']
+
+    return record
+
+
+def read_zone_file(path, origin):
+    """
+    Returns:
+        tuple: (records, None) or (None, error message) if the zone file can't be read or parsed
+    """
+    try:
+        f = open(path)
+        try:
+            return parse_zone(f, origin), None
+        finally:
+            f.close()
+    except (IOError, OSError), err:
+        return None, 'unable to read %s: %s' % (path, err.strerror)
+    except ZoneFileError, err:
+        return None, 'unable to parse %s: %s' % (path, err)
+
+
+def read_zone_serial(path, origin):
+    """
+    Reads the zone file only up to its SOA record
+
+    Returns:
+        str: SOA serial, None if the zone file can't be read or parsed up to the SOA record
+    """
+    try:
+        f = open(path)
+        try:
+            for record in iter_zone(f, origin):
+                if record['type'] == 'SOA':
+                    return str(record['serial'])
+        finally:
+            f.close()
+    except (IOError, OSError, ZoneFileError):
+        pass
+
+    return None
+
+
+def _read_zone(args):
+    # pool worker function, module level so it can be pickled
+    domain, path = args
+
+    return (domain,) + read_zone_file(path, domain)
+
+
+class ZoneFileReader(object):
+    """
+    Reads zones from BIND zone files (/var/named/<domain>.db on cPanel servers) instead of dumping them
+    through the API. Many zones are parsed by a pool of worker processes, in batches.
+
+    Usage:
+        reader = ZoneFileReader('/var/named')
+        records, error = reader.read('domain.tld')
+        serial = reader.read_serial('domain.tld')
+        for domain, records, error in reader.read_many(domains):
+            ...
+    """
+
+    def __init__(self, zone_dir, workers=None, batch_size=200):
+        self.zone_dir = zone_dir
+        if not workers:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def path(self, domain):
+        return os.path.join(self.zone_dir, '%s.db' % domain)
+
+    def read(self, domain):
+        """
+        Returns:
+            tuple: (records, None) or (None, error message), see read_zone_file()
+        """
+        return read_zone_file(self.path(domain), domain)
+
+    def read_serial(self, domain):
+        """
+        Returns:
+            str: SOA serial of the zone, None if it can't be read, see read_zone_serial()
+        """
+        return read_zone_serial(self.path(domain), domain)
+
+    def read_many(self, domains):
+        """
+        Reads zones of all domains, parsed in a pool of worker processes when there is more than one batch.
+        Next batch is parsed while the results of the current one are used, so only two batches of zones are
+        kept in memory.
+
+        Arguments:
+            domains: list of domains
+
+        Returns:
+            generator: (domain, records, error) tuples in the same order as domains, see read_zone_file()
+        """
+        items = [(domain, self.path(domain)) for domain in domains]
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        if self.workers == 1 or len(batches) < 2:
+            for item in items:
+                yield _read_zone(item)
+            return
+
+        from multiprocessing import Pool
+        pool = Pool(min(self.workers, len(batches)))
+        try:
+            pending = pool.map_async(_read_zone, batches[0])
+            for batch in batches[1:] + [None]:
+                results = pending.get()
+                if batch:
+                    pending = pool.map_async(_read_zone, batch)
+                for result in results:
+                    yield result
+            pool.close()
+        finally:
+            # stops workers also when the generator isn't read to the end
+            pool.terminate()
+            pool.join()